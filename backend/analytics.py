@@ -0,0 +1,213 @@
+# Métriques Prometheus/OpenMetrics exposées sur /metrics : requêtes HTTP par route, appels LLM et embeddings
+# (latence, tokens, erreurs par fournisseur/modèle), caches, pool de connexions DB, pools d'exécution et ingestion.
+import os
+import time
+import logging
+from contextlib import contextmanager
+from typing import Optional
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+except Exception:
+    REGISTRY = None
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes") and REGISTRY is not None
+
+# Seconds; requests range from cached answers (ms) to long LLM completions and uploads
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+if METRICS_ENABLED:
+    HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+    HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency (until response headers for streams)", ["method", "route"], buckets=_LATENCY_BUCKETS)
+    HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being handled")
+    LLM_REQUESTS = Counter("llm_requests_total", "LLM calls (each retry counts)", ["provider", "model", "outcome"])
+    LLM_LATENCY = Histogram("llm_request_duration_seconds", "LLM call latency", ["provider", "model"], buckets=_LATENCY_BUCKETS)
+    LLM_TTFT = Histogram("llm_time_to_first_token_seconds", "Streamed LLM calls: time to the first token", ["provider", "model"], buckets=_LATENCY_BUCKETS)
+    LLM_TOKENS = Counter("llm_tokens_total", "Tokens reported by the LLM API", ["provider", "model", "kind"])
+    EMBEDDING_REQUESTS = Counter("embedding_requests_total", "Embedding API calls", ["model", "kind", "outcome"])
+    EMBEDDING_INPUTS = Counter("embedding_inputs_total", "Texts sent to the embedding API", ["model", "kind"])
+    EMBEDDING_LATENCY = Histogram("embedding_request_duration_seconds", "Embedding API call latency", ["model", "kind"], buckets=_LATENCY_BUCKETS)
+    DB_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection", buckets=_WAIT_BUCKETS)
+
+
+@contextmanager
+def track_llm(provider: str, model: str):
+    """Time one LLM call and count it as ok/error."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        if METRICS_ENABLED:
+            LLM_REQUESTS.labels(provider, model or "", outcome).inc()
+            LLM_LATENCY.labels(provider, model or "").observe(time.perf_counter() - start)
+
+
+def record_llm_tokens(provider: str, model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    if not METRICS_ENABLED:
+        return
+    if prompt_tokens:
+        LLM_TOKENS.labels(provider, model or "", "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(provider, model or "", "completion").inc(completion_tokens)
+
+
+def record_llm_usage(provider: str, model: str, usage):
+    """Token counts of an OpenAI `usage` object (prompt_tokens / completion_tokens)."""
+    if usage is not None:
+        record_llm_tokens(provider, model, getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None))
+
+
+def record_gemini_usage(model: str, response_json: dict):
+    """Token counts of a Vertex generateContent response (usageMetadata)."""
+    usage = (response_json or {}).get("usageMetadata") or {}
+    record_llm_tokens("vertex", model, usage.get("promptTokenCount"), usage.get("candidatesTokenCount"))
+
+
+def record_llm_ttft(provider: str, model: str, seconds: float):
+    if METRICS_ENABLED:
+        LLM_TTFT.labels(provider, model or "").observe(seconds)
+
+
+@contextmanager
+def track_embedding(model: str, kind: str, inputs: int = 1):
+    """Time one embedding call; kind is 'query' (request path) or 'batch' (ingestion, backfill)."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        if METRICS_ENABLED:
+            EMBEDDING_REQUESTS.labels(model, kind, outcome).inc()
+            EMBEDDING_INPUTS.labels(model, kind).inc(inputs)
+            EMBEDDING_LATENCY.labels(model, kind).observe(time.perf_counter() - start)
+
+
+def observe_http(method: str, route: str, status: int, seconds: float):
+    if METRICS_ENABLED:
+        HTTP_REQUESTS.labels(method, route, str(status)).inc()
+        HTTP_LATENCY.labels(method, route).observe(seconds)
+
+
+@contextmanager
+def http_in_progress():
+    if not METRICS_ENABLED:
+        yield
+        return
+    HTTP_IN_PROGRESS.inc()
+    try:
+        yield
+    finally:
+        HTTP_IN_PROGRESS.dec()
+
+
+def instrument_engine(engine):
+    """Measure how long sessions wait for a connection from the engine's pool (see database.PoolWaitStats)."""
+    if not METRICS_ENABLED:
+        return
+    from database import add_checkout_observer
+    add_checkout_observer(engine, DB_CHECKOUT_WAIT.observe)
+
+
+class _StatsCollector:
+    """Exports, at scrape time, the counters the other modules already keep for /debug/*."""
+
+    def __init__(self, engine=None):
+        self.engine = engine
+
+    def collect(self):
+        for section in (self._cache_metrics, self._pool_metrics, self._db_pool_metrics, self._stage_metrics):
+            try:
+                # Materialized first so that one failing section does not cut the scrape short
+                yield from list(section())
+            except Exception as e:
+                logger.warning(f"Metrics collection failed in {section.__name__}: {e}")
+
+    def _cache_metrics(self):
+        import redis_cache
+        import semantic_cache
+        lookups = CounterMetricFamily("cache_lookups", "Cache lookups", labels=["cache", "result"])
+        hit_rate = GaugeMetricFamily("cache_hit_ratio", "Cache hit ratio since process start", labels=["cache"])
+        stats = redis_cache.cache_stats()
+        for namespace in redis_cache.NAMESPACES:
+            lookups.add_metric([namespace, "hit"], stats[namespace]["hits"])
+            lookups.add_metric([namespace, "miss"], stats[namespace]["misses"])
+            hit_rate.add_metric([namespace], stats[namespace]["hit_rate"])
+        semantic = semantic_cache.stats()
+        lookups.add_metric(["semantic", "hit"], semantic["hits"])
+        lookups.add_metric(["semantic", "miss"], semantic["misses"])
+        hit_rate.add_metric(["semantic"], semantic["hit_rate"])
+        yield lookups
+        yield hit_rate
+        yield CounterMetricFamily("cache_redis_errors", "Redis errors (local fallback used)", value=stats["redis_errors"])
+        yield CounterMetricFamily("semantic_cache_saved_tokens", "Tokens not sent to the model thanks to semantic hits", value=semantic["saved_tokens"])
+
+    def _pool_metrics(self):
+        from executors import executor_stats
+        active = GaugeMetricFamily("executor_active", "Tasks running in the pool", labels=["pool"])
+        queued = GaugeMetricFamily("executor_queued", "Tasks waiting for a worker (ingest: ingestion queue depth)", labels=["pool"])
+        utilization = GaugeMetricFamily("executor_utilization", "Active tasks / workers", labels=["pool"])
+        rejected = CounterMetricFamily("executor_rejected", "Tasks rejected because the pool queue was full", labels=["pool"])
+        in_flight = GaugeMetricFamily("llm_requests_in_flight", "LLM requests in flight on the shared connection pools", labels=["provider"])
+        for name, stats in executor_stats().items():
+            if name == "llm":
+                for provider, provider_stats in stats.items():
+                    if isinstance(provider_stats, dict) and "in_flight" in provider_stats:
+                        in_flight.add_metric([provider], provider_stats["in_flight"])
+                continue
+            if not isinstance(stats, dict) or "active" not in stats:
+                continue
+            active.add_metric([name], stats["active"])
+            queued.add_metric([name], stats["queued"])
+            utilization.add_metric([name], stats["utilization"])
+            rejected.add_metric([name], stats.get("rejected", 0))
+        yield from (active, queued, utilization, rejected, in_flight)
+
+    def _db_pool_metrics(self):
+        if self.engine is None:
+            return
+        from database import pool_stats
+        stats = pool_stats(self.engine)
+        yield CounterMetricFamily("db_pool_checkout_timeouts", "Checkouts that gave up after DB_POOL_TIMEOUT", value=stats["timeouts"])
+        if "size" not in stats:
+            return
+        yield GaugeMetricFamily("db_pool_size", "Configured pool size", value=stats["size"])
+        yield GaugeMetricFamily("db_pool_checked_out", "Connections in use", value=stats["checked_out"])
+        yield GaugeMetricFamily("db_pool_overflow", "Connections opened beyond pool_size", value=stats["overflow"])
+
+    def _stage_metrics(self):
+        import request_trace
+        family = HistogramMetricFamily("rag_stage_duration_seconds", "Answer pipeline stage latency (see /debug/latency)", labels=["pipeline", "stage"])
+        for pipeline, stages in request_trace.latency_stats().items():
+            for stage, snapshot in stages.items():
+                buckets = [(str(float(bound) / 1000), count) for bound, count in snapshot["buckets"].items() if bound != "+Inf"]
+                buckets.append(("+Inf", snapshot["count"]))
+                family.add_metric([pipeline, stage], buckets, snapshot["sum_ms"] / 1000)
+        yield family
+
+
+_collector_registered = False
+
+
+def register_collectors(engine=None):
+    """Register the scrape-time collector once (app startup)."""
+    global _collector_registered
+    if not METRICS_ENABLED or _collector_registered:
+        return
+    REGISTRY.register(_StatsCollector(engine))
+    if engine is not None:
+        instrument_engine(engine)
+    _collector_registered = True
+
+
+def render() -> Optional[tuple]:
+    """(body, content type) for /metrics, or None when prometheus_client is unavailable/disabled."""
+    if not METRICS_ENABLED:
+        return None
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
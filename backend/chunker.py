@@ -0,0 +1,230 @@
+# Découpage en chunks par nombre de tokens (tiktoken, cl100k_base comme les embeddings) sans NLTK : phrases
+# découpées par regex, recouvrement en phrases entières mesuré en tokens, titres et tableaux traités
+# structurellement (un titre ouvre un chunk, un tableau n'est coupé qu'entre deux lignes et garde son en-tête).
+import os
+import re
+import logging
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, NamedTuple
+
+import token_counter
+from token_counter import CHARS_PER_TOKEN_ESTIMATE, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# tokens (default chunker) | legacy (file_loader.chunk_text: NLTK, characters)
+CHUNKER = os.getenv("CHUNKER", "tokens").lower()
+# Target chunk size and overlap with the previous chunk, in tokens of CHUNK_ENCODING
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+CHUNK_ENCODING = os.getenv("CHUNK_ENCODING", "cl100k_base")
+# Threads counting tokens (the BPE releases the GIL); 1 = in the calling thread
+CHUNK_TOKEN_THREADS = int(os.getenv("CHUNK_TOKEN_THREADS", str(min(8, os.cpu_count() or 1))))
+# Below this many units, counting is not split across threads
+_MIN_UNITS_PER_THREAD = 2000
+
+HEADING, ROW, SENTENCE = "heading", "row", "sentence"
+# A heading closes the current chunk once it holds at least 1/MIN_SECTION_FRACTION of max_tokens
+MIN_SECTION_FRACTION = 4
+
+# Markdown heading, or a short numbered title ("2.1 Tarifs", "III. Résiliation") without final punctuation
+_HEADING_RE = re.compile(r"^(#{1,6}\s+\S.*|(?:\d+(?:\.\d+)+\.?|\d+[.)]|[IVXLC]+[.)])\s+[^\W\d_][^.;:,!?]{0,60}[^.;:,!?])$")
+_TABLE_RE = re.compile(r"^\s*\|.*\|\s*$")
+# Not ends of sentence: "M. Dupont", "cf. p. 12", "J. R. R. Tolkien"
+_ABBREVIATIONS = ("M", "MM", "Mme", "Mlle", "Dr", "Pr", "Me", "St", "Ste", "art", "Art", "cf", "Cf", "p", "pp",
+                  "n°", "no", "No", "vol", "chap", "fig", "env", "ex", "av", "bd")
+# End of sentence: punctuation (not after an abbreviation or an initial) and an optional closing quote / bracket,
+# kept with the sentence (group 1), whitespace, then an upper-case letter, digit or opening quote
+_SENTENCE_END_RE = re.compile(
+    r"([.!?…]"
+    + "".join(rf"(?<!\b{re.escape(a)}\.)" for a in _ABBREVIATIONS)
+    + r"(?<!\b[A-ZÀ-Þ]\.)"
+    + r"\s?[\"'»)\]]*)\s+(?=[«\"'(\[]?[A-ZÀ-ÖØ-Þ0-9])"
+)
+_HEADING_START = frozenset("#0123456789IVXLC")
+
+
+class Unit(NamedTuple):
+    """Smallest piece a chunk is made of; `sep` is the text that precedes it in the document."""
+    kind: str
+    text: str
+    sep: str
+    tokens: int
+
+
+def _encoding():
+    # Same encodings and offline estimate as the embedding truncation and prompt budgeting
+    return token_counter.get_encoding(CHUNK_ENCODING)
+
+
+@lru_cache(maxsize=1)
+def _count_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=CHUNK_TOKEN_THREADS, thread_name_prefix="chunk-tokens")
+
+
+def _count_slice(encode, texts: List[str]) -> List[int]:
+    return [len(encode(text)) for text in texts]
+
+
+def _count_tokens(texts: List[str]) -> List[int]:
+    encoding = _encoding()
+    if encoding is None:
+        return [estimate_tokens(text) for text in texts]
+    # One task per slice of units: encode_ordinary_batch submits one future per text, which costs more than the
+    # BPE itself on sentences and table rows
+    threads = min(CHUNK_TOKEN_THREADS, len(texts) // _MIN_UNITS_PER_THREAD)
+    if threads <= 1:
+        return _count_slice(encoding.encode_ordinary, texts)
+    step = -(-len(texts) // threads)
+    slices = _count_pool().map(_count_slice, [encoding.encode_ordinary] * threads,
+                               [texts[i:i + step] for i in range(0, len(texts), step)])
+    return [count for counts in slices for count in counts]
+
+
+def split_sentences(paragraph: str) -> List[str]:
+    """Split a paragraph into sentences with a regex (no model to load)."""
+    parts = _SENTENCE_END_RE.split(paragraph)
+    # [sentence, closing, sentence, closing, ..., sentence]
+    sentences = [sentence + closing.strip() for sentence, closing in zip(parts[0::2], parts[1::2])]
+    sentences.append(parts[-1])
+    return [sentence for sentence in sentences if sentence.strip()]
+
+
+def _split_long(text: str, max_tokens: int) -> List[str]:
+    """Cut a unit longer than max_tokens into windows of max_tokens (a sentence without punctuation, a huge row)."""
+    encoding = _encoding()
+    if encoding is None:
+        step = max_tokens * CHARS_PER_TOKEN_ESTIMATE
+        return [text[i:i + step] for i in range(0, len(text), step)]
+    tokens = encoding.encode_ordinary(text)
+    return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+
+def _units(text: str, max_tokens: int) -> List[Unit]:
+    """Headings, table rows and sentences of a text, in order, with their token counts."""
+    kinds, texts, seps = [], [], []
+    sep = ""
+    paragraph: List[str] = []
+
+    def flush_paragraph():
+        nonlocal sep
+        if paragraph:
+            for i, sentence in enumerate(split_sentences(" ".join(paragraph))):
+                kinds.append(SENTENCE)
+                texts.append(sentence)
+                seps.append(sep if i == 0 else " ")
+            paragraph.clear()
+            sep = "\n"
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            flush_paragraph()
+            if texts:
+                sep = "\n\n"
+            continue
+        if "\t" in line or (stripped[0] == "|" and _TABLE_RE.search(line)):
+            flush_paragraph()
+            kinds.append(ROW)
+            texts.append(line.rstrip())
+            seps.append(sep)
+            sep = "\n"
+        elif len(stripped) <= 120 and ((stripped[0] in _HEADING_START and _HEADING_RE.match(stripped))
+                                       or (len(stripped) > 3 and stripped.isupper())):
+            flush_paragraph()
+            kinds.append(HEADING)
+            texts.append(stripped)
+            seps.append(sep)
+            sep = "\n"
+        else:
+            paragraph.append(stripped)
+    flush_paragraph()
+
+    counts = _count_tokens(texts)
+    units = list(map(Unit._make, zip(kinds, texts, seps, counts)))
+    if counts and max(counts) > max_tokens:
+        split = []
+        for unit in units:
+            if unit.tokens <= max_tokens:
+                split.append(unit)
+                continue
+            for i, part in enumerate(_split_long(unit.text, max_tokens)):
+                split.append(Unit(unit.kind, part, unit.sep if i == 0 else " ", max_tokens))
+        units = split
+    return units
+
+
+def _join(units: List[Unit]) -> str:
+    return "".join([units[0].text] + [unit.sep + unit.text for unit in units[1:]]).strip()
+
+
+def _breaks_before(unit: Unit, tokens: int, max_tokens: int) -> bool:
+    if unit.kind == HEADING:
+        # A new section starts a new chunk, unless the current one is still small (numbered lists, short sections)
+        return tokens >= max_tokens // MIN_SECTION_FRACTION
+    return tokens + unit.tokens > max_tokens
+
+
+def chunk_segments(segments: Iterable[str], max_tokens: int = CHUNK_MAX_TOKENS,
+                   overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+    """Yield chunks of at most ~max_tokens tokens from text segments (pages, blocks of rows...), as they arrive.
+
+    Chunks break at headings and between table rows (a table continued in the next chunk repeats its header
+    row); elsewhere they break between sentences, and start with the last whole sentences of the previous
+    chunk, up to overlap_tokens tokens, so that context_packer.join_chunks can remove the repeated text.
+    """
+    if CHUNKER == "legacy":
+        from file_loader import chunk_pages
+        yield from chunk_pages(segments)
+        return
+    current: List[Unit] = []
+    tokens = 0
+    carried = 0  # leading units of `current` repeated from the previous chunk
+    table_header = None
+
+    for segment in segments:
+        if not segment or not segment.strip():
+            continue
+        for i, unit in enumerate(_units(segment, max_tokens)):
+            if i == 0 and current:
+                # A segment boundary is a paragraph boundary, except inside a table (blocks of spreadsheet rows)
+                unit = unit._replace(sep="\n" if unit.kind == ROW and current[-1].kind == ROW else "\n\n")
+            if unit.kind == ROW:
+                if table_header is None or unit.sep.startswith("\n\n"):
+                    table_header = unit
+            else:
+                table_header = None
+            if len(current) > carried and (tokens + unit.tokens > max_tokens or unit.kind == HEADING) \
+                    and _breaks_before(unit, tokens, max_tokens):
+                # A heading is never the last line of a chunk: it moves to the next one with its section
+                headings = []
+                while len(current) > carried + 1 and current[-1].kind == HEADING:
+                    headings.insert(0, current.pop())
+                yield _join(current)
+                carried_units = []
+                if headings:
+                    carried_units = headings
+                elif unit.kind == ROW and table_header is not None and table_header is not unit:
+                    carried_units = [table_header]
+                elif unit.kind == SENTENCE and current[-1].kind == SENTENCE:
+                    overlap = 0
+                    for previous in reversed(current[carried:]):
+                        if previous.kind != SENTENCE or overlap + previous.tokens > overlap_tokens:
+                            break
+                        overlap += previous.tokens
+                        carried_units.insert(0, previous)
+                    if overlap + unit.tokens > max_tokens:
+                        carried_units = []
+                current = carried_units
+                carried = 0 if headings else len(current)
+                tokens = sum(u.tokens for u in current)
+            current.append(unit)
+            tokens += unit.tokens
+    if len(current) > carried:
+        yield _join(current)
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """Chunks of a whole text (see chunk_segments)."""
+    return list(chunk_segments([text], max_tokens, overlap_tokens))
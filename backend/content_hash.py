@@ -0,0 +1,25 @@
+# Empreintes SHA-256 du contenu : octets bruts des fichiers (Document.content_hash, nom de l'objet GCS) et texte
+# normalisé des chunks (DocumentChunk.text_hash), pour dédoublonner les uploads, réutiliser les embeddings des
+# chunks identiques et regrouper les résultats de recherche en double.
+import hashlib
+import unicodedata
+from typing import List
+
+
+def content_hash(content: bytes) -> str:
+    """Hex SHA-256 of raw bytes."""
+    return hashlib.sha256(content or b"").hexdigest()
+
+
+def normalize_chunk_text(text: str) -> str:
+    """Canonical form of a chunk for hashing: unicode NFC, whitespace runs collapsed (case is kept, it reaches the embedding)."""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def text_hash(text: str) -> str:
+    """Hex SHA-256 of the normalized chunk text."""
+    return hashlib.sha256(normalize_chunk_text(text).encode("utf-8")).hexdigest()
+
+
+def text_hashes(texts: List[str]) -> List[str]:
+    return [text_hash(text) for text in texts]
@@ -0,0 +1,128 @@
+# Assemblage du contexte RAG sous budget de tokens : comptage tiktoken par segment, dédoublonnage du
+# recouvrement entre chunks consécutifs, sélection des meilleurs extraits dans le budget du modèle.
+import os
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import token_counter
+
+# Hard cap on retrieved context per request, whatever the model's window (latency and cost)
+RAG_CONTEXT_MAX_TOKENS = int(os.getenv("RAG_CONTEXT_MAX_TOKENS", "6000"))
+# Safety margin on top of the completion tokens (chat message framing, tokenizer differences)
+RAG_CONTEXT_RESERVED_TOKENS = int(os.getenv("RAG_CONTEXT_RESERVED_TOKENS", "256"))
+# A truncated extract shorter than this is not worth including
+MIN_SEGMENT_TOKENS = 64
+# "--- Extraits du document '...' ---" / "Extrait n: " framing around each extract
+SEGMENT_OVERHEAD_TOKENS = 12
+# Chunks start with the end of the previous one (chunker: whole sentences up to CHUNK_OVERLAP_TOKENS,
+# legacy file_loader.chunk_text: its last 200 characters)
+MAX_CHUNK_OVERLAP = 400
+MIN_CHUNK_OVERLAP = 20
+
+# Context windows by model prefix (first match wins; fine-tuned "ft:" ids use their base model)
+_CONTEXT_WINDOWS = (
+    ("gpt-4.1", 1_000_000),
+    ("gpt-4o", 128_000),
+    ("gpt-4-turbo", 128_000),
+    ("gpt-4-1106", 128_000),
+    ("gpt-4-0125", 128_000),
+    ("gpt-4-32k", 32_768),
+    ("gpt-4", 8_192),
+    ("gpt-3.5-turbo", 16_385),
+    ("o1", 128_000),
+    ("o3", 200_000),
+    ("o4", 200_000),
+    ("gemini", 1_000_000),
+)
+_DEFAULT_WINDOW = 8_192
+
+
+def _base_model(model: Optional[str]) -> str:
+    model = (model or "").lower()
+    for prefix in ("gemini:", "ft:", "perplexity:"):
+        if model.startswith(prefix):
+            model = ("gemini-" if prefix == "gemini:" else "") + model[len(prefix):]
+    return model
+
+
+def context_window(model: Optional[str]) -> int:
+    base = _base_model(model)
+    for prefix, window in _CONTEXT_WINDOWS:
+        if base.startswith(prefix):
+            return window
+    return _DEFAULT_WINDOW
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    # Same counter as the embedding truncation (token_counter), on the base model of fine-tuned / prefixed ids
+    return token_counter.count_tokens(text, _base_model(model))
+
+
+def _truncate(text: str, max_tokens: int, model: Optional[str]) -> str:
+    return token_counter.truncate(text, max_tokens, _base_model(model))[0]
+
+
+def join_chunks(texts: List[str]) -> str:
+    """Concatenate consecutive chunks of a document, dropping the text repeated at each boundary."""
+    parts = []
+    previous = ""
+    for text in texts:
+        if previous:
+            text = text[_overlap_length(previous, text):].lstrip()
+        if text:
+            parts.append(text)
+            previous = text if len(text) >= MAX_CHUNK_OVERLAP else (previous + " " + text)[-MAX_CHUNK_OVERLAP:]
+    return "\n".join(parts)
+
+
+def _overlap_length(previous: str, text: str) -> int:
+    """Length of the longest prefix of `text` that is also a suffix of `previous`."""
+    tail = previous[-MAX_CHUNK_OVERLAP:]
+    probe = text[:MIN_CHUNK_OVERLAP]
+    if len(probe) < MIN_CHUNK_OVERLAP:
+        return 0
+    start = tail.find(probe)
+    while start != -1:
+        if text.startswith(tail[start:]):
+            return len(tail) - start
+        start = tail.find(probe, start + 1)
+    return 0
+
+
+def context_budget(model: Optional[str], fixed_tokens: int, completion_tokens: int = 0) -> int:
+    """Tokens left for retrieved extracts once the fixed prompt parts and the completion are reserved."""
+    available = context_window(model) - fixed_tokens - completion_tokens - RAG_CONTEXT_RESERVED_TOKENS
+    return max(0, min(RAG_CONTEXT_MAX_TOKENS, available))
+
+
+def pack_context(results: List[dict], budget: int, model: Optional[str] = None) -> Tuple[List[dict], Dict[str, int]]:
+    """Keep the best results (in the given order, best first) that fit in `budget` tokens.
+
+    Identical extracts are kept once; an extract that does not fit is truncated if enough room is
+    left, otherwise skipped so that smaller ones further down can still be used.
+    """
+    packed = []
+    seen = set()
+    used = 0
+    report = {"budget": budget, "candidates": len(results), "packed": 0, "dropped": 0, "truncated": 0, "duplicates": 0}
+    for result in results:
+        text = (result.get("text") or "").strip()
+        digest = hashlib.sha1(" ".join(text.lower().split()).encode("utf-8")).hexdigest()
+        if not text or digest in seen:
+            report["duplicates"] += 1
+            continue
+        seen.add(digest)
+        tokens = count_tokens(text, model) + SEGMENT_OVERHEAD_TOKENS
+        remaining = budget - used
+        if tokens > remaining:
+            if remaining - SEGMENT_OVERHEAD_TOKENS < MIN_SEGMENT_TOKENS:
+                report["dropped"] += 1
+                continue
+            text = _truncate(text, remaining - SEGMENT_OVERHEAD_TOKENS, model)
+            tokens = remaining
+            report["truncated"] += 1
+        packed.append(dict(result, text=text, tokens=tokens))
+        used += tokens
+    report["packed"] = len(packed)
+    report["context_tokens"] = used
+    return packed, report
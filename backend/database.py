@@ -1,12 +1,17 @@
 import os
+import time
 import logging
+import threading
 from typing import List, Optional
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Boolean, LargeBinary
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, Index
 from datetime import datetime
 
+from config import config
+
 # Configuration logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -75,13 +80,14 @@ class Agent(Base):
     type = Column(String(32), nullable=False, default="conversationnel")
 
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    embedding = Column(Text, nullable=True)  # Embedding du contexte (JSON ou array)
+    embedding = Column(Text, nullable=True)  # Embedding du contexte (JSON, ancien format)
+    embedding_vec = Column(LargeBinary, nullable=True)  # Embedding du contexte (binaire, voir embedding_codec)
 
     created_at = Column(DateTime, default=datetime.utcnow)
     finetuned_model_id = Column(String(255), nullable=True)  # ID du modèle OpenAI fine-tuné
     slack_bot_token = Column(String(255), nullable=True)  # Token du bot Slack associé à l'agent
-    slack_team_id = Column(String(64), nullable=True)  # ID du workspace Slack associé à l'agent
-    slack_bot_user_id = Column(String(64), nullable=True)  # Bot user ID (ex: U123ABC) pour identifier le bot dans une team
+    slack_team_id = Column(String(64), nullable=True, index=True)  # ID du workspace Slack associé à l'agent
+    slack_bot_user_id = Column(String(64), nullable=True, index=True)  # Bot user ID (ex: U123ABC) pour identifier le bot dans une team
 
     # Relations
     owner = relationship("User", back_populates="agents")
@@ -94,9 +100,10 @@ class Document(Base):
     filename = Column(String(255), nullable=False)
     content = Column(Text)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    agent_id = Column(Integer, ForeignKey("agents.id"), nullable=True)  # Documents peuvent être liés à un agent spécifique
+    agent_id = Column(Integer, ForeignKey("agents.id"), nullable=True, index=True)  # Documents peuvent être liés à un agent spécifique
     created_at = Column(DateTime, default=datetime.utcnow)
     gcs_url = Column(String(512), nullable=True)  # URL du fichier dans le bucket GCS
+    content_hash = Column(String(64), nullable=True, index=True)  # SHA-256 du fichier brut (voir content_hash.py)
 
     # Relations
     owner = relationship("User", back_populates="documents")
@@ -110,13 +117,20 @@ class DocumentChunk(Base):
     id = Column(Integer, primary_key=True, index=True)
     document_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
     chunk_text = Column(Text, nullable=False)
-    embedding = Column(Text)  # JSON string of embedding vector
+    embedding = Column(Text)  # JSON string of embedding vector (legacy, see migrate_embeddings_to_binary.py)
+    embedding_vec = Column(LargeBinary, nullable=True)  # Binary embedding (see embedding_codec)
     chunk_index = Column(Integer, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # SHA-256 of the normalized text: identical chunks share their embedding and collapse in retrieval
+    text_hash = Column(String(64), nullable=True, index=True)
     
     # Relation avec le document
     document = relationship("Document", back_populates="chunks")
 
+    # Neighbour windows of retrieval hits are fetched by (document_id, chunk_index range); the leading
+    # document_id column also serves the plain document_id filters and joins
+    __table_args__ = (Index("ix_document_chunks_document_id_chunk_index", "document_id", "chunk_index"),)
+
 
 class AgentAction(Base):
     __tablename__ = "agent_actions"
@@ -148,18 +162,192 @@ class Team(Base):
 
     user = relationship("User")
 
+
+class IngestionJob(Base):
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String(36), primary_key=True)  # uuid4 hex, returned by the upload endpoints
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    agent_id = Column(Integer, ForeignKey("agents.id"), nullable=True)
+    filename = Column(String(255), nullable=False)
+    source = Column(String(16), nullable=False, default="file")  # 'file' | 'url'
+    spool_path = Column(String(512), nullable=True)  # raw upload (or URL) persisted until processed
+    # status: 'queued' | 'running' | 'done' | 'failed'
+    status = Column(String(16), nullable=False, default="queued", index=True)
+    stage = Column(String(32), nullable=True)  # current stage: fetch / extract / store / chunk / embed / index
+    stage_timings = Column(Text, nullable=True)  # JSON {stage: seconds}
+    document_id = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # Heartbeat: bumped on every update of the job (stage changes) and periodically while it is
+    # queued or running on an instance; staleness is measured from it (ingestion_jobs._is_stale)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class SemanticCacheEntry(Base):
+    __tablename__ = "semantic_cache_entries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    agent_id = Column(Integer, ForeignKey("agents.id"), nullable=False, index=True)
+    question = Column(Text, nullable=False)
+    question_embedding = Column(LargeBinary, nullable=False)  # see embedding_codec
+    answer = Column(Text, nullable=False)
+    model_id = Column(String(255), nullable=True)
+    corpus_version = Column(String(64), nullable=False)  # semantic_cache.corpus_version() when stored
+    tokens = Column(Integer, nullable=False, default=0)  # prompt + completion tokens of the original call
+    hits = Column(Integer, nullable=False, default=0)
+    pinned = Column(Boolean, nullable=False, default=False)  # served even after corpus changes, never evicted
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_hit_at = Column(DateTime, nullable=True)
+
+class PoolWaitStats:
+    """Checkout counters of an engine's pool: time spent waiting for a connection, timeouts."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.observers = []  # callables(seconds), e.g. the Prometheus histogram of analytics.py
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, ok: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += 0 if ok else 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+        for observer in self.observers:
+            try:
+                observer(seconds)
+            except Exception:
+                pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.wait_seconds / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+            }
+
+
+def _instrument_pool(pool) -> PoolWaitStats:
+    """Time every checkout that goes through the pool queue (QueuePool and its async adaptation)."""
+    stats = getattr(pool, "_wait_stats", None)
+    if stats is not None:
+        return stats
+    stats = PoolWaitStats()
+    pool._wait_stats = stats
+    do_get = getattr(pool, "_do_get", None)
+    if do_get is None:
+        return stats
+
+    def timed_do_get():
+        start = time.perf_counter()
+        ok = False
+        try:
+            connection = do_get()
+            ok = True
+            return connection
+        finally:
+            stats.observe(time.perf_counter() - start, ok)
+
+    pool._do_get = timed_do_get
+    return stats
+
+
+def _pool_settings(url) -> dict:
+    """Pool arguments from config.Config (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING)."""
+    settings = {
+        "pool_pre_ping": config.get("database.pool_pre_ping", True),
+        "pool_recycle": config.get("database.pool_recycle", 300),
+        "echo": config.get("database.echo", False),  # DB_ECHO=true for SQL debugging
+    }
+    # In-memory SQLite keeps a single connection per thread: no queue to size
+    if not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+        settings.update(
+            pool_size=config.get("database.pool_size", 5),
+            max_overflow=config.get("database.max_overflow", 10),
+            pool_timeout=config.get("database.pool_timeout", 30),
+        )
+    return settings
+
+
+def create_db_engine(database_url: str = None, **overrides):
+    """Engine with the pool settings of the configuration; keyword arguments override them."""
+    url = make_url(database_url or DATABASE_URL)
+    settings = _pool_settings(url)
+    settings.update(overrides)
+    db_engine = create_engine(url, **settings)
+    _instrument_pool(db_engine.pool)
+    return db_engine
+
+
+def create_async_db_engine(database_url: str = None, **overrides):
+    """asyncpg engine for the same PostgreSQL database, or None (other databases, asyncpg missing)."""
+    url = make_url(database_url or DATABASE_URL)
+    if url.get_backend_name() != "postgresql":
+        return None
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        settings = _pool_settings(url)
+        settings["pool_size"] = config.get("database.async_pool_size", settings.get("pool_size", 5))
+        settings.update(overrides)
+        db_engine = create_async_engine(url.set(drivername="postgresql+asyncpg"), **settings)
+    except Exception as e:
+        logger.warning(f"Async database engine unavailable ({e}); hot read endpoints use the sync pool")
+        return None
+    _instrument_pool(db_engine.sync_engine.pool)
+    return db_engine
+
+
+def add_checkout_observer(db_engine, observer):
+    """Call observer(seconds) after every pool checkout of db_engine (sync or async engine)."""
+    db_engine = getattr(db_engine, "sync_engine", db_engine)
+    _instrument_pool(db_engine.pool).observers.append(observer)
+
+
+def pool_stats(db_engine) -> dict:
+    """Pool usage (size, connections in use, overflow) and checkout waits of an engine."""
+    db_engine = getattr(db_engine, "sync_engine", db_engine)
+    pool = db_engine.pool
+    stats = {"pool": type(pool).__name__}
+    if hasattr(pool, "checkedout"):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(0, pool.overflow()),
+            max_overflow=getattr(pool, "_max_overflow", None),
+            timeout=pool.timeout(),
+        )
+    stats.update(_instrument_pool(pool).snapshot())
+    return stats
+
+
 # Create database engine with connection pooling
-engine = create_engine(
-    DATABASE_URL,
-    pool_size=5,
-    max_overflow=10,
-    pool_pre_ping=True,
-    pool_recycle=300,
-    echo=False  # Set to True for SQL debugging
-)
+engine = create_db_engine()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Hot read endpoints (see read_all) use asyncpg when DB_ASYNC_ENABLED=true
+async_engine = create_async_db_engine() if config.get("database.async_enabled", False) else None
+AsyncSessionLocal = None
+if async_engine is not None:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+    AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+
+
+def db_pool_stats() -> dict:
+    stats = {"sync": pool_stats(engine)}
+    if async_engine is not None:
+        stats["async"] = pool_stats(async_engine)
+    return stats
+
 def get_db():
     """Database dependency for FastAPI"""
     db = SessionLocal()
@@ -168,6 +356,46 @@ def get_db():
     finally:
         db.close()
 
+async def read_all(statement, scalars: bool = False) -> list:
+    """Rows (or entities with scalars=True) of a read-only select, without blocking the event loop.
+
+    Runs on the asyncpg engine when enabled, else on a short-lived session in the blocking thread pool.
+    Returned entities are detached: only their loaded columns may be used.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(statement)
+            return list(result.scalars().all() if scalars else result.all())
+
+    from executors import run_blocking
+
+    def run():
+        with SessionLocal() as session:
+            result = session.execute(statement)
+            return list(result.scalars().all() if scalars else result.all())
+
+    return await run_blocking(run)
+
+
+def release_connection(db: Session):
+    """Give the session's pooled connection back before a long wait (LLM call) instead of holding it idle.
+
+    Ends the read transaction without expiring the loaded objects; the session checks out a connection
+    again on its next query. A session with unflushed changes is left untouched.
+    """
+    if db.new or db.dirty or db.deleted or not db.in_transaction():
+        return
+    expire_on_commit = db.expire_on_commit
+    db.expire_on_commit = False
+    try:
+        db.commit()
+    except Exception as e:
+        logger.warning(f"Could not release the DB connection: {e}")
+        db.rollback()
+    finally:
+        db.expire_on_commit = expire_on_commit
+
+
 def init_db():
     """Initialize database tables"""
     try:
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Backfill des embeddings manquants (chunks enregistrés avec embedding=None)
+
+Peut tourner en CLI (comme update_finetuned_models.py) ou en tâche asyncio dans l'API
+(EMBEDDING_BACKFILL_INTERVAL > 0, voir main.startup_event).
+
+Usage: python embedding_backfill.py [--batch-size 256] [--concurrency 4] [--rpm 500]
+                                    [--document-id ID] [--checkpoint backfill.json] [--resume] [--include-dummy]
+"""
+import sys
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import func, and_, or_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Document, DocumentChunk
+from embedding_codec import encode_embedding
+from content_hash import text_hash
+from openai_client import get_embeddings_batch
+import redis_cache
+
+import retrievers
+
+logger = logging.getLogger(__name__)
+
+# Zero vectors written by older versions of process_document_for_user when an embedding call failed
+_DUMMY_EMBEDDING_PREFIX = "[0.0, 0.0, 0.0, 0.0, 0.0"
+
+
+class RateLimiter:
+    """Thread-safe limiter spacing requests to at most `per_minute` per minute."""
+
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / per_minute if per_minute and per_minute > 0 else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _missing_filter(include_dummy: bool):
+    missing = and_(DocumentChunk.embedding_vec.is_(None), DocumentChunk.embedding.is_(None))
+    if include_dummy:
+        dummy = and_(DocumentChunk.embedding_vec.is_(None), DocumentChunk.embedding.like(_DUMMY_EMBEDDING_PREFIX + "%"))
+        return or_(missing, dummy)
+    return missing
+
+
+def _load_checkpoint(path: Optional[str]) -> dict:
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"last_chunk_id": 0, "documents": {}}
+
+
+def _save_checkpoint(path: Optional[str], state: dict):
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def _pending_per_document(db: Session, include_dummy: bool, after_id: int, document_id: Optional[int]) -> Dict[int, int]:
+    query = db.query(DocumentChunk.document_id, func.count(DocumentChunk.id)).filter(
+        _missing_filter(include_dummy), DocumentChunk.id > after_id
+    )
+    if document_id:
+        query = query.filter(DocumentChunk.document_id == document_id)
+    return {doc_id: count for doc_id, count in query.group_by(DocumentChunk.document_id)}
+
+
+def backfill_missing_embeddings(
+    db: Session,
+    batch_size: int = 256,
+    concurrency: int = 4,
+    requests_per_minute: int = 0,
+    document_id: Optional[int] = None,
+    checkpoint_path: Optional[str] = None,
+    resume: bool = False,
+    include_dummy: bool = False,
+) -> dict:
+    """Embed chunks that have no embedding yet. Returns {"embedded": n, "failed": n, "documents": {...}}.
+
+    Chunks are read in id order, `concurrency` batches at a time; API calls run in worker threads
+    while the DB session is only used from the calling thread. Each round's rows are claimed with
+    SELECT ... FOR UPDATE SKIP LOCKED, so concurrent runs (one loop per API instance) embed disjoint
+    rows. With a checkpoint file the last committed chunk id is persisted after every round so an
+    interrupted run can `resume`. Re-embedded dummy vectors are handed to retrievers.reindex_chunks.
+    """
+    state = _load_checkpoint(checkpoint_path) if resume else {"last_chunk_id": 0, "documents": {}}
+    last_id = int(state.get("last_chunk_id", 0))
+    progress = state.setdefault("documents", {})
+    for doc_id, pending in _pending_per_document(db, include_dummy, last_id, document_id).items():
+        entry = progress.setdefault(str(doc_id), {"done": 0, "failed": 0, "total": 0})
+        entry["total"] = entry["done"] + entry["failed"] + pending
+    total_pending = sum(p["total"] - p["done"] - p["failed"] for p in progress.values())
+    logger.info(f"Embedding backfill: {total_pending} chunks pending in {len(progress)} documents (resume from id {last_id})")
+
+    limiter = RateLimiter(requests_per_minute)
+    embedded = 0
+    failed = 0
+    scopes: Set[Tuple[Optional[int], int]] = set()
+    replaced: Dict[Tuple[Optional[int], int], List[int]] = {}
+
+    def embed(texts: List[str]) -> List[Optional[list]]:
+        limiter.wait()
+        return get_embeddings_batch(texts)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        while True:
+            query = db.query(
+                DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.chunk_text,
+                DocumentChunk.embedding.isnot(None).label("dummy"),
+            ).filter(_missing_filter(include_dummy), DocumentChunk.id > last_id)
+            if document_id:
+                query = query.filter(DocumentChunk.document_id == document_id)
+            # Rows claimed by another instance's backfill are skipped; the locks are held until the commit below
+            rows = query.order_by(DocumentChunk.id).limit(batch_size * max(1, concurrency)).with_for_update(skip_locked=True).all()
+            if not rows:
+                break
+            batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+            results = pool.map(embed, [[r.chunk_text for r in batch] for batch in batches])
+            dummy_ids = {}
+            for batch, embeddings in zip(batches, results):
+                for row, embedding in zip(batch, embeddings):
+                    entry = progress.setdefault(str(row.document_id), {"done": 0, "failed": 0, "total": 0})
+                    if embedding is None:
+                        failed += 1
+                        entry["failed"] += 1
+                        continue
+                    db.query(DocumentChunk).filter(DocumentChunk.id == row.id).update(
+                        {"embedding_vec": encode_embedding(embedding), "embedding": None, "text_hash": text_hash(row.chunk_text)},
+                        synchronize_session=False
+                    )
+                    embedded += 1
+                    entry["done"] += 1
+                    if row.dummy:
+                        dummy_ids.setdefault(int(row.document_id), []).append(row.id)
+            db.commit()
+            last_id = rows[-1].id
+            state["last_chunk_id"] = last_id
+            _save_checkpoint(checkpoint_path, state)
+
+            doc_ids = {int(r.document_id) for r in rows}
+            for doc in db.query(Document.id, Document.agent_id, Document.user_id).filter(Document.id.in_(doc_ids)):
+                scopes.add((doc.agent_id, doc.user_id))
+                replaced.setdefault((doc.agent_id, doc.user_id), []).extend(dummy_ids.get(doc.id, []))
+                entry = progress[str(doc.id)]
+                logger.info(f"Backfill document {doc.id}: {entry['done']}/{entry['total']} embedded, {entry['failed']} failed")
+
+    for agent_id, user_id in scopes:
+        if replaced.get((agent_id, user_id)):
+            # Dummy rows already counted as embedded: the index must replace their vectors, not append
+            retrievers.reindex_chunks(db, replaced[(agent_id, user_id)], agent_id=agent_id, user_id=user_id)
+        else:
+            retrievers.index_new_chunks(db, agent_id=agent_id, user_id=user_id)
+        # Newly embedded chunks can change retrieval results
+        redis_cache.bump_corpus_version(agent_id=agent_id, user_id=user_id)
+    logger.info(f"Embedding backfill finished: {embedded} embedded, {failed} failed")
+    return {"embedded": embedded, "failed": failed, "documents": progress}
+
+
+async def run_backfill_loop(interval_seconds: int, **kwargs):
+    """In-process mode: run a backfill pass every `interval_seconds` without blocking the event loop."""
+    def run_once():
+        db = SessionLocal()
+        try:
+            return backfill_missing_embeddings(db, **kwargs)
+        finally:
+            db.close()
+
+    while True:
+        try:
+            await asyncio.to_thread(run_once)
+        except Exception as e:
+            logger.error(f"Embedding backfill pass failed: {e}")
+        await asyncio.sleep(interval_seconds)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Calcule les embeddings des chunks qui n'en ont pas")
+    parser.add_argument("--batch-size", type=int, default=256, help="Textes par appel embeddings.create")
+    parser.add_argument("--concurrency", type=int, default=4, help="Appels API en parallèle")
+    parser.add_argument("--rpm", type=int, default=0, help="Limite d'appels API par minute (0 = illimité)")
+    parser.add_argument("--document-id", type=int, default=None)
+    parser.add_argument("--checkpoint", default=None, help="Fichier JSON de reprise")
+    parser.add_argument("--resume", action="store_true", help="Reprend depuis le checkpoint")
+    parser.add_argument("--include-dummy", action="store_true", help="Recalcule aussi les vecteurs nuls factices")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        summary = backfill_missing_embeddings(
+            db,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            requests_per_minute=args.rpm,
+            document_id=args.document_id,
+            checkpoint_path=args.checkpoint,
+            resume=args.resume,
+            include_dummy=args.include_dummy,
+        )
+    finally:
+        db.close()
+    print(f"✅ {summary['embedded']} embeddings calculés, {summary['failed']} échecs")
+    if summary["failed"]:
+        sys.exit(1)
@@ -0,0 +1,90 @@
+# Encodage binaire compact des embeddings (float32 / float16 / int8) pour la base
+import os
+import json
+import struct
+from typing import List, Optional, Union
+
+import numpy as np
+from sqlalchemy import or_
+
+# Storage precision for new embeddings: float32 (exact), float16 (half size) or int8 (quarter size)
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+
+# Header: 4-byte little-endian tag (keeps the payload 4-byte aligned for np.frombuffer),
+# followed for int8 by a float32 scale factor.
+_TAG_FLOAT32 = 1
+_TAG_FLOAT16 = 2
+_TAG_INT8 = 3
+_TAGS = {"float32": _TAG_FLOAT32, "float16": _TAG_FLOAT16, "int8": _TAG_INT8}
+_HEADER = struct.Struct("<I")
+_SCALE = struct.Struct("<f")
+
+
+def encode_embedding(vector: Union[List[float], np.ndarray], dtype: str = None, normalize: bool = True) -> bytes:
+    """Serialize an embedding vector to bytes for a BYTEA column.
+
+    Vectors are L2-normalized at ingest by default (cosine is unchanged), so readers can score
+    them with a plain dot product instead of recomputing norms on every query.
+    """
+    dtype = dtype or EMBEDDING_STORAGE_DTYPE
+    if dtype not in _TAGS:
+        raise ValueError(f"Unsupported embedding storage dtype: {dtype}")
+    arr = np.asarray(vector, dtype=np.float32)
+    if normalize:
+        norm = float(np.linalg.norm(arr))
+        if norm > 0:
+            arr = arr / norm
+    if dtype == "float32":
+        return _HEADER.pack(_TAG_FLOAT32) + arr.tobytes()
+    if dtype == "float16":
+        return _HEADER.pack(_TAG_FLOAT16) + arr.astype(np.float16).tobytes()
+    max_abs = float(np.abs(arr).max()) if arr.size else 0.0
+    scale = max_abs / 127.0 if max_abs > 0 else 1.0
+    quantized = np.clip(np.rint(arr / scale), -127, 127).astype(np.int8)
+    return _HEADER.pack(_TAG_INT8) + _SCALE.pack(scale) + quantized.tobytes()
+
+
+def decode_embedding(raw: Union[bytes, memoryview]) -> np.ndarray:
+    """Decode bytes produced by encode_embedding. float32 payloads are returned without copying."""
+    (tag,) = _HEADER.unpack_from(raw, 0)
+    offset = _HEADER.size
+    if tag == _TAG_FLOAT32:
+        return np.frombuffer(raw, dtype=np.float32, offset=offset)
+    if tag == _TAG_FLOAT16:
+        return np.frombuffer(raw, dtype=np.float16, offset=offset).astype(np.float32)
+    if tag == _TAG_INT8:
+        (scale,) = _SCALE.unpack_from(raw, offset)
+        return np.frombuffer(raw, dtype=np.int8, offset=offset + _SCALE.size).astype(np.float32) * scale
+    raise ValueError(f"Unknown embedding encoding tag: {tag}")
+
+
+def load_embedding(binary: Optional[bytes], legacy_json: Optional[str]) -> Optional[np.ndarray]:
+    """Return the embedding from the binary column, falling back to the legacy JSON text column."""
+    if binary is not None:
+        return decode_embedding(binary)
+    if legacy_json:
+        return np.asarray(json.loads(legacy_json), dtype=np.float32)
+    return None
+
+
+def load_unit_embedding(binary: Optional[bytes], legacy_json: Optional[str]) -> Optional[np.ndarray]:
+    """Like load_embedding, but always unit-norm: binary rows were normalized by encode_embedding,
+    only legacy JSON rows need a norm pass. Rows can be stacked into EmbeddingMatrix(normalized=True)."""
+    if binary is not None:
+        return decode_embedding(binary)
+    vector = load_embedding(None, legacy_json)
+    if vector is not None:
+        norm = float(np.linalg.norm(vector))
+        if norm > 0:
+            vector = vector / norm
+    return vector
+
+
+def has_embedding(obj) -> bool:
+    """True if a DocumentChunk/Agent row carries an embedding in either storage format."""
+    return obj.embedding_vec is not None or bool(obj.embedding)
+
+
+def embedding_present(model):
+    """SQL filter selecting rows of `model` that have an embedding in either storage format."""
+    return or_(model.embedding_vec.isnot(None), model.embedding.isnot(None))
@@ -0,0 +1,218 @@
+# Modèle d'exécution : les appels bloquants (LLM, HTTP, SQLAlchemy) partent dans un pool de threads borné,
+# le parsing/OCR lourd en CPU dans un pool de processus, pour ne jamais geler la boucle asyncio.
+import os
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Threads for blocking I/O (sync OpenAI client, requests, DB sessions)
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "32"))
+# Max calls waiting for a blocking thread before new ones are rejected (0 = unbounded queue)
+BLOCKING_POOL_MAX_QUEUE = int(os.getenv("BLOCKING_POOL_MAX_QUEUE", "0"))
+# Worker processes for CPU-bound parsing/OCR (0 = run them in the blocking thread pool instead)
+CPU_POOL_SIZE = int(os.getenv("CPU_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+
+
+class ExecutorSaturated(RuntimeError):
+    """Raised when a pool's wait queue is full; handlers map it to HTTP 503."""
+
+
+class InstrumentedPool:
+    """Executor wrapper keeping saturation counters (active, queued, peak, wait/run time)."""
+
+    def __init__(self, name: str, max_workers: int, factory, max_queue: int = 0):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._factory = factory
+        self._executor = None
+        self._lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+        self.peak_active = 0
+        self.peak_queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = self._factory()
+        return self._executor
+
+    def _reserve(self):
+        with self._lock:
+            if self.max_queue and self.queued >= self.max_queue and self.active >= self.max_workers:
+                self.rejected += 1
+                raise ExecutorSaturated(f"{self.name} pool saturated ({self.active} active, {self.queued} queued)")
+            self.submitted += 1
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+
+    def _release(self):
+        with self._lock:
+            self.queued -= 1
+            self.submitted -= 1
+
+    def _started(self, wait: float):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            self.wait_seconds += wait
+
+    def _finished(self, run: float, ok: bool):
+        with self._lock:
+            self.active -= 1
+            self.run_seconds += run
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def _call(self, fn, enqueued_at: float):
+        started = time.perf_counter()
+        self._started(started - enqueued_at)
+        ok = False
+        try:
+            result = fn()
+            ok = True
+            return result
+        finally:
+            self._finished(time.perf_counter() - started, ok)
+
+    def submit(self, fn, *args, **kwargs):
+        """Submit to the thread pool with accounting. Returns a concurrent.futures.Future."""
+        self._reserve()
+        try:
+            return self.executor.submit(self._call, partial(fn, *args, **kwargs), time.perf_counter())
+        except Exception:
+            self._release()
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self.completed + self.failed
+            return {
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "queued": self.queued,
+                "utilization": round(self.active / self.max_workers, 3) if self.max_workers else 0.0,
+                "peak_active": self.peak_active,
+                "peak_queued": self.peak_queued,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.wait_seconds / done * 1000, 2) if done else 0.0,
+                "avg_run_ms": round(self.run_seconds / done * 1000, 2) if done else 0.0,
+            }
+
+
+class InstrumentedProcessPool(InstrumentedPool):
+    """Process pool variant: the callable runs in a child process, accounting stays in the parent."""
+
+    def submit(self, fn, *args, **kwargs):
+        self._reserve()
+        enqueued_at = time.perf_counter()
+        try:
+            try:
+                future = self.executor.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # A child died (OOM on a huge scan...): start a fresh pool and retry once
+                logger.warning(f"{self.name} process pool broken, restarting it")
+                with self._lock:
+                    self._executor = None
+                future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        # Only the child knows when the task really starts: count it as in flight from submission
+        self._started(0.0)
+        future.add_done_callback(lambda f: self._done(f, enqueued_at))
+        return future
+
+    def _done(self, future, enqueued_at: float):
+        if future.cancelled():
+            # Cancelled while still queued (e.g. pages past pdf_extraction's time budget)
+            self._finished(time.perf_counter() - enqueued_at, False)
+            return
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            logger.warning(f"{self.name} process pool broken, it will be restarted on next submit")
+            with self._lock:
+                self._executor = None
+        self._finished(time.perf_counter() - enqueued_at, error is None)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        # In-flight tasks beyond max_workers are waiting in the pool's internal queue
+        in_flight = stats["active"]
+        stats["active"] = min(in_flight, self.max_workers)
+        stats["queued"] = max(0, in_flight - self.max_workers)
+        stats["utilization"] = round(stats["active"] / self.max_workers, 3) if self.max_workers else 0.0
+        return stats
+
+
+blocking_pool = InstrumentedPool(
+    "blocking",
+    BLOCKING_POOL_SIZE,
+    lambda: ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking"),
+    max_queue=BLOCKING_POOL_MAX_QUEUE,
+)
+
+# spawn (not fork): the API process holds threads, DB connections and gRPC channels
+cpu_pool = InstrumentedProcessPool(
+    "cpu",
+    CPU_POOL_SIZE,
+    lambda: ProcessPoolExecutor(max_workers=CPU_POOL_SIZE, mp_context=multiprocessing.get_context("spawn")),
+)
+
+_extra_pools = {}
+
+
+def register_pool(name: str, stats_fn):
+    """Expose another executor (e.g. the ingestion workers) in executor_stats()."""
+    _extra_pools[name] = stats_fn
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call in the bounded thread pool and await its result."""
+    return await asyncio.wrap_future(blocking_pool.submit(fn, *args, **kwargs))
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run a CPU-bound, picklable module-level function in the process pool."""
+    if CPU_POOL_SIZE <= 0:
+        return await run_blocking(fn, *args, **kwargs)
+    return await asyncio.wrap_future(cpu_pool.submit(fn, *args, **kwargs))
+
+
+def run_cpu_sync(fn, *args, **kwargs):
+    """Same as run_cpu for callers already running in a worker thread."""
+    if CPU_POOL_SIZE <= 0:
+        return fn(*args, **kwargs)
+    return cpu_pool.submit(fn, *args, **kwargs).result()
+
+
+def executor_stats() -> dict:
+    stats = {"blocking": blocking_pool.stats(), "cpu": cpu_pool.stats()}
+    for name, stats_fn in _extra_pools.items():
+        try:
+            stats[name] = stats_fn()
+        except Exception as e:
+            stats[name] = {"error": str(e)}
+    return stats
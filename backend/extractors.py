@@ -0,0 +1,156 @@
+# Extraction de texte des fichiers uploadés : un registre d'extracteurs indexé par extension et type MIME.
+# Chaque extracteur lit les octets en mémoire (pas de fichier temporaire) et rend le texte par segments
+# (pages, blocs de lignes / paragraphes, diapositives) pour que le découpage en chunks suive au fil de l'eau.
+import io
+import os
+import logging
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from chunker import chunk_segments
+from pdf_extraction import iter_pdf_pages
+
+logger = logging.getLogger(__name__)
+
+# Maximum size of a block of rows / paragraphs / slides yielded as one segment (bounds what is held at once;
+# chunker.chunk_segments builds chunks across segment boundaries)
+EXTRACT_BLOCK_CHARS = int(os.getenv("EXTRACT_BLOCK_CHARS", "16000"))
+
+Extractor = Callable[[bytes], Iterator[str]]
+
+# extension ('.pdf') -> extractor
+EXTRACTOR_REGISTRY: Dict[str, Extractor] = {}
+# MIME type -> extension, used when the filename has no known extension
+MIME_TYPES: Dict[str, str] = {}
+
+
+class ExtractionError(ValueError):
+    """Raised when a file cannot be parsed to the end (a truncated text must not be ingested)."""
+
+
+def register_extractor(extensions: Tuple[str, ...], mime_types: Tuple[str, ...] = ()):
+    """Decorator to register a text extractor for file extensions (and MIME types)."""
+    def deco(fn: Extractor):
+        for extension in extensions:
+            EXTRACTOR_REGISTRY[extension] = fn
+        for mime_type in mime_types:
+            MIME_TYPES[mime_type] = extensions[0]
+        return fn
+    return deco
+
+
+def _blocks(units: Iterable[str], size: int = EXTRACT_BLOCK_CHARS) -> Iterator[str]:
+    """Group short text units into newline-joined blocks of at most `size` characters (longer units alone)."""
+    block: List[str] = []
+    length = 0
+    for unit in units:
+        if not unit:
+            continue
+        if block and length + len(unit) + 1 > size:
+            yield "\n".join(block)
+            block, length = [], 0
+        block.append(unit)
+        length += len(unit) + 1
+    if block:
+        yield "\n".join(block)
+
+
+@register_extractor(('.pdf',), ('application/pdf',))
+def extract_pdf(content: bytes) -> Iterator[str]:
+    # Pages fanned out to the process pool, OCR only on scanned pages (see pdf_extraction.py)
+    for _, text in iter_pdf_pages(content):
+        yield text
+
+
+@register_extractor(('.docx',), ('application/vnd.openxmlformats-officedocument.wordprocessingml.document',))
+def extract_docx(content: bytes) -> Iterator[str]:
+    from docx import Document as DocxDocument
+    doc = DocxDocument(io.BytesIO(content))
+    yield from _blocks(p.text for p in doc.paragraphs)
+
+
+@register_extractor(('.pptx',), ('application/vnd.openxmlformats-officedocument.presentationml.presentation',))
+def extract_pptx(content: bytes) -> Iterator[str]:
+    from pptx import Presentation
+    pres = Presentation(io.BytesIO(content))
+    slides = ("\n".join(shape.text for shape in slide.shapes if hasattr(shape, "text")) for slide in pres.slides)
+    yield from _blocks(slides)
+
+
+@register_extractor(('.xlsx',), ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',))
+def extract_xlsx(content: bytes) -> Iterator[str]:
+    import openpyxl
+    # read_only: rows are parsed lazily from the sheet XML instead of loading every cell of the workbook
+    wb = openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        for sheet in wb.worksheets:
+            rows = ('\t'.join(str(cell) if cell is not None else '' for cell in row) for row in sheet.iter_rows(values_only=True))
+            yield from _blocks(rows)
+    finally:
+        wb.close()
+
+
+@register_extractor(('.txt', '.csv', '.ics', '.md', '.json', '.xml'),
+                    ('text/plain', 'text/csv', 'text/calendar', 'text/markdown', 'application/json', 'application/xml', 'text/xml'))
+def extract_plain_text(content: bytes) -> Iterator[str]:
+    yield content.decode('utf-8', errors='ignore')
+
+
+# Extensions accepted by the generic upload pipeline
+SUPPORTED_EXTENSIONS = tuple(EXTRACTOR_REGISTRY)
+
+
+def get_extractor(filename: str, content_type: Optional[str] = None) -> Optional[Extractor]:
+    """Extractor for a file, by extension first, then by MIME type. None if the type is not supported."""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension in EXTRACTOR_REGISTRY:
+        return EXTRACTOR_REGISTRY[extension]
+    if content_type:
+        extension = MIME_TYPES.get(content_type.split(";")[0].strip().lower())
+        if extension:
+            return EXTRACTOR_REGISTRY[extension]
+    return None
+
+
+def is_supported(filename: str, content_type: Optional[str] = None) -> bool:
+    return get_extractor(filename, content_type) is not None
+
+
+def iter_text(filename: str, content: bytes, content_type: Optional[str] = None) -> Iterator[str]:
+    """Yield the text of a file segment by segment. Raises ValueError for an unsupported type.
+
+    A parsing error raises ExtractionError, even after segments were yielded, so that the ingestion
+    job fails instead of storing a truncated document.
+    """
+    extractor = get_extractor(filename, content_type)
+    if extractor is None:
+        raise ValueError(f"File type not supported: {filename}")
+    try:
+        yield from extractor(content)
+    except Exception as e:
+        logger.error(f"Extraction error ({filename}): {e}")
+        raise ExtractionError(f"Le fichier {filename} n'a pas pu être lu entièrement : {e}") from e
+
+
+def extract_text(filename: str, content: bytes, content_type: Optional[str] = None) -> str:
+    """Extract the full text of an uploaded file from its raw bytes (PDF with per-page OCR, DOCX, PPTX, XLSX, text)"""
+    text = "\n".join(iter_text(filename, content, content_type))
+    logger.info(f"Texte extrait ({filename}): longueur={len(text)}")
+    return text
+
+
+def extract_chunks(filename: str, content: bytes, content_type: Optional[str] = None) -> Tuple[str, List[str]]:
+    """Full text and chunks of a file, chunking each segment as soon as it is extracted (see chunk_segments).
+
+    Picklable entry point for executors.run_cpu / run_cpu_sync.
+    """
+    segments: List[str] = []
+
+    def collect() -> Iterator[str]:
+        for segment in iter_text(filename, content, content_type):
+            segments.append(segment)
+            yield segment
+
+    chunks = list(chunk_segments(collect()))
+    text = "\n".join(segments)
+    logger.info(f"Texte extrait ({filename}): longueur={len(text)}, {len(chunks)} chunks")
+    return text, chunks
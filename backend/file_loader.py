@@ -1,29 +1,100 @@
-import pdfplumber
-from typing import List
+import logging
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Tuple
 import nltk
 from nltk.tokenize import sent_tokenize, blankline_tokenize
 
-# Patch NLTK pour rediriger 'punkt_tab' vers 'punkt'
-import nltk.data
-_original_find = nltk.data.find
-def patched_find(resource_name, paths=None):
-    if 'punkt_tab' in resource_name:
-        resource_name = resource_name.replace('punkt_tab', 'punkt')
-    return _original_find(resource_name, paths)
-nltk.data.find = patched_find
-
-def load_text_from_pdf(path: str) -> str:
-    """Load text from PDF file"""
-    text = ""
+logger = logging.getLogger("file_loader")
+
+def fetch_url_text(url: str, max_chars: int = 200000) -> Tuple[str, str]:
+    """Download a web page and keep only useful content (title, meta description, main text).
+
+    Returns (filename, text) where filename is derived from the URL.
+    """
+    import requests
+    from bs4 import BeautifulSoup
+    # Télécharger le contenu de l'URL
+    response = requests.get(url, timeout=15)
+    response.raise_for_status()
+    html = response.text
+
+    try:
+        from readability import Document as ReadabilityDocument
+        use_readability = True
+    except Exception:
+        use_readability = False
+
+    title = ""
+    meta_desc = ""
+    main_text = ""
+
     try:
-        with pdfplumber.open(path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
+        soup = BeautifulSoup(html, "lxml")
+        # Title
+        if soup.title and soup.title.string:
+            title = soup.title.string.strip()
+        # Meta description
+        md = soup.find("meta", attrs={"name": "description"})
+        if md and md.get("content"):
+            meta_desc = md.get("content").strip()
+
+        # Try Readability first (better extraction of main article)
+        if use_readability:
+            try:
+                doc = ReadabilityDocument(html)
+                main_soup = BeautifulSoup(doc.summary(), "lxml")
+                main_text = "\n".join([p.get_text(separator=" ", strip=True) for p in main_soup.find_all(["p", "h1", "h2", "h3"])])
+            except Exception:
+                use_readability = False
+
+        # Fallback: extract visible text from body, but filter out navigation/footer links
+        if not main_text:
+            body = soup.body
+            if body:
+                for tag in body.find_all(["script", "style", "nav", "footer", "aside", "header", "form", "noscript"]):
+                    tag.decompose()
+                paragraphs = [p.get_text(separator=" ", strip=True) for p in body.find_all(["p", "h1", "h2", "h3"]) if p.get_text(strip=True)]
+                main_text = "\n".join(paragraphs)
+
+        # Build a cleaned text that contains only useful metadata + main content
+        cleaned = []
+        if title:
+            cleaned.append(f"Title: {title}")
+        if meta_desc:
+            cleaned.append(f"Description: {meta_desc}")
+        if main_text:
+            cleaned.append("Content:\n" + main_text)
+
+        content = "\n\n".join(cleaned)
+        if not content.strip():
+            # If nothing meaningful found, fallback to raw text (but cleaned)
+            content = soup.get_text(separator="\n", strip=True)
     except Exception as e:
-        print(f"Error loading PDF: {e}")
-    return text
+        logger.warning(f"Failed to parse HTML for useful content, falling back to raw. Error: {e}")
+        content = html
+
+    # Shorten the filename
+    filename = url.split("//")[-1][:100].replace("/", "_") + ".txt"
+    # Truncate content to a reasonable length to avoid huge token usage
+    return filename, content[:max_chars]
+
+@lru_cache(maxsize=1)
+def _ensure_punkt():
+    # Once per process, on the first legacy chunking (the default chunker is chunker.py, without NLTK)
+    # Patch NLTK pour rediriger 'punkt_tab' vers 'punkt'
+    import nltk.data
+    _original_find = nltk.data.find
+
+    def patched_find(resource_name, paths=None):
+        if 'punkt_tab' in resource_name:
+            resource_name = resource_name.replace('punkt_tab', 'punkt')
+        return _original_find(resource_name, paths)
+    nltk.data.find = patched_find
+    try:
+        nltk.download('punkt', quiet=True)
+    except Exception as e:
+        logger.error(f"NLTK 'punkt' download failed: {e}")
+
 
 def chunk_text(text: str, chunk_size: int = 2000, overlap: int = 200, chunk_type: str = "auto") -> List[str]:
     """
@@ -33,10 +104,7 @@ def chunk_text(text: str, chunk_size: int = 2000, overlap: int = 200, chunk_type
 
     import logging
     logger = logging.getLogger("file_loader")
-    try:
-        nltk.download('punkt', quiet=True)
-    except Exception as e:
-        logger.error(f"NLTK 'punkt' download failed: {e}")
+    _ensure_punkt()
     chunks = []
     try:
         if chunk_type == "paragraph":
@@ -99,3 +167,20 @@ def chunk_text(text: str, chunk_size: int = 2000, overlap: int = 200, chunk_type
     result_chunks = [c.strip() for c in final_chunks if c.strip()]
     logger.info(f"chunk_text produced {len(result_chunks)} chunks.")
     return result_chunks
+
+def chunk_pages(pages: Iterable[str], chunk_size: int = 2000, overlap: int = 200) -> Iterator[str]:
+    """chunk_text applied segment by segment as they arrive (PDF pages, blocks of rows... see extractors.iter_text).
+    Used by chunker.chunk_segments when CHUNKER=legacy.
+
+    Chunks do not span segments; the overlap still carries the end of a segment into the first chunk of the next one.
+    """
+    previous = None
+    for page in pages:
+        if not page or not page.strip():
+            continue
+        for i, chunk in enumerate(chunk_text(page, chunk_size, overlap)):
+            if i == 0 and previous is not None:
+                tail = previous[-overlap:] if len(previous) > overlap else previous
+                chunk = tail + " " + chunk
+            previous = chunk
+            yield chunk
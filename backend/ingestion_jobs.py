@@ -0,0 +1,273 @@
+# File d'ingestion asynchrone : les endpoints d'upload persistent le fichier brut et rendent un job id,
+# un pool de workers exécute ensuite extract → store → chunk → embed → index hors de la boucle d'événements.
+import os
+import json
+import time
+import logging
+import threading
+from uuid import uuid4
+from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, IngestionJob
+from executors import InstrumentedPool, register_pool, run_cpu_sync
+from extractors import extract_chunks
+from file_loader import fetch_url_text
+from content_hash import content_hash
+from rag_engine import find_duplicate_document, process_document_for_user
+from utils import event_tracker
+
+logger = logging.getLogger(__name__)
+
+# Raw uploads are spooled here until their job completes (local disk of the instance)
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", "/tmp/ingest_spool")
+# Number of documents processed concurrently per instance
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+# A job still queued/running with no heartbeat for this long is considered lost with its instance
+INGEST_JOB_STALE_SECONDS = int(os.getenv("INGEST_JOB_STALE_SECONDS", "900"))
+# Interval at which an instance bumps IngestionJob.updated_at of the jobs it has queued or running
+INGEST_JOB_HEARTBEAT_SECONDS = int(os.getenv("INGEST_JOB_HEARTBEAT_SECONDS", "60"))
+
+_pool = InstrumentedPool(
+    "ingest",
+    max(1, INGEST_WORKERS),
+    lambda: ThreadPoolExecutor(max_workers=max(1, INGEST_WORKERS), thread_name_prefix="ingest"),
+)
+register_pool("ingest", _pool.stats)
+_lock = threading.Lock()
+_scheduled = set()
+_heartbeat_thread = None
+
+
+class EmptyDocumentError(ValueError):
+    """Raised when no text could be extracted from an upload."""
+
+
+def _spool(job_id: str, data: bytes) -> str:
+    os.makedirs(INGEST_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(INGEST_SPOOL_DIR, job_id)
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _create_job(db: Session, user_id: int, filename: str, source: str, data: bytes, agent_id: Optional[int]) -> IngestionJob:
+    job_id = uuid4().hex
+    job = IngestionJob(
+        id=job_id,
+        user_id=user_id,
+        agent_id=agent_id,
+        filename=filename,
+        source=source,
+        spool_path=_spool(job_id, data),
+        status="queued",
+        stage_timings=json.dumps({}),
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    _schedule(job_id)
+    logger.info(f"Ingestion job {job_id} queued: {source} {filename} for user {user_id}, agent {agent_id}")
+    return job
+
+
+def submit_file_job(db: Session, user_id: int, filename: str, content: bytes, agent_id: Optional[int] = None) -> IngestionJob:
+    """Persist an uploaded file and queue it for ingestion. Returns the queued job."""
+    return _create_job(db, user_id, filename, "file", content, agent_id)
+
+
+def submit_url_job(db: Session, user_id: int, url: str, agent_id: Optional[int] = None) -> IngestionJob:
+    """Queue a web page for ingestion; it is downloaded by the worker, not in the request."""
+    return _create_job(db, user_id, url, "url", url.encode("utf-8"), agent_id)
+
+
+def _schedule(job_id: str):
+    global _heartbeat_thread
+    with _lock:
+        if job_id in _scheduled:
+            return
+        _scheduled.add(job_id)
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name="ingest-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+    _pool.submit(_run_job, job_id)
+
+
+def _heartbeat_loop():
+    """Keep the jobs of this instance fresh, so that a deep queue or a long stage (OCR) is not taken for a lost job."""
+    while True:
+        time.sleep(INGEST_JOB_HEARTBEAT_SECONDS)
+        with _lock:
+            job_ids = list(_scheduled)
+        if not job_ids:
+            continue
+        db = SessionLocal()
+        try:
+            db.query(IngestionJob).filter(
+                IngestionJob.id.in_(job_ids), IngestionJob.status.in_(("queued", "running"))
+            ).update({"updated_at": datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Ingestion job heartbeat failed: {e}")
+        finally:
+            db.close()
+
+
+def _run_job(job_id: str):
+    db = SessionLocal()
+    try:
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if not job or job.status in ("done", "failed"):
+            return
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        db.commit()
+
+        timings = json.loads(job.stage_timings or "{}")
+        chunks = None
+
+        @contextmanager
+        def stage(name: str):
+            job.stage = name
+            job.updated_at = datetime.utcnow()
+            db.commit()
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                timings[name] = round(time.perf_counter() - start, 3)
+                job.stage_timings = json.dumps(timings)
+
+        with open(job.spool_path, "rb") as f:
+            raw = f.read()
+
+        if job.source == "file":
+            # Same bytes already ingested for this user and agent: nothing to extract or embed
+            duplicate = find_duplicate_document(db, content_hash(raw), job.user_id, job.agent_id)
+            if duplicate:
+                job.document_id = duplicate
+                job.status = "done"
+                job.finished_at = datetime.utcnow()
+                db.commit()
+                logger.info(f"Ingestion job {job_id}: {job.filename} is identical to document {duplicate}, not ingested again")
+                return
+
+        if job.source == "url":
+            url = raw.decode("utf-8")
+            with stage("fetch"):
+                filename, text = fetch_url_text(url)
+            content = text.encode("utf-8", errors="ignore")
+            job.filename = filename
+        else:
+            filename = job.filename
+            content = raw
+            with stage("extract"):
+                # Segments are chunked as they are extracted. PDF pages fan out to the process pool by themselves;
+                # other formats are parsed in the process pool, not in this thread
+                if filename.lower().endswith(".pdf"):
+                    text, chunks = extract_chunks(filename, content)
+                else:
+                    text, chunks = run_cpu_sync(extract_chunks, filename, content)
+
+        if not text or not text.strip():
+            raise EmptyDocumentError("Aucun texte détecté dans la pièce jointe. Vérifiez que le document contient du texte sélectionnable (pas une image ou un scan).")
+
+        job.document_id = process_document_for_user(
+            filename, content, job.user_id, db, agent_id=job.agent_id, text_content=text, stage=stage, chunks=chunks
+        )
+        job.status = "done"
+        job.stage = None
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        logger.info(f"Ingestion job {job_id} done: document {job.document_id}, timings {timings}")
+        event_tracker.track_document_upload(job.user_id, url if job.source == "url" else filename, len(text))
+    except Exception as e:
+        logger.error(f"Ingestion job {job_id} failed: {e}")
+        db.rollback()
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if job:
+            job.status = "failed"
+            job.error = str(e)[:2000]
+            job.finished_at = datetime.utcnow()
+            db.commit()
+    finally:
+        with _lock:
+            _scheduled.discard(job_id)
+        job = db.query(IngestionJob).filter(IngestionJob.id == job_id).first()
+        if job and job.status in ("done", "failed") and job.spool_path and os.path.exists(job.spool_path):
+            os.unlink(job.spool_path)
+        db.close()
+
+
+def _is_stale(job: IngestionJob) -> bool:
+    last_activity = job.updated_at or job.started_at or job.created_at
+    return last_activity is not None and (datetime.utcnow() - last_activity).total_seconds() > INGEST_JOB_STALE_SECONDS
+
+
+def _fail_lost_job(db: Session, job: IngestionJob):
+    job.status = "failed"
+    job.error = "Le traitement du document a été interrompu (redémarrage du serveur). Veuillez l'envoyer à nouveau."
+    job.finished_at = datetime.utcnow()
+    db.commit()
+    logger.warning(f"Ingestion job {job.id} ({job.filename}) lost: marked as failed")
+
+
+def resume_pending_jobs() -> int:
+    """Re-queue jobs interrupted by a restart. Only jobs spooled on this instance's disk can be resumed.
+
+    Jobs whose spool file is gone are failed once stale: until then they may still be running on another instance.
+    """
+    db = SessionLocal()
+    try:
+        pending = db.query(IngestionJob).filter(IngestionJob.status.in_(("queued", "running"))).all()
+        resumed = 0
+        for job in pending:
+            if job.spool_path and os.path.exists(job.spool_path):
+                job.status = "queued"
+                db.commit()
+                _schedule(job.id)
+                resumed += 1
+            elif _is_stale(job):
+                _fail_lost_job(db, job)
+        if resumed:
+            logger.info(f"Resumed {resumed} pending ingestion jobs")
+        return resumed
+    finally:
+        db.close()
+
+
+def get_job(db: Session, job_id: str, user_id: int) -> Optional[IngestionJob]:
+    """A user's job. A pending job that is stale and not scheduled on this instance is marked as failed first."""
+    job = db.query(IngestionJob).filter(IngestionJob.id == job_id, IngestionJob.user_id == user_id).first()
+    if job and job.status in ("queued", "running") and _is_stale(job):
+        with _lock:
+            scheduled_here = job.id in _scheduled
+        if not scheduled_here:
+            _fail_lost_job(db, job)
+    return job
+
+
+def job_to_dict(job: IngestionJob) -> dict:
+    timings = json.loads(job.stage_timings or "{}")
+    return {
+        "job_id": job.id,
+        "filename": job.filename,
+        "source": job.source,
+        "agent_id": job.agent_id,
+        "status": job.status,
+        "stage": job.stage,
+        "stage_timings": timings,
+        "total_seconds": round(sum(timings.values()), 3),
+        "document_id": job.document_id,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
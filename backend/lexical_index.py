@@ -0,0 +1,165 @@
+# Index lexical BM25 en mémoire par agent et par utilisateur, sur DocumentChunk.chunk_text
+# (normalisation française : minuscules, accents, mots vides, racinisation légère).
+import os
+import re
+import math
+import logging
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Document, DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_ENABLED = os.getenv("LEXICAL_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Codes and references (AB-1234, v2.1, art_12) are kept whole, and also split into their parts
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_STOPWORDS = frozenset("""
+a afin ai aie aient aies ait alors as au aucun aupres auquel aura aurai auraient aurais aurait aux avec avez aviez avions
+avoir avons ayant c ca ce ceci cela celle celles celui ces cet cette chaque chez ci comme comment d dans de des desquelles
+desquels dont du duquel elle elles en encore entre es est et etaient etais etait etant ete etes etre eu eux fait faut il
+ils j je jusqu l la laquelle le lequel les lesquelles lesquels leur leurs lui m ma mais me meme memes mes moi mon n ne
+ni nos notre nous on ont ou par pas peu peut plus pour pourquoi qu quand que quel quelle quelles quels qui quoi s sa sans
+se sera ses si son sont sous suis sur t ta te tes toi ton tous tout toute toutes tu un une vos votre vous y
+the of and or to in is are was be for on with by an at it this that what which how
+""".split())
+
+
+def _strip_accents(text: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def _stem(word: str) -> str:
+    """Light French stemming: plural, then final -e / -er (facture, factures, facturer -> factur)."""
+    if not word.isalpha() or len(word) < 4:
+        return word
+    if word.endswith("aux") and len(word) > 5:
+        return word[:-3] + "al"
+    if word[-1] in "sx":
+        word = word[:-1]
+    if word.endswith("er") and len(word) > 4:
+        return word[:-2]
+    if word.endswith("e") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def analyze(text: str) -> List[str]:
+    """Terms of a text for indexing and querying."""
+    terms = []
+    for token in _TOKEN_RE.findall(_strip_accents((text or "").lower())):
+        parts = re.split(r"[-_./]", token)
+        if len(parts) > 1:
+            terms.append(token)
+        for part in parts:
+            if part and part not in _STOPWORDS:
+                terms.append(_stem(part))
+    return terms
+
+
+class LexicalScope:
+    """BM25 postings for one retrieval scope ("agent_<id>" or "user_<id>"), keyed by DocumentChunk id."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.built = False
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.lengths: Dict[int, int] = {}
+        self.documents: Dict[int, int] = {}  # chunk id -> document id
+        self.total_length = 0
+        self.rows_seen = 0
+        self.max_chunk_id = 0
+        self.lock = threading.RLock()
+
+    def reset(self):
+        self.postings = {}
+        self.lengths = {}
+        self.documents = {}
+        self.total_length = 0
+        self.rows_seen = 0
+        self.max_chunk_id = 0
+
+    def add(self, rows: Iterable[Tuple[int, int, str]]):
+        for chunk_id, document_id, text in rows:
+            terms = analyze(text)
+            for term, tf in Counter(terms).items():
+                self.postings.setdefault(term, {})[chunk_id] = tf
+            self.lengths[chunk_id] = len(terms)
+            self.documents[chunk_id] = document_id
+            self.total_length += len(terms)
+            self.rows_seen += 1
+            self.max_chunk_id = max(self.max_chunk_id, chunk_id)
+        self.built = True
+
+    def search(self, query: str, top_k: int, document_ids: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        n = len(self.lengths)
+        if not n:
+            return []
+        allowed = set(document_ids) if document_ids else None
+        avg_length = self.total_length / n or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(analyze(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                if allowed is not None and self.documents[chunk_id] not in allowed:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_id] / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(chunk_id, float(score)) for chunk_id, score in best]
+
+
+_scopes: Dict[str, LexicalScope] = {}
+_scopes_lock = threading.Lock()
+
+
+def _scope_query(db: Session, columns, agent_id: Optional[int], user_id: Optional[int]):
+    """Every chunk of the scope, embedded or not (same filters as the vector index)."""
+    query = db.query(*columns).join(Document, DocumentChunk.document_id == Document.id)
+    if agent_id:
+        return query.filter(Document.agent_id == agent_id)
+    return query.filter(Document.user_id == user_id)
+
+
+def _sync(scope: LexicalScope, db: Session, agent_id: Optional[int], user_id: Optional[int]):
+    """Catch up with new chunks, or rebuild when chunks were deleted."""
+    count, max_id = _scope_query(db, (func.count(DocumentChunk.id), func.max(DocumentChunk.id)), agent_id, user_id).one()
+    count = count or 0
+    max_id = max_id or 0
+    if scope.built and count == scope.rows_seen and max_id <= scope.max_chunk_id:
+        return
+    columns = (DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.chunk_text)
+    if scope.built and max_id > scope.max_chunk_id:
+        new_rows = _scope_query(db, columns, agent_id, user_id).filter(DocumentChunk.id > scope.max_chunk_id).all()
+        if scope.rows_seen + len(new_rows) == count:
+            scope.add(new_rows)
+            return
+    scope.reset()
+    scope.add(_scope_query(db, columns, agent_id, user_id).yield_per(1000))
+    logger.info(f"Lexical index {scope.key} rebuilt ({scope.rows_seen} chunks, {len(scope.postings)} terms)")
+
+
+def search(db: Session, query: str, top_k: int, agent_id: int = None, user_id: int = None, document_ids: List[int] = None) -> List[Tuple[int, float]]:
+    """Return the top_k (chunk_id, BM25 score) pairs for the agent scope, or the user scope if no agent."""
+    if agent_id:
+        key = f"agent_{agent_id}"
+    elif user_id:
+        key = f"user_{user_id}"
+    else:
+        return []
+    with _scopes_lock:
+        scope = _scopes.setdefault(key, LexicalScope(key))
+    with scope.lock:
+        _sync(scope, db, agent_id, user_id)
+        return scope.search(query, top_k, document_ids)
@@ -0,0 +1,222 @@
+# Couche LLM asynchrone : AsyncOpenAI et client Vertex (Gemini) async, chacun avec un pool de connexions
+# longue durée (HTTP/2 si disponible) partagé par toutes les conversations de l'instance.
+import os
+import asyncio
+import logging
+import threading
+from functools import lru_cache
+from typing import List, Optional
+
+import httpx
+
+import analytics
+
+logger = logging.getLogger(__name__)
+
+# Pool settings shared by the sync OpenAI client (openai_client.client) and the async clients below
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "50"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "30"))
+# HTTP/2 multiplexes concurrent requests over a few sockets (needs the h2 package: httpx[http2])
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() in ("1", "true", "yes")
+
+_async_openai = None
+_vertex_http = None
+_loop = None
+_stats_lock = threading.Lock()
+_inflight = {"openai": 0, "vertex": 0}
+_peak_inflight = {"openai": 0, "vertex": 0}
+_requests = {"openai": 0, "vertex": 0}
+
+
+def http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+@lru_cache(maxsize=1)
+def http2_enabled() -> bool:
+    if not LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except Exception:
+        logger.warning("LLM_HTTP2 requested but the h2 package is missing (pip install httpx[http2]); using HTTP/1.1")
+        return False
+
+
+def get_async_openai():
+    """Process-wide AsyncOpenAI client (created lazily, inside the event loop)."""
+    global _async_openai
+    if _async_openai is None:
+        from openai import AsyncOpenAI
+        from openai_client import api_key
+        _async_openai = AsyncOpenAI(
+            api_key=api_key,
+            timeout=LLM_HTTP_TIMEOUT,
+            max_retries=3,
+            http_client=httpx.AsyncClient(timeout=LLM_HTTP_TIMEOUT, limits=http_limits(), http2=http2_enabled()),
+        )
+    return _async_openai
+
+
+def get_vertex_http() -> httpx.AsyncClient:
+    """Process-wide async HTTP client for Vertex AI; auth comes from gemini_client's cached credentials."""
+    global _vertex_http
+    if _vertex_http is None:
+        _vertex_http = httpx.AsyncClient(timeout=LLM_HTTP_TIMEOUT, limits=http_limits(), http2=http2_enabled())
+    return _vertex_http
+
+
+class _Tracked:
+    """Counts in-flight requests per provider (exposed in /debug/executors)."""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+
+    def __enter__(self):
+        with _stats_lock:
+            _inflight[self.provider] += 1
+            _requests[self.provider] += 1
+            _peak_inflight[self.provider] = max(_peak_inflight[self.provider], _inflight[self.provider])
+
+    def __exit__(self, *exc):
+        with _stats_lock:
+            _inflight[self.provider] -= 1
+
+
+def _open_connections(client) -> Optional[int]:
+    try:
+        return len(client._transport._pool.connections)
+    except Exception:
+        return None
+
+
+def provider_stats() -> dict:
+    with _stats_lock:
+        stats = {
+            provider: {"in_flight": _inflight[provider], "peak_in_flight": _peak_inflight[provider], "requests": _requests[provider]}
+            for provider in _inflight
+        }
+    if _async_openai is not None:
+        stats["openai"]["open_connections"] = _open_connections(_async_openai._client)
+    if _vertex_http is not None:
+        stats["vertex"]["open_connections"] = _open_connections(_vertex_http)
+    stats["http2"] = http2_enabled()
+    stats["max_connections"] = LLM_HTTP_MAX_CONNECTIONS
+    return stats
+
+
+async def agenerate_gemini(prompt: str, model_name: str = "gemini-2.0-flash", temperature: float = 0.0, max_tokens: int = 512, timeout: int = 30) -> str:
+    """Async equivalent of gemini_client.generate_text over the shared Vertex connection pool."""
+    from gemini_client import resolve_model, build_generate_url, build_request_body, extract_response_text, get_access_token
+    # Cached credentials; the (rare) token refresh is a blocking HTTP call, keep it off the loop
+    token = await asyncio.to_thread(get_access_token)
+    resolved_model = resolve_model(model_name)
+    url = build_generate_url(resolved_model)
+    logger.info(f"Calling Vertex generateContent (async): model={resolved_model}")
+    with _Tracked("vertex"), analytics.track_llm("vertex", resolved_model):
+        resp = await get_vertex_http().post(
+            url,
+            json=build_request_body(prompt, temperature, max_tokens),
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=timeout,
+        )
+        if resp.status_code >= 400:
+            logger.error(f"Vertex generateContent non-2xx status {resp.status_code}: {resp.text}")
+        resp.raise_for_status()
+    data = resp.json()
+    analytics.record_gemini_usage(resolved_model, data)
+    return extract_response_text(data)
+
+
+async def achat(messages: list, model_id: str = None, gemini_only: bool = False, temperature: float = 0.7, max_tokens: int = None, max_retries: int = 5) -> str:
+    """Async get_chat_response: same provider routing (gemini:/perplexity:/OpenAI) and fallbacks."""
+    from openai_client import DEFAULT_MODEL, DEFAULT_MAX_TOKENS, _messages_to_prompt
+    model = model_id if model_id else DEFAULT_MODEL
+    max_tokens = max_tokens if max_tokens is not None else DEFAULT_MAX_TOKENS
+    if isinstance(model, str) and model.startswith('gemini:'):
+        model_short = model.split(':', 1)[1]
+        try:
+            return await agenerate_gemini(_messages_to_prompt(messages), model_name=model_short, temperature=temperature, max_tokens=max_tokens)
+        except Exception as e:
+            env_gemini_only = os.getenv("GEMINI_ONLY", "false").lower() in ("1", "true", "yes")
+            if gemini_only or env_gemini_only:
+                logger.error(f"Gemini-only mode enabled and Gemini call failed: {e}")
+                raise
+            logger.warning(f"Gemini call failed (will fallback to OpenAI): {e}")
+            model = DEFAULT_MODEL
+    if isinstance(model, str) and model.startswith('perplexity:'):
+        logger.warning(f"Perplexity integration not implemented; falling back to DEFAULT_MODEL ({DEFAULT_MODEL}).")
+        model = DEFAULT_MODEL
+    client = get_async_openai()
+    for attempt in range(max_retries):
+        try:
+            with _Tracked("openai"), analytics.track_llm("openai", model):
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature
+                )
+            analytics.record_llm_usage("openai", model, getattr(response, "usage", None))
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"Error getting chat response (async, attempt {attempt + 1}/{max_retries}): {e}")
+            if attempt < max_retries - 1:
+                await asyncio.sleep(2 ** attempt)
+            else:
+                raise
+
+
+async def aembed(texts: List[str], model: str = None) -> List[list]:
+    """Async embeddings.create for a small list of texts (queries); ingestion uses get_embeddings_batch."""
+    from openai_client import EMBEDDING_MODEL
+    model = model or EMBEDDING_MODEL
+    with _Tracked("openai"), analytics.track_embedding(model, "query", len(texts)):
+        response = await get_async_openai().embeddings.create(input=texts, model=model)
+    return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+
+def bind_event_loop(loop: asyncio.AbstractEventLoop):
+    """Register the app's event loop so worker threads can use the shared async pools (see chat_blocking)."""
+    global _loop
+    _loop = loop
+
+
+def _on_loop_thread(loop) -> bool:
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+def chat_blocking(messages: list, model_id: str = None, gemini_only: bool = False) -> str:
+    """Sync chat call for code running in worker threads (get_answer under run_blocking, Slack...).
+
+    When the app loop is running, the request is executed on it through the shared async pools, so
+    every in-flight conversation multiplexes over the same few sockets; otherwise (scripts, tests)
+    it falls back to the sync client.
+    """
+    loop = _loop
+    if loop is not None and loop.is_running() and not _on_loop_thread(loop):
+        future = asyncio.run_coroutine_threadsafe(achat(messages, model_id=model_id, gemini_only=gemini_only), loop)
+        return future.result()
+    from openai_client import get_chat_response
+    return get_chat_response(messages, model_id=model_id, gemini_only=gemini_only)
+
+
+async def aclose():
+    """Close the pooled connections (app shutdown)."""
+    global _async_openai, _vertex_http
+    if _async_openai is not None:
+        await _async_openai.close()
+        _async_openai = None
+    if _vertex_http is not None:
+        await _vertex_http.aclose()
+        _vertex_http = None
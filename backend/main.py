@@ -10,6 +10,7 @@ from fastapi import Response
 
 # Standard library
 import os
+import asyncio
 import io
 import time
 import json
@@ -34,7 +35,7 @@ from pptx import Presentation
 from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Request, Body, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
@@ -44,9 +45,24 @@ from google.cloud import storage
 
 # Local modules
 from auth import create_access_token, verify_token, hash_password, verify_password
-from database import get_db, init_db, User, Document, Agent, Team, Base, engine
-from rag_engine import get_answer, get_answer_with_files, process_document_for_user
+from database import get_db, init_db, User, Document, Agent, Team, Base, engine, SessionLocal, async_engine, read_all, release_connection, db_pool_stats
+from sqlalchemy import select
+from rag_engine import get_answer, aget_answer, build_answer_prompt, store_cached_answer, get_answer_with_files, RAG_HISTORY_MESSAGES
+import retrievers
+import redis_cache
+import semantic_cache
+import reranker
+import request_trace
+import analytics
+import migrations
+from streaming_response import stream_answer_events
+import llm_providers
+from ingestion_jobs import submit_file_job, submit_url_job, resume_pending_jobs, get_job as get_ingestion_job_for_user, job_to_dict as ingestion_job_to_dict
+from extractors import extract_pdf, extract_plain_text, extract_text, get_extractor, is_supported
+from executors import run_blocking, run_cpu, executor_stats, register_pool, ExecutorSaturated
 from file_generator import FileGenerator
+from embedding_codec import encode_embedding, load_unit_embedding, has_embedding
+from similarity import EmbeddingMatrix
 from utils import logger, event_tracker
 from models_conversation import Conversation, Message
 
@@ -82,6 +98,26 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Request count and latency per route template (not per raw path: ids would explode the series)"""
+    start = time.perf_counter()
+    status = 500
+    with analytics.http_in_progress():
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = getattr(request.scope.get("route"), "path", None) or "unmatched"
+            analytics.observe_http(request.method, route, status, time.perf_counter() - start)
+
+
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturated):
+    """Blocking pool queue full (BLOCKING_POOL_MAX_QUEUE): shed load instead of piling up requests"""
+    logger.warning(f"Rejected {request.url.path}: {exc}")
+    return JSONResponse(status_code=503, content={"detail": "Server busy, please retry"}, headers={"Retry-After": "2"})
 
 
 def _normalize_model_output(obj) -> str:
@@ -207,90 +243,11 @@ async def upload_url(
     user_id: str = Depends(verify_token),
     db: Session = Depends(get_db)
 ):
-    """Ajoute une URL comme document/source pour le RAG"""
+    """Ajoute une URL comme document/source pour le RAG (téléchargement et indexation en tâche de fond)"""
     try:
-        # Télécharger le contenu de l'URL
-        response = requests.get(request.url, timeout=15)
-        response.raise_for_status()
-        html = response.text
-
-        # Extraire uniquement les informations utiles : titre, meta description et contenu principal
-        from bs4 import BeautifulSoup
-        try:
-            from readability import Document as ReadabilityDocument
-            use_readability = True
-        except Exception:
-            use_readability = False
-
-        title = ""
-        meta_desc = ""
-        main_text = ""
-
-        try:
-            soup = BeautifulSoup(html, "lxml")
-            # Title
-            if soup.title and soup.title.string:
-                title = soup.title.string.strip()
-            # Meta description
-            md = soup.find("meta", attrs={"name": "description"})
-            if md and md.get("content"):
-                meta_desc = md.get("content").strip()
-
-            # Try Readability first (better extraction of main article)
-            if use_readability:
-                try:
-                    doc = ReadabilityDocument(html)
-                    main_html = doc.summary()
-                    main_soup = BeautifulSoup(main_html, "lxml")
-                    # Get visible text
-                    main_text = "\n".join([p.get_text(separator=" ", strip=True) for p in main_soup.find_all(["p", "h1", "h2", "h3"])])
-                except Exception:
-                    use_readability = False
-
-            # Fallback: extract visible text from body, but filter out navigation/footer links
-            if not main_text:
-                body = soup.body
-                if body:
-                    # Remove scripts, styles, nav, footer, aside
-                    for tag in body.find_all(["script", "style", "nav", "footer", "aside", "header", "form", "noscript"]):
-                        tag.decompose()
-                    # Collect paragraphs and headings
-                    paragraphs = [p.get_text(separator=" ", strip=True) for p in body.find_all(["p", "h1", "h2", "h3"]) if p.get_text(strip=True)]
-                    main_text = "\n".join(paragraphs)
-
-            # Build a cleaned text that contains only useful metadata + main content (limit length)
-            cleaned = []
-            if title:
-                cleaned.append(f"Title: {title}")
-            if meta_desc:
-                cleaned.append(f"Description: {meta_desc}")
-            if main_text:
-                cleaned.append("Content:\n" + main_text)
-
-            content = "\n\n".join(cleaned)
-            if not content.strip():
-                # If nothing meaningful found, fallback to raw text (but cleaned)
-                content = soup.get_text(separator="\n", strip=True)
-
-        except Exception as e:
-            logger.warning(f"Failed to parse HTML for useful content, falling back to raw. Error: {e}")
-            content = html
-
-        # Shorten the filename
-        filename = request.url.split("//")[-1][:100].replace("/", "_") + ".txt"
-
-        # Truncate content to a reasonable length to avoid huge token usage (e.g., 200k chars)
-        max_chars = 200000
-        if len(content) > max_chars:
-            content = content[:max_chars]
-
-        # Indexer le document comme pour un upload classique (send cleaned text)
-        doc_id = process_document_for_user(filename, content.encode("utf-8", errors="ignore"), int(user_id), db, agent_id=request.agent_id)
-
-        logger.info(f"URL ajoutée pour user {user_id}, agent {request.agent_id}: {request.url}")
-        event_tracker.track_document_upload(int(user_id), request.url, len(content))
-
-        return {"url": request.url, "document_id": doc_id, "agent_id": request.agent_id, "status": "uploaded"}
+        job = await run_blocking(submit_url_job, db, int(user_id), request.url, agent_id=request.agent_id)
+        logger.info(f"URL mise en file pour user {user_id}, agent {request.agent_id}: {request.url}")
+        return {"url": request.url, "job_id": job.id, "agent_id": request.agent_id, "status": job.status}
     except Exception as e:
         logger.error(f"Erreur lors de l'ajout d'URL: {e}")
         raise HTTPException(status_code=500, detail="Erreur lors de l'ajout de l'URL")
@@ -317,48 +274,68 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     """Initialize database and create tables on startup"""
+    # Worker threads send their LLM calls through the shared async pools of this loop
+    llm_providers.bind_event_loop(asyncio.get_running_loop())
+    register_pool("llm", llm_providers.provider_stats)
+    register_pool("db", db_pool_stats)
+    analytics.register_collectors(engine)
     try:
         logger.info("Initializing database...")
         init_db()
         logger.info("Creating database tables...")
         Base.metadata.create_all(bind=engine)
         
-        # Run migration to add agent_id column if it doesn't exist
+        # Versioned schema migrations (columns and indexes missing from databases created by older versions)
         logger.info("Running database migrations...")
-        await run_migrations()
+        try:
+            applied = migrations.run_migrations(engine)
+            if applied:
+                logger.info(f"Migrations applied: {applied}")
+        except Exception as e:
+            logger.error(f"Migration failed: {e}")
+            # Don't raise exception to allow the app to continue
         
         logger.info("Database initialization completed successfully")
+
+        # Re-queue uploads interrupted by a restart of this instance
+        resume_pending_jobs()
+
+        # Optional in-process backfill of chunks stored without embedding
+        backfill_interval = int(os.getenv("EMBEDDING_BACKFILL_INTERVAL", "0"))
+        if backfill_interval > 0:
+            from embedding_backfill import run_backfill_loop
+            # Keep a reference: the event loop only holds tasks weakly
+            app.state.backfill_task = asyncio.create_task(run_backfill_loop(
+                backfill_interval,
+                concurrency=int(os.getenv("EMBEDDING_BACKFILL_CONCURRENCY", "2")),
+                requests_per_minute=int(os.getenv("EMBEDDING_BACKFILL_RPM", "0")),
+            ))
+            app.state.backfill_task.add_done_callback(_log_backfill_exit)
+            logger.info(f"Embedding backfill scheduled every {backfill_interval}s")
     except Exception as e:
         logger.error(f"Database initialization failed: {e}")
         # Don't raise exception to allow the app to start, but log the error
 
-async def run_migrations():
-    """Run database migrations"""
-    try:
-        from sqlalchemy import text
-        
-        with engine.connect() as conn:
-            # Check if agent_id column exists in documents table
-            result = conn.execute(text("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name = 'documents' AND column_name = 'agent_id'
-            """))
-            
-            if not result.fetchone():
-                logger.info("Adding agent_id column to documents table...")
-                conn.execute(text("""
-                    ALTER TABLE documents 
-                    ADD COLUMN agent_id INTEGER REFERENCES agents(id)
-                """))
-                conn.commit()
-                logger.info("agent_id column added successfully")
-            else:
-                logger.info("agent_id column already exists")
-                
-    except Exception as e:
-        logger.error(f"Migration failed: {e}")
-        # Don't raise exception to allow the app to continue
+def _log_backfill_exit(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Embedding backfill loop stopped: {task.exception()!r}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the embedding backfill loop, close the pooled LLM and async DB connections"""
+    backfill_task = getattr(app.state, "backfill_task", None)
+    if backfill_task is not None:
+        backfill_task.cancel()
+        try:
+            await backfill_task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            pass  # already logged by _log_backfill_exit
+    await llm_providers.aclose()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 # Health check endpoints
 @app.get("/")
@@ -366,6 +343,14 @@ async def root():
     """Root endpoint"""
     return {"message": "TAIC Companion API is running", "status": "ok"}
 
+@app.get("/ingest/jobs/{job_id}")
+async def get_ingestion_job(job_id: str, user_id: str = Depends(verify_token), db: Session = Depends(get_db)):
+    """Status of an ingestion job with per-stage timings (seconds)"""
+    job = get_ingestion_job_for_user(db, job_id, int(user_id))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ingestion_job_to_dict(job)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -386,6 +371,9 @@ class QuestionRequest(BaseModel):
     selected_documents: list[int] = []  # List of document IDs to use
     agent_id: int = None  # Id de l'agent sélectionné
     team_id: int = None  # Id de l'équipe sélectionnée
+    conversation_id: Optional[int] = None  # Historique chargé depuis la conversation (et réponse enregistrée par /ask/stream)
+    history: Optional[List[dict]] = None  # Historique envoyé directement par le frontend
+    debug: bool = False  # Ajoute la durée de chaque étape et le détail des extraits retenus à la réponse
 
 class AgentCreate(BaseModel):
     name: str
@@ -465,6 +453,38 @@ async def login(user: UserLogin, db: Session = Depends(get_db)):
 # Nouvelle version de l'endpoint /ask : utilise toujours la mémoire (historique) et le modèle fine-tuné si dispo
 from models_conversation import Message
 
+def _load_history(request: QuestionRequest, db: Session) -> list:
+    """Conversation history for the prompt: stored messages of conversation_id, else the history sent by the frontend"""
+    if request.conversation_id:
+        # Only the tail reaches the prompt: let the database return just those rows
+        msgs = (
+            db.query(Message.role, Message.content)
+            .filter(Message.conversation_id == request.conversation_id)
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(RAG_HISTORY_MESSAGES)
+            .all()
+        )
+        return [{"role": role, "content": content} for role, content in reversed(msgs)]
+    # fallback: si le frontend envoie déjà l'historique
+    return request.history or []
+
+
+def _resolve_model_id(agent) -> Optional[str]:
+    """Model used for an agent: its fine-tuned model, else the default model of its type"""
+    if agent and agent.finetuned_model_id:
+        return agent.finetuned_model_id
+    atype = getattr(agent, 'type', 'conversationnel') if agent else 'conversationnel'
+    if atype == 'actionnable':
+        return os.getenv('GEMINI_MODEL', 'gemini:gemini-2.0-flash-001')
+    if atype == 'recherche_live':
+        return os.getenv('PERPLEXITY_MODEL', 'perplexity:default')
+    return os.getenv('OPENAI_MODEL', None)
+
+
+def _agent_prompt(question: str) -> str:
+    return f"Sachant le contexte et la discussion en cours, réponds à cette question : {question}"
+
+
 @app.post("/ask")
 async def ask_question(
     request: QuestionRequest,
@@ -472,41 +492,41 @@ async def ask_question(
     db: Session = Depends(get_db)
 ):
     """Ask question to RAG system (toujours avec mémoire et bon modèle)"""
+    # Embeddings, LLM calls and DB queries are blocking: run the whole pipeline off the event loop
+    return await run_blocking(_answer_question, request, user_id, db)
+
+
+def _answer_question(request: QuestionRequest, user_id: str, db: Session):
+    """/ask pipeline with per-stage timings (histograms, and the `debug` payload when requested)"""
+    trace = request_trace.start("ask", explain=request.debug)
+    try:
+        result = _run_question(request, user_id, db)
+    finally:
+        request_trace.finish_current()
+    if request.debug and isinstance(result, dict):
+        result["debug"] = trace.to_dict()
+    return result
+
+
+def _run_question(request: QuestionRequest, user_id: str, db: Session):
     start_time = time.time()
     try:
         logger.info(f"Processing question from user {user_id}: {request.question}")
         logger.info(f"Selected documents: {request.selected_documents}")
 
         # Récupérer l'historique complet de la conversation si conversation_id fourni
-        history = []
-        if hasattr(request, 'conversation_id') and request.conversation_id:
-            msgs = db.query(Message).filter(Message.conversation_id == request.conversation_id).order_by(Message.created_at.asc()).all()
-            history = [{"role": m.role, "content": m.content} for m in msgs]
-        elif hasattr(request, 'history') and request.history:
-            # fallback: si le frontend envoie déjà l'historique
-            history = request.history
+        with request_trace.stage("history"):
+            history = _load_history(request, db)
 
         answer = None
         agent = None
         model_id = None
         # Si agent_id fourni, comportement agent classique
         if request.agent_id:
-            from database import Agent
-            agent = db.query(Agent).filter(Agent.id == request.agent_id).first()
-            if agent and agent.finetuned_model_id:
-                model_id = agent.finetuned_model_id
-            else:
-                atype = getattr(agent, 'type', 'conversationnel') if agent else 'conversationnel'
-                if atype == 'conversationnel':
-                    model_id = os.getenv('OPENAI_MODEL', None)
-                elif atype == 'actionnable':
-                    model_id = os.getenv('GEMINI_MODEL', 'gemini:gemini-2.0-flash-001')
-                elif atype == 'recherche_live':
-                    model_id = os.getenv('PERPLEXITY_MODEL', 'perplexity:default')
-                else:
-                    model_id = os.getenv('OPENAI_MODEL', None)
-            question_finale = request.question
-            prompt = f"Sachant le contexte et la discussion en cours, réponds à cette question : {question_finale}"
+            with request_trace.stage("agent"):
+                agent = db.query(Agent).filter(Agent.id == request.agent_id).first()
+            model_id = _resolve_model_id(agent)
+            prompt = _agent_prompt(request.question)
             answer = get_answer(
                 prompt,
                 int(user_id),
@@ -514,12 +534,11 @@ async def ask_question(
                 selected_doc_ids=request.selected_documents,
                 agent_id=request.agent_id,
                 history=history,
-                model_id=model_id
+                model_id=model_id,
+                user_question=request.question
             )
         # Si team_id fourni, on va chercher le chef d'équipe et on agit comme pour un agent
         elif request.team_id:
-            from database import Team, Agent
-            import numpy as np
             team = db.query(Team).filter(Team.id == request.team_id).first()
             if not team:
                 raise HTTPException(status_code=404, detail="Team not found")
@@ -531,25 +550,31 @@ async def ask_question(
             # 2. Récupère les agents actionnables
             action_ids = json.loads(team.action_agent_ids) if team.action_agent_ids else []
             action_agents = db.query(Agent).filter(Agent.id.in_(action_ids)).all()
-            # 3. Matching sémantique
+            # 3. Matching sémantique : toutes les candidates en une seule multiplication matrice-vecteur
             best_agent = None
             best_score = -1
+            candidates = []
+            vectors = []
             for a in action_agents:
-                if not a.embedding:
+                if not has_embedding(a):
                     continue
                 try:
-                    emb = np.array(json.loads(a.embedding))
-                    score = float(np.dot(prompt_embedding, emb) / (np.linalg.norm(prompt_embedding) * np.linalg.norm(emb)))
-                    if score > best_score:
-                        best_score = score
-                        best_agent = a
+                    emb = load_unit_embedding(a.embedding_vec, a.embedding)
                 except Exception:
                     continue
+                if emb.shape[0] == len(prompt_embedding):
+                    candidates.append(a)
+                    vectors.append(emb)
+            if candidates:
+                idx, scores = EmbeddingMatrix(vectors, normalized=True).top_k(prompt_embedding, 1)
+                best_agent = candidates[int(idx[0])]
+                best_score = float(scores[0])
+                logger.info(f"Team {team.id}: routed to agent {best_agent.id} (score={best_score:.3f})")
             if not best_agent:
                 raise HTTPException(status_code=400, detail="Aucun agent actionnable qualifié trouvé.")
             # 4. Appel get_answer avec l'agent actionnable
             model_id = best_agent.finetuned_model_id or os.getenv('OPENAI_MODEL', None)
-            prompt = f"Sachant le contexte et la discussion en cours, réponds à cette question : {request.question}"
+            prompt = _agent_prompt(request.question)
             agent_answer = get_answer(
                 prompt,
                 int(user_id),
@@ -557,7 +582,8 @@ async def ask_question(
                 selected_doc_ids=request.selected_documents,
                 agent_id=best_agent.id,
                 history=history,
-                model_id=model_id
+                model_id=model_id,
+                user_question=request.question
             )
             # 5. Réponse formatée du chef d'équipe
             answer = f"Pour répondre à votre question, j'ai fait appel à l'agent {best_agent.name}. Voici sa réponse :\n{agent_answer}"
@@ -888,6 +914,96 @@ async def ask_question(
         return {"answer": f"Désolé, une erreur s'est produite lors du traitement de votre question. Détails: {str(e)}"}
 
 
+def _save_agent_message(conversation_id: int, content: str) -> dict:
+    """Persist a streamed answer as the agent's message (own session: the request one is closed by then)"""
+    db = SessionLocal()
+    try:
+        message = Message(conversation_id=conversation_id, role="agent", content=content)
+        db.add(message)
+        db.commit()
+        return {"message_id": message.id}
+    finally:
+        db.close()
+
+
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@app.post("/ask/stream")
+async def ask_question_stream(
+    request: QuestionRequest,
+    user_id: str = Depends(verify_token),
+    db: Session = Depends(get_db)
+):
+    """Same as /ask, streamed as Server-Sent Events: `token` {delta}, then `done` {answer, message_id} or `error`.
+
+    With conversation_id the complete answer is saved as an agent Message when the stream ends.
+    """
+    start_time = time.time()
+    if not request.agent_id and not request.team_id:
+        raise HTTPException(status_code=400, detail="Aucun agent ou équipe valide fourni.")
+    trace = request_trace.RequestTrace("ask_stream", explain=request.debug)
+    agent = None
+    if request.agent_id:
+        with trace.stage("agent"):
+            agent = await run_blocking(lambda: db.query(Agent).filter(Agent.id == request.agent_id).first())
+
+    extra = {}
+
+    async def on_complete(full_answer: str) -> dict:
+        response_time = time.time() - start_time
+        logger.info(f"Streamed answer for user {user_id} in {response_time:.2f}s")
+        event_tracker.track_question_asked(int(user_id), request.question, response_time)
+        result = dict(extra)
+        if request.conversation_id:
+            result.update(await run_blocking(_save_agent_message, request.conversation_id, full_answer))
+        return result
+
+    if request.team_id or getattr(agent, 'type', '') == 'actionnable':
+        # Team routing and actions need the complete answer: run the /ask pipeline, send it as one event
+        result = await run_blocking(_answer_question, request, user_id, db)
+        if "action_results" in result:
+            extra["action_results"] = result["action_results"]
+        if "debug" in result:
+            extra["debug"] = result["debug"]
+        events = stream_answer_events(None, answer=result.get("answer", ""), on_complete=on_complete)
+    else:
+        with trace.stage("history"):
+            history = await run_blocking(_load_history, request, db)
+        model_id = _resolve_model_id(agent)
+        prompt = await run_blocking(
+            trace.run,
+            build_answer_prompt,
+            _agent_prompt(request.question),
+            int(user_id),
+            db,
+            selected_doc_ids=request.selected_documents,
+            agent_id=request.agent_id,
+            history=history,
+            model_id=model_id,
+            user_question=request.question,
+        )
+        # The stream can last for minutes: do not keep the pooled connection idle meanwhile
+        await run_blocking(release_connection, db)
+
+        async def cache_and_complete(full_answer: str) -> dict:
+            await run_blocking(store_cached_answer, prompt, full_answer)
+            trace.finish()
+            if request.debug:
+                extra["debug"] = trace.to_dict()
+            return await on_complete(full_answer)
+
+        events = stream_answer_events(
+            prompt.get("messages"),
+            model_id=model_id,
+            gemini_only=prompt.get("gemini_only", False),
+            answer=prompt.get("answer"),
+            on_complete=cache_and_complete,
+            trace=trace,
+        )
+    return StreamingResponse(events, media_type="text/event-stream", headers=_SSE_HEADERS)
+
+
 @app.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
@@ -902,118 +1018,15 @@ async def upload_file(
             raise HTTPException(status_code=413, detail="File too large (max 10MB)")
 
         logger.info(f"Début import PJ : filename={file.filename}, content_type={file.content_type if hasattr(file, 'content_type') else 'unknown'}")
-        filename = file.filename.lower()
-        content = await file.read()
-        logger.info(f"PJ reçue : filename={filename}, taille={len(content)} octets")
-        text = None
-
-        if filename.endswith('.pdf'):
-            logger.info("Tentative extraction PDF (pdfplumber)")
-            import pdfplumber
-            import tempfile
-            import tempfile
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                tmp.write(content)
-                tmp.flush()
-                logger.info(f"Fichier PDF temporaire créé : {tmp.name}")
-                try:
-                    with pdfplumber.open(tmp.name) as pdf:
-                        text = '\n'.join([page.extract_text() or '' for page in pdf.pages])
-                    logger.info(f"Texte PDF extrait (pdfplumber) : longueur={len(text) if text else 0}, aperçu='{text[:200] if text else ''}'")
-                except Exception as e:
-                    logger.error(f"PDF extraction error: {e}")
-                # Si le texte est vide, tente l'OCR sur chaque page
-                if not text or not text.strip():
-                    logger.info("PDF vide ou non textuel, tentative OCR (pytesseract)")
-                    try:
-                        from PIL import Image
-                        import pytesseract
-                        with pdfplumber.open(tmp.name) as pdf:
-                            ocr_text = ''
-                            for i, page in enumerate(pdf.pages):
-                                img = page.to_image(resolution=300)
-                                pil_img = img.original
-                                page_ocr = pytesseract.image_to_string(pil_img, lang='fra')
-                                logger.info(f"OCR page {i+1}: longueur={len(page_ocr)}, aperçu='{page_ocr[:100]}'")
-                                ocr_text += page_ocr + '\n'
-                        text = ocr_text
-                        logger.info(f"OCR PDF extrait: longueur={len(text)}, aperçu='{text[:200]}'")
-                    except Exception as e:
-                        logger.error(f"PDF OCR extraction error: {e}")
-            os.unlink(tmp.name)
-        elif filename.endswith('.docx'):
-            logger.info("Tentative extraction DOCX")
-            from docx import Document as DocxDocument
-            import tempfile
-            import tempfile
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.docx') as tmp:
-                tmp.write(content)
-                tmp.flush()
-                logger.info(f"Fichier DOCX temporaire créé : {tmp.name}")
-                try:
-                    doc = DocxDocument(tmp.name)
-                    text = '\n'.join([p.text for p in doc.paragraphs])
-                    logger.info(f"Texte DOCX extrait : longueur={len(text) if text else 0}, aperçu='{text[:200] if text else ''}'")
-                except Exception as e:
-                    logger.error(f"DOCX extraction error: {e}")
-            os.unlink(tmp.name)
-        elif filename.endswith('.pptx'):
-            logger.info("Tentative extraction PPTX")
-            from pptx import Presentation
-            import tempfile
-            import tempfile
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pptx') as tmp:
-                tmp.write(content)
-                tmp.flush()
-                logger.info(f"Fichier PPTX temporaire créé : {tmp.name}")
-                try:
-                    pres = Presentation(tmp.name)
-                    text = '\n'.join([shape.text for slide in pres.slides for shape in slide.shapes if hasattr(shape, "text")])
-                    logger.info(f"Texte PPTX extrait : longueur={len(text) if text else 0}, aperçu='{text[:200] if text else ''}'")
-                except Exception as e:
-                    logger.error(f"PPTX extraction error: {e}")
-            os.unlink(tmp.name)
-        elif filename.endswith('.xlsx'):
-            logger.info("Tentative extraction XLSX")
-            import openpyxl
-            import tempfile
-            import tempfile
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp:
-                tmp.write(content)
-                tmp.flush()
-                logger.info(f"Fichier XLSX temporaire créé : {tmp.name}")
-                try:
-                    wb = openpyxl.load_workbook(tmp.name, data_only=True)
-                    text = ''
-                    for sheet in wb.worksheets:
-                        for row in sheet.iter_rows(values_only=True):
-                            text += '\t'.join([str(cell) if cell is not None else '' for cell in row]) + '\n'
-                    logger.info(f"Texte XLSX extrait : longueur={len(text) if text else 0}, aperçu='{text[:200] if text else ''}'")
-                except Exception as e:
-                    logger.error(f"XLSX extraction error: {e}")
-            os.unlink(tmp.name)
-        elif filename.endswith('.txt') or filename.endswith('.csv') or filename.endswith('.ics'):
-            logger.info("Tentative extraction fichier texte/csv/ics")
-            try:
-                text = content.decode('utf-8', errors='ignore')
-                logger.info(f"Texte fichier texte/csv/ics extrait : longueur={len(text) if text else 0}, aperçu='{text[:200] if text else ''}'")
-            except Exception as e:
-                logger.error(f"Text file decode error: {e}")
-        else:
+        if not is_supported(file.filename):
             raise HTTPException(status_code=400, detail="File type not supported")
+        content = await file.read()
+        logger.info(f"PJ reçue : filename={file.filename}, taille={len(content)} octets")
 
+        # Extraction, chunking and embedding run in the ingestion workers (see GET /ingest/jobs/{job_id})
+        job = await run_blocking(submit_file_job, db, int(user_id), file.filename, content, agent_id=None)
 
-        logger.info(f"Texte extrait de la PJ ({file.filename}): longueur={len(text) if text else 0}, aperçu='{text[:200] if text else ''}'")
-        if not text or not text.strip():
-            raise HTTPException(status_code=400, detail="Aucun texte détecté dans la pièce jointe. Vérifiez que le document contient du texte sélectionnable (pas une image ou un scan).")
-
-        # Process document with extracted text
-        doc_id = process_document_for_user(file.filename, text.encode('utf-8', errors='ignore'), int(user_id), db, agent_id=None)
-
-        logger.info(f"Document uploaded for user {user_id}: {file.filename}")
-        event_tracker.track_document_upload(int(user_id), file.filename, len(text))
-
-        return {"filename": file.filename, "document_id": doc_id, "status": "uploaded"}
+        return {"filename": file.filename, "job_id": job.id, "status": job.status}
 
     except HTTPException:
         raise
@@ -1061,12 +1074,10 @@ async def upload_file_for_agent(
             raise HTTPException(status_code=404, detail="Agent not found or doesn't belong to user")
         
         content = await file.read()
-        doc_id = process_document_for_user(file.filename, content, int(user_id), db, agent_id)
-        
-        logger.info(f"Document uploaded for user {user_id}, agent {agent_id}: {file.filename}")
-        event_tracker.track_document_upload(int(user_id), file.filename, len(content))
-        
-        return {"filename": file.filename, "document_id": doc_id, "agent_id": agent_id, "status": "uploaded"}
+        job = await run_blocking(submit_file_job, db, int(user_id), file.filename, content, agent_id=agent_id)
+        logger.info(f"Document queued for user {user_id}, agent {agent_id}: {file.filename} (job {job.id})")
+
+        return {"filename": file.filename, "job_id": job.id, "agent_id": agent_id, "status": job.status}
     
     except HTTPException:
         raise
@@ -1256,6 +1267,37 @@ async def debug_whoami():
         "metadata_body_snippet": body_snippet
     }
 
+@app.get("/debug/executors")
+async def debug_executors():
+    """Saturation metrics of the blocking thread pool, the CPU process pool and the ingestion workers"""
+    return executor_stats()
+
+@app.get("/debug/cache")
+async def debug_cache():
+    """Hit/miss counters of the embedding, retrieval and answer caches (Redis or in-memory fallback)"""
+    stats = redis_cache.cache_stats()
+    stats["semantic"] = semantic_cache.stats()
+    return stats
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus/OpenMetrics scrape endpoint (requests, LLM/embedding calls, caches, pools, ingestion queue)"""
+    rendered = analytics.render()
+    if rendered is None:
+        raise HTTPException(status_code=503, detail="Metrics disabled (METRICS_ENABLED=false or prometheus_client missing)")
+    body, content_type = rendered
+    return Response(content=body, media_type=content_type)
+
+@app.get("/debug/latency")
+async def debug_latency():
+    """Latency histograms of each answer pipeline stage (ms), for /ask and /ask/stream"""
+    return request_trace.latency_stats()
+
+@app.get("/debug/rerank")
+async def debug_rerank():
+    """Reranker configuration and outcomes (reranked, over budget, failed, skipped when saturated)"""
+    return reranker.stats()
+
 @app.get("/user/documents")
 async def get_user_documents(
     user_id: str = Depends(verify_token),
@@ -1320,10 +1362,17 @@ async def delete_document(
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
+        # Chunks to drop from the ANN indexes once the delete is committed
+        indexed_chunk_ids = [c.id for c in document.chunks if has_embedding(c)]
+        doc_agent_id = document.agent_id
+
         # Delete document
         db.delete(document)
         db.commit()
-        
+
+        retrievers.remove_chunks(indexed_chunk_ids, agent_id=doc_agent_id, user_id=int(user_id))
+        redis_cache.bump_corpus_version(agent_id=doc_agent_id, user_id=int(user_id))
+
         logger.info(f"Document {document_id} deleted by user {user_id}")
         event_tracker.track_user_action(int(user_id), f"document_deleted:{document.filename}")
         
@@ -1338,12 +1387,11 @@ async def delete_document(
 # Endpoints pour les agents
 @app.get("/agents")
 async def get_agents(
-    user_id: str = Depends(verify_token),
-    db: Session = Depends(get_db)
+    user_id: str = Depends(verify_token)
 ):
     """Get user's agents"""
     try:
-        agents = db.query(Agent).filter(Agent.user_id == int(user_id)).all()
+        agents = await read_all(select(Agent).where(Agent.user_id == int(user_id)), scalars=True)
         return {"agents": agents}
     except Exception as e:
         logger.error(f"Error getting agents: {e}")
@@ -1464,8 +1512,10 @@ async def delete_agent(
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found")
         
+        semantic_cache.purge(db, agent_id, include_pinned=True)
         db.delete(agent)
         db.commit()
+        redis_cache.bump_corpus_version(agent_id=agent_id)
         
         return {"message": "Agent deleted successfully"}
     except HTTPException:
@@ -1498,41 +1548,120 @@ async def get_agent(
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+# Cache sémantique des réponses (voir semantic_cache.py), réservé au propriétaire de l'agent
+class SemanticCachePinRequest(BaseModel):
+    pinned: bool = True
+
+
+def _owned_agent_or_404(agent_id: int, user_id: str, db: Session) -> Agent:
+    agent = db.query(Agent).filter(Agent.id == agent_id, Agent.user_id == int(user_id)).first()
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    return agent
+
+
+@app.get("/agents/{agent_id}/semantic-cache")
+async def list_semantic_cache(
+    agent_id: int,
+    limit: int = 100,
+    offset: int = 0,
+    user_id: str = Depends(verify_token),
+    db: Session = Depends(get_db)
+):
+    """Cached questions/answers of an agent, with hit counts and saved tokens"""
+    def load():
+        _owned_agent_or_404(agent_id, user_id, db)
+        entries = semantic_cache.list_entries(db, agent_id, limit=limit, offset=offset)
+        return {
+            "entries": [semantic_cache.entry_to_dict(e) for e in entries],
+            "stats": semantic_cache.agent_stats(db, agent_id),
+            "corpus_version": semantic_cache.corpus_version(db, agent_id),
+        }
+    return await run_blocking(load)
+
+
+@app.put("/agents/{agent_id}/semantic-cache/{entry_id}/pin")
+async def pin_semantic_cache_entry(
+    agent_id: int,
+    entry_id: int,
+    request: SemanticCachePinRequest,
+    user_id: str = Depends(verify_token),
+    db: Session = Depends(get_db)
+):
+    """Pin (or unpin) an entry: pinned answers are served even after the documents change and never evicted"""
+    def update():
+        _owned_agent_or_404(agent_id, user_id, db)
+        return semantic_cache.set_pinned(db, agent_id, entry_id, request.pinned)
+    entry = await run_blocking(update)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Cache entry not found")
+    return {"entry": semantic_cache.entry_to_dict(entry)}
+
+
+@app.delete("/agents/{agent_id}/semantic-cache/{entry_id}")
+async def delete_semantic_cache_entry(
+    agent_id: int,
+    entry_id: int,
+    user_id: str = Depends(verify_token),
+    db: Session = Depends(get_db)
+):
+    """Remove one cached answer"""
+    def delete():
+        _owned_agent_or_404(agent_id, user_id, db)
+        return semantic_cache.delete_entry(db, agent_id, entry_id)
+    if not await run_blocking(delete):
+        raise HTTPException(status_code=404, detail="Cache entry not found")
+    return {"message": "Cache entry deleted"}
+
+
+@app.delete("/agents/{agent_id}/semantic-cache")
+async def purge_semantic_cache(
+    agent_id: int,
+    include_pinned: bool = False,
+    user_id: str = Depends(verify_token),
+    db: Session = Depends(get_db)
+):
+    """Drop the agent's cached answers (pinned ones are kept unless include_pinned=true)"""
+    def purge():
+        _owned_agent_or_404(agent_id, user_id, db)
+        return semantic_cache.purge(db, agent_id, include_pinned=include_pinned)
+    return {"deleted": await run_blocking(purge)}
+
+
+def _team_action_agent_ids(team: Team) -> List[int]:
+    try:
+        return [int(aid) for aid in json.loads(team.action_agent_ids)] if team.action_agent_ids else []
+    except Exception:
+        return []
+
+
+def _agent_names(db: Session, agent_ids) -> dict:
+    """{agent_id: name} for the given ids, loaded with one IN query"""
+    ids = {int(aid) for aid in agent_ids if aid is not None}
+    if not ids:
+        return {}
+    return dict(db.query(Agent.id, Agent.name).filter(Agent.id.in_(ids)).all())
+
+
 @app.get("/teams")
 async def list_teams(user_id: str = Depends(verify_token), db: Session = Depends(get_db)):
     """List teams for the current user."""
     try:
         # Return teams created by the current user
         teams = db.query(Team).filter(Team.user_id == int(user_id)).order_by(Team.created_at.desc()).all()
+        # Leader and action agent names of every team in a single query
+        action_ids = {t.id: _team_action_agent_ids(t) for t in teams}
+        names = _agent_names(db, [t.leader_agent_id for t in teams] + [aid for ids in action_ids.values() for aid in ids])
         out = []
         for t in teams:
-            # Try to resolve leader and action agent names for convenience
-            leader_name = None
-            action_agent_names = []
-            try:
-                leader = db.query(Agent).filter(Agent.id == t.leader_agent_id).first()
-                if leader:
-                    leader_name = leader.name
-            except Exception:
-                leader_name = None
-            try:
-                import json
-                ids = json.loads(t.action_agent_ids) if t.action_agent_ids else []
-                for aid in ids:
-                    a = db.query(Agent).filter(Agent.id == int(aid)).first()
-                    if a:
-                        action_agent_names.append(a.name)
-            except Exception:
-                action_agent_names = []
-
             out.append({
                 "id": t.id,
                 "name": t.name,
                 "contexte": t.contexte,
                 "leader_agent_id": t.leader_agent_id,
-                "leader_name": leader_name,
-                "action_agent_ids": json.loads(t.action_agent_ids) if t.action_agent_ids else [],
-                "action_agent_names": action_agent_names,
+                "leader_name": names.get(t.leader_agent_id),
+                "action_agent_ids": action_ids[t.id],
+                "action_agent_names": [names[aid] for aid in action_ids[t.id] if aid in names],
                 "created_at": t.created_at.isoformat() if t.created_at else None
             })
         return {"teams": out}
@@ -1561,8 +1690,9 @@ async def create_team(payload: dict, user_id: str = Depends(verify_token), db: S
 
         # Valider les membres (uniquement conversationnels)
         member_agents = []
+        owned = {a.id: a for a in db.query(Agent).filter(Agent.id.in_([int(aid) for aid in member_agent_ids]), Agent.user_id == int(user_id)).all()} if member_agent_ids else {}
         for aid in member_agent_ids:
-            a = db.query(Agent).filter(Agent.id == int(aid), Agent.user_id == int(user_id)).first()
+            a = owned.get(int(aid))
             if not a or getattr(a, 'type', '') != 'conversationnel':
                 raise HTTPException(status_code=400, detail=f"Agent {aid} doit être un agent conversationnel appartenant à vous")
             member_agents.append(a)
@@ -1609,23 +1739,10 @@ async def get_team(team_id: int, user_id: str = Depends(verify_token), db: Sessi
         t = db.query(Team).filter(Team.id == team_id, Team.user_id == int(user_id)).first()
         if not t:
             raise HTTPException(status_code=404, detail="Team not found")
-        import json
-        leader_name = None
-        try:
-            leader = db.query(Agent).filter(Agent.id == t.leader_agent_id).first()
-            if leader:
-                leader_name = leader.name
-        except Exception:
-            leader_name = None
-        action_agent_names = []
-        try:
-            ids = json.loads(t.action_agent_ids) if t.action_agent_ids else []
-            for aid in ids:
-                a = db.query(Agent).filter(Agent.id == int(aid)).first()
-                if a:
-                    action_agent_names.append(a.name)
-        except Exception:
-            action_agent_names = []
+        ids = _team_action_agent_ids(t)
+        names = _agent_names(db, [t.leader_agent_id] + ids)
+        leader_name = names.get(t.leader_agent_id)
+        action_agent_names = [names[aid] for aid in ids if aid in names]
 
         return {"team": {
             "id": t.id,
@@ -1717,6 +1834,8 @@ async def update_agent(
 
         db.commit()
         db.refresh(agent)
+        # Le contexte de l'agent fait partie du prompt : invalide ses réponses en cache
+        redis_cache.bump_corpus_version(agent_id=agent.id)
         logger.info(f"[UPDATE_AGENT] Agent modifié avec succès: id={agent.id}, statut={agent.statut}")
         return {"agent": agent}
     except HTTPException:
@@ -1771,15 +1890,16 @@ from fastapi import Query
 @app.get("/conversations", response_model=List[dict])
 async def list_conversations(
     agent_id: int = Query(None),
-    team_id: int = Query(None),
-    db: Session = Depends(get_db)
+    team_id: int = Query(None)
 ):
+    statement = select(Conversation.id, Conversation.title, Conversation.created_at)
     if agent_id is not None:
-        conversations = db.query(Conversation).filter(Conversation.agent_id == agent_id).order_by(Conversation.created_at.desc()).all()
+        statement = statement.where(Conversation.agent_id == agent_id)
     elif team_id is not None:
-        conversations = db.query(Conversation).filter(Conversation.team_id == team_id).order_by(Conversation.created_at.desc()).all()
+        statement = statement.where(Conversation.team_id == team_id)
     else:
         raise HTTPException(status_code=422, detail="agent_id ou team_id doit être fourni")
+    conversations = await read_all(statement.order_by(Conversation.created_at.desc()))
     return [{"id": c.id, "title": c.title, "created_at": c.created_at} for c in conversations]
 
 @app.post("/conversations/{conversation_id}/messages", response_model=dict)
@@ -1791,8 +1911,12 @@ async def add_message(conversation_id: int, msg: MessageCreate, db: Session = De
     return {"message_id": message.id}
 
 @app.get("/conversations/{conversation_id}/messages", response_model=List[dict])
-async def get_messages(conversation_id: int, db: Session = Depends(get_db)):
-    messages = db.query(Message).filter(Message.conversation_id == conversation_id).order_by(Message.timestamp.asc()).all()
+async def get_messages(conversation_id: int):
+    messages = await read_all(
+        select(Message.id, Message.role, Message.content, Message.timestamp)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.timestamp.asc())
+    )
     return [{"id": m.id, "role": m.role, "content": m.content, "timestamp": m.timestamp} for m in messages]
 # Endpoint de connexion agent (email + password)
 class FeedbackRequest(BaseModel):
@@ -1866,6 +1990,11 @@ async def slack_events(request: Request, db: Session = Depends(get_db)):
     # Vérification du challenge lors de l'installation
     if data.get("type") == "url_verification":
         return {"challenge": data["challenge"]}
+    # Slack API calls, DB lookups and the LLM answer are blocking
+    return await run_blocking(_handle_slack_event, data, db)
+
+
+def _handle_slack_event(data: dict, db: Session):
     event = data.get("event", {})
     # On ne traite que les mentions du bot (app_mention)
     if event.get("type") == "app_mention" and "text" in event:
@@ -2102,7 +2231,7 @@ async def public_agent_chat(agent_id: int, req: PublicChatRequest, request: Requ
     history.append({"role": "user", "content": req.message})
 
     try:
-        answer = get_answer(req.message, None, db, agent_id=agent_id, history=history)
+        answer = await aget_answer(req.message, None, db, agent_id=agent_id, history=history)
     except Exception as e:
         logger.exception(f"Error generating public chat answer for agent {agent_id}: {e}")
         raise HTTPException(status_code=500, detail="Error generating answer")
@@ -2116,6 +2245,49 @@ async def public_agent_chat(agent_id: int, req: PublicChatRequest, request: Requ
 
     return {"answer": answer}
 
+@app.post("/public/agents/{agent_id}/chat/stream")
+async def public_agent_chat_stream(agent_id: int, req: PublicChatRequest, request: Request, db: Session = Depends(get_db)):
+    """Streaming (SSE) version of the public chat endpoint. Rate-limited by IP."""
+    agent = await run_blocking(lambda: db.query(Agent).filter(Agent.id == agent_id, Agent.statut == 'public').first())
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found or not public")
+
+    ip = request.client.host if hasattr(request, 'client') and request.client else 'unknown'
+    if not _check_rate_limit(ip):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+
+    history = req.history or []
+    history.append({"role": "user", "content": req.message})
+
+    if getattr(agent, 'type', '') == 'actionnable':
+        # Gemini output of actionnable agents is normalized to plain text: send it in one piece
+        try:
+            answer = _normalize_model_output(await aget_answer(req.message, None, db, agent_id=agent_id, history=history))
+        except Exception as e:
+            logger.exception(f"Error generating public chat answer for agent {agent_id}: {e}")
+            raise HTTPException(status_code=500, detail="Error generating answer")
+        events = stream_answer_events(None, answer=answer)
+    else:
+        try:
+            prompt = await run_blocking(build_answer_prompt, req.message, None, db, agent_id=agent_id, history=history)
+        except Exception as e:
+            logger.exception(f"Error generating public chat answer for agent {agent_id}: {e}")
+            raise HTTPException(status_code=500, detail="Error generating answer")
+        # The stream can last for minutes: do not keep the pooled connection idle meanwhile
+        await run_blocking(release_connection, db)
+
+        async def cache_answer(full_answer: str) -> dict:
+            await run_blocking(store_cached_answer, prompt, full_answer)
+            return {}
+
+        events = stream_answer_events(
+            prompt.get("messages"),
+            gemini_only=prompt.get("gemini_only", False),
+            answer=prompt.get("answer"),
+            on_complete=cache_answer,
+        )
+    return StreamingResponse(events, media_type="text/event-stream", headers=_SSE_HEADERS)
+
 #test
 @app.get("/documents/{document_id}/download-url")
 async def get_signed_download_url(document_id: int, user_id: str = Depends(verify_token), db: Session = Depends(get_db)):
@@ -2168,7 +2340,11 @@ async def get_signed_download_url(document_id: int, user_id: str = Depends(verif
             raise HTTPException(status_code=404, detail="Fichier introuvable dans le bucket GCS")
 
         try:
-            url = blob.generate_signed_url(version="v4", expiration=600, method="GET")
+            # Objects are named by content hash (sha256/<hash><ext>): the download name comes from the document
+            url = blob.generate_signed_url(
+                version="v4", expiration=600, method="GET",
+                response_disposition=f'attachment; filename="{document.filename or os.path.basename(blob_name)}"',
+            )
         except Exception as e:
             logger.exception("Error generating signed URL (permission or signing issue)")
             # Provide a helpful hint without exposing sensitive info
@@ -2302,58 +2478,20 @@ async def extract_text_from_file(file: UploadFile = File(...)):
     logger.info(f"Appel reçu sur /api/agent/extractText : filename={file.filename}, ext={ext}, content_type={getattr(file, 'content_type', 'unknown')}")
     text = ""
     try:
-        if ext == "pdf":
-            logger.info(f"Tentative extraction PDF: {file.filename}")
-            try:
-                with pdfplumber.open(file.file) as pdf:
-                    for i, page in enumerate(pdf.pages):
-                        page_text = page.extract_text()
-                        logger.info(f"Page {i+1} PDF: longueur={len(page_text) if page_text else 0}, aperçu='{page_text[:100] if page_text else ''}'")
-                        if page_text:
-                            text += page_text + "\n"
-            except Exception as e:
-                logger.error(f"Erreur extraction PDF {file.filename}: {e}")
-        elif ext in ["txt", "md", "json", "xml", "csv"]:
-            logger.info(f"Tentative extraction texte: {file.filename}")
-            try:
-                raw = await file.read()
-                text = raw.decode(errors="ignore")
-                logger.info(f"Texte extrait: longueur={len(text)}, aperçu='{text[:200]}'")
-            except Exception as e:
-                logger.error(f"Erreur extraction texte {file.filename}: {e}")
-        elif ext in ["doc", "docx"]:
-            logger.info(f"Tentative extraction DOCX: {file.filename}")
-            try:
-                doc = DocxDocument(file.file)
-                text = "\n".join([p.text for p in doc.paragraphs if p.text.strip()])
-                logger.info(f"Texte DOCX extrait: longueur={len(text)}, aperçu='{text[:200]}'")
-            except Exception as e:
-                logger.error(f"Erreur extraction DOCX {file.filename}: {e}")
-        elif ext in ["xls", "xlsx"]:
-            logger.info(f"Tentative extraction XLSX: {file.filename}")
-            try:
-                wb = openpyxl.load_workbook(file.file, read_only=True)
-                for sheet in wb.worksheets:
-                    for row in sheet.iter_rows(values_only=True):
-                        row_text = "\t".join([str(cell) if cell is not None else "" for cell in row])
-                        text += row_text + "\n"
-                logger.info(f"Texte XLSX extrait: longueur={len(text)}, aperçu='{text[:200]}'")
-            except Exception as e:
-                logger.error(f"Erreur extraction XLSX {file.filename}: {e}")
-        elif ext in ["ppt", "pptx"]:
-            logger.info(f"Tentative extraction PPTX: {file.filename}")
-            try:
-                pres = Presentation(file.file)
-                for slide in pres.slides:
-                    for shape in slide.shapes:
-                        if hasattr(shape, "text"):
-                            text += shape.text + "\n"
-                logger.info(f"Texte PPTX extrait: longueur={len(text)}, aperçu='{text[:200]}'")
-            except Exception as e:
-                logger.error(f"Erreur extraction PPTX {file.filename}: {e}")
-        else:
+        content = await file.read()
+        content_type = getattr(file, 'content_type', None)
+        extractor = get_extractor(file.filename, content_type)
+        if extractor is None:
             logger.warning(f"Type de fichier non supporté: {file.filename}")
             text = f"[Type de fichier non supporté: {file.filename}]"
+        elif extractor is extract_plain_text:
+            text = extract_text(file.filename, content, content_type)
+        elif extractor is extract_pdf:
+            # Pages (and OCR of scanned pages) are fanned out to the process pool by pdf_extraction
+            text = await run_blocking(extract_text, file.filename, content, content_type)
+        else:
+            # Parsing is CPU-bound: run it in the process pool
+            text = await run_cpu(extract_text, file.filename, content, content_type)
     except Exception as e:
         logger.error(f"Erreur extraction {file.filename}: {e}")
         text = f"[Erreur extraction {file.filename}: {e}]"
@@ -2362,10 +2500,8 @@ async def extract_text_from_file(file: UploadFile = File(...)):
 
 
 def get_embedding(text):
-    api_key = os.getenv("OPENAI_API_KEY")
-    if api_key:
-        api_key = api_key.strip()
-    client = openai.OpenAI(api_key=api_key)
+    # Agent/team routing embeddings stay on ada-002 (stored agent vectors use it); reuse the shared client
+    from openai_client import client
     response = client.embeddings.create(
         input=[text],
         model="text-embedding-ada-002"
@@ -2374,7 +2510,8 @@ def get_embedding(text):
 
 def update_agent_embedding(agent, db):
     if agent.contexte:
-        agent.embedding = json.dumps(get_embedding(agent.contexte))
+        agent.embedding_vec = encode_embedding(get_embedding(agent.contexte))
+        agent.embedding = None
         db.commit()
 
 @app.get("/debug/test-openai-embeddings")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Script pour convertir les embeddings JSON (document_chunks.embedding, agents.embedding)
+vers la colonne binaire embedding_vec (BYTEA, voir embedding_codec.py)
+
+Usage: python migrate_embeddings_to_binary.py [--dtype float32|float16|int8] [--batch-size 500] [--clear-json]
+"""
+import sys
+import os
+import json
+import argparse
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import engine
+from sqlalchemy import text
+from embedding_codec import encode_embedding
+
+TABLES = ["document_chunks", "agents"]
+
+
+def add_embedding_vec_columns(conn):
+    """Ajoute la colonne embedding_vec aux tables si elle n'existe pas"""
+    for table in TABLES:
+        result = conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = :table AND column_name = 'embedding_vec'
+        """), {"table": table})
+        if result.fetchone():
+            print(f"✅ La colonne 'embedding_vec' existe déjà dans la table '{table}'")
+            continue
+        print(f"⚠️  Ajout de la colonne 'embedding_vec' à la table '{table}'...")
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN embedding_vec BYTEA"))
+        conn.commit()
+
+
+def convert_table(conn, table: str, dtype: str, batch_size: int, clear_json: bool) -> int:
+    """Convertit les embeddings JSON d'une table par lots (pagination par id)"""
+    converted = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(text(f"""
+            SELECT id, embedding FROM {table}
+            WHERE id > :last_id AND embedding IS NOT NULL AND embedding_vec IS NULL
+            ORDER BY id
+            LIMIT :limit
+        """), {"last_id": last_id, "limit": batch_size}).fetchall()
+        if not rows:
+            break
+        params = []
+        for row_id, embedding in rows:
+            try:
+                params.append({"id": row_id, "vec": encode_embedding(json.loads(embedding), dtype)})
+            except Exception as e:
+                print(f"⚠️  {table} id={row_id}: embedding illisible, ignoré ({e})")
+        if params:
+            if clear_json:
+                conn.execute(text(f"UPDATE {table} SET embedding_vec = :vec, embedding = NULL WHERE id = :id"), params)
+            else:
+                conn.execute(text(f"UPDATE {table} SET embedding_vec = :vec WHERE id = :id"), params)
+        conn.commit()
+        converted += len(params)
+        last_id = rows[-1][0]
+        print(f"  {table}: {converted} embeddings convertis (dernier id={last_id})")
+    return converted
+
+
+def migrate_embeddings(dtype: str, batch_size: int, clear_json: bool) -> bool:
+    try:
+        print("Connexion à la base de données PostgreSQL...")
+        with engine.connect() as conn:
+            add_embedding_vec_columns(conn)
+            for table in TABLES:
+                count = convert_table(conn, table, dtype, batch_size, clear_json)
+                print(f"✅ Table '{table}': {count} embeddings convertis en {dtype}")
+        if clear_json:
+            print("ℹ️  Les colonnes JSON ont été vidées : lancez VACUUM FULL document_chunks, agents pour récupérer l'espace disque.")
+        return True
+    except Exception as e:
+        print(f"❌ Erreur lors de la migration des embeddings: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convertit les embeddings JSON en BYTEA")
+    parser.add_argument("--dtype", choices=["float32", "float16", "int8"], default=os.getenv("EMBEDDING_STORAGE_DTYPE", "float32"))
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--clear-json", action="store_true", help="Vide la colonne JSON une fois la ligne convertie")
+    args = parser.parse_args()
+
+    success = migrate_embeddings(args.dtype, args.batch_size, args.clear_json)
+    if success:
+        print("\n🎉 Migration terminée avec succès!")
+    else:
+        print("\n💥 Échec de la migration")
+        sys.exit(1)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Script pour activer le mode de recherche pgvector (RETRIEVAL_BACKEND=pgvector)
+
+Crée l'extension vector, la colonne document_chunks.embedding_pg, recopie les embeddings existants
+(colonne binaire embedding_vec ou ancien JSON embedding) puis crée l'index ANN (HNSW ou IVFFlat).
+
+L'index couvre toute la table : une requête filtrée par agent ou utilisateur n'obtient de l'index qu'environ
+hnsw.ef_search voisins (PGVECTOR_EF_SEARCH) avant le filtre, si bien qu'un agent qui ne possède qu'une petite
+part des chunks peut recevoir moins de top_k résultats, voire aucun. Avec pgvector >= 0.8 le parcours itératif
+(PGVECTOR_ITERATIVE_SCAN=relaxed_order, par défaut) continue jusqu'à trouver assez de lignes ; sinon, et dans
+tous les cas où l'index revient incomplet, retrievers.PgvectorRetriever relance la requête en parcours exact
+du périmètre.
+
+Usage: python migrate_pgvector.py [--index hnsw|ivfflat|none] [--batch-size 1000]
+                                  [--hnsw-m 16] [--hnsw-ef-construction 64] [--ivf-lists N]
+"""
+import sys
+import os
+import argparse
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import engine
+from sqlalchemy import text
+from embedding_codec import load_embedding
+from retrievers import EMBEDDING_DIMENSION, to_pgvector
+
+INDEX_NAME = "ix_document_chunks_embedding_pg"
+
+
+def add_pgvector_column(conn):
+    """Active l'extension et ajoute la colonne embedding_pg si elle n'existe pas"""
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+    conn.execute(text(f"ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding_pg vector({EMBEDDING_DIMENSION})"))
+    conn.commit()
+    print(f"✅ Colonne document_chunks.embedding_pg vector({EMBEDDING_DIMENSION}) prête")
+
+
+def copy_embeddings(conn, batch_size: int) -> int:
+    """Recopie les embeddings existants dans embedding_pg par lots (pagination par id)"""
+    copied = 0
+    skipped = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(text("""
+            SELECT id, embedding_vec, embedding FROM document_chunks
+            WHERE id > :last_id AND embedding_pg IS NULL
+              AND (embedding_vec IS NOT NULL OR embedding IS NOT NULL)
+            ORDER BY id
+            LIMIT :limit
+        """), {"last_id": last_id, "limit": batch_size}).fetchall()
+        if not rows:
+            break
+        params = []
+        for row_id, embedding_vec, embedding in rows:
+            try:
+                vector = load_embedding(embedding_vec, embedding)
+            except Exception as e:
+                print(f"⚠️  document_chunks id={row_id}: embedding illisible, ignoré ({e})")
+                skipped += 1
+                continue
+            # Vecteurs nuls (embeddings factices) : distance cosinus NaN dans pgvector
+            if vector is None or vector.shape[0] != EMBEDDING_DIMENSION or not vector.any():
+                skipped += 1
+                continue
+            params.append({"id": row_id, "vec": to_pgvector(vector)})
+        if params:
+            conn.execute(text("UPDATE document_chunks SET embedding_pg = CAST(:vec AS vector) WHERE id = :id"), params)
+        conn.commit()
+        copied += len(params)
+        last_id = rows[-1][0]
+        print(f"  document_chunks: {copied} embeddings copiés (dernier id={last_id})")
+    if skipped:
+        print(f"⚠️  {skipped} embeddings ignorés (illisibles, nuls ou dimension différente de {EMBEDDING_DIMENSION})")
+    return copied
+
+
+def create_index(conn, kind: str, hnsw_m: int, hnsw_ef_construction: int, ivf_lists: int):
+    """Crée l'index ANN (distance cosinus) ; CONCURRENTLY pour ne pas bloquer les écritures"""
+    if kind == "none":
+        return
+    conn.commit()
+    conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}"))
+    if kind == "hnsw":
+        conn.execute(text(f"""
+            CREATE INDEX CONCURRENTLY {INDEX_NAME} ON document_chunks
+            USING hnsw (embedding_pg vector_cosine_ops) WITH (m = {hnsw_m}, ef_construction = {hnsw_ef_construction})
+        """))
+    else:
+        if not ivf_lists:
+            # Recommandation pgvector : lignes / 1000 (jusqu'à 1M lignes), sqrt(lignes) au-delà
+            rows = conn.execute(text("SELECT count(*) FROM document_chunks WHERE embedding_pg IS NOT NULL")).scalar() or 0
+            ivf_lists = max(1, rows // 1000 if rows <= 1_000_000 else int(rows ** 0.5))
+        conn.execute(text(f"""
+            CREATE INDEX CONCURRENTLY {INDEX_NAME} ON document_chunks
+            USING ivfflat (embedding_pg vector_cosine_ops) WITH (lists = {ivf_lists})
+        """))
+    conn.execute(text("ANALYZE document_chunks"))
+    print(f"✅ Index {kind} {INDEX_NAME} créé")
+
+
+def migrate(index: str, batch_size: int, hnsw_m: int, hnsw_ef_construction: int, ivf_lists: int) -> bool:
+    try:
+        print("Connexion à la base de données PostgreSQL...")
+        with engine.connect() as conn:
+            add_pgvector_column(conn)
+            count = copy_embeddings(conn, batch_size)
+            print(f"✅ {count} embeddings copiés dans embedding_pg")
+            # L'index est construit après le chargement (bien plus rapide que des insertions indexées)
+            create_index(conn, index, hnsw_m, hnsw_ef_construction, ivf_lists)
+        print("ℹ️  Activez le mode avec RETRIEVAL_BACKEND=pgvector")
+        print("ℹ️  pgvector >= 0.8 recommandé pour le parcours itératif filtré (PGVECTOR_ITERATIVE_SCAN)")
+        return True
+    except Exception as e:
+        print(f"❌ Erreur lors de la migration pgvector: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Active la recherche vectorielle pgvector")
+    parser.add_argument("--index", choices=["hnsw", "ivfflat", "none"], default="hnsw")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--hnsw-m", type=int, default=16)
+    parser.add_argument("--hnsw-ef-construction", type=int, default=64)
+    parser.add_argument("--ivf-lists", type=int, default=0, help="0 = calculé à partir du nombre de lignes")
+    args = parser.parse_args()
+
+    success = migrate(args.index, args.batch_size, args.hnsw_m, args.hnsw_ef_construction, args.ivf_lists)
+    if success:
+        print("\n🎉 Migration terminée avec succès!")
+    else:
+        print("\n💥 Échec de la migration")
+        sys.exit(1)
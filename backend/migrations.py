@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Migrations versionnées du schéma, appliquées au démarrage de l'API (après create_all) ou à la main.
+
+Chaque migration est idempotente et n'est appliquée qu'une fois : sa version est enregistrée dans la table
+schema_migrations. Pour faire évoluer le schéma, ajouter une fonction à la fin de MIGRATIONS (ne jamais
+renuméroter ni modifier une migration déjà déployée) et déclarer la colonne / l'index sur le modèle, pour
+que create_all le crée directement sur une base neuve.
+
+Usage: python migrations.py [--list]
+"""
+import sys
+import os
+import argparse
+import logging
+from datetime import datetime
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+# Clé du verrou consultatif PostgreSQL : plusieurs instances qui démarrent ensemble appliquent les migrations une seule fois
+MIGRATION_LOCK_KEY = 7_413_020
+# Verrou (de session) des constructions d'index CONCURRENTLY : une seule instance construit, les autres démarrent sans attendre
+INDEX_BUILD_LOCK_KEY = 7_413_021
+
+# Index des filtres chauds (nom, table, colonnes), aussi déclarés sur les modèles ; utilisés par scripts/bench_indexes.py
+HOT_INDEXES = [
+    ("ix_documents_agent_id", "documents", ("agent_id",)),
+    ("ix_document_chunks_document_id_chunk_index", "document_chunks", ("document_id", "chunk_index")),
+    ("ix_messages_conversation_id_timestamp", "messages", ("conversation_id", "timestamp")),
+    ("ix_conversations_agent_id_created_at", "conversations", ("agent_id", "created_at")),
+    ("ix_conversations_team_id_created_at", "conversations", ("team_id", "created_at")),
+    ("ix_agents_slack_bot_user_id", "agents", ("slack_bot_user_id",)),
+    ("ix_agents_slack_team_id", "agents", ("slack_team_id",)),
+]
+
+
+def _has_column(conn, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(conn).get_columns(table))
+
+
+def _add_column(conn, table: str, column: str, ddl: str):
+    if _has_column(conn, table, column):
+        return
+    logger.info(f"Adding {table}.{column}...")
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+_deferred_indexes = []  # (name, table, columns) declared by the running migration, built by build_indexes
+
+
+def create_index(conn, name: str, table: str, columns):
+    """Index of a migration. On PostgreSQL it is only declared here and built by run_migrations once the
+    migration's transaction is committed (CREATE INDEX CONCURRENTLY cannot run inside a transaction)."""
+    if conn.dialect.name == "postgresql":
+        _deferred_indexes.append((name, table, tuple(columns)))
+        return
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+
+def build_indexes(engine, indexes) -> bool:
+    """Build missing indexes without blocking writes: CREATE INDEX CONCURRENTLY on an AUTOCOMMIT
+    connection on PostgreSQL (as migrate_pgvector.py does), a plain CREATE INDEX elsewhere.
+
+    An index left INVALID by an interrupted build is dropped and rebuilt. Returns False, without
+    waiting, when another instance is already building indexes.
+    """
+    if engine.dialect.name != "postgresql":
+        with engine.begin() as conn:
+            for name, table, columns in indexes:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+        return True
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": INDEX_BUILD_LOCK_KEY}).scalar():
+            return False
+        try:
+            for name, table, columns in indexes:
+                valid = conn.execute(text(
+                    "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name"
+                ), {"name": name}).scalar()
+                if valid:
+                    continue
+                if valid is not None:
+                    logger.info(f"Rebuilding invalid index {name}...")
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                logger.info(f"Building index {name} on {table} (CONCURRENTLY)...")
+                conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INDEX_BUILD_LOCK_KEY})
+    return True
+
+
+def _binary_type(conn) -> str:
+    return "BYTEA" if conn.dialect.name == "postgresql" else "BLOB"
+
+
+# --- Migrations (ne pas renuméroter) ---
+
+def m001_documents_agent_id(conn):
+    """documents.agent_id (ancien migrate_add_agent_id.py)"""
+    _add_column(conn, "documents", "agent_id", "INTEGER REFERENCES agents(id)")
+
+
+def m002_embedding_vec(conn):
+    """Colonnes d'embedding binaire (conversion des données : migrate_embeddings_to_binary.py)"""
+    for table in ("document_chunks", "agents"):
+        _add_column(conn, table, "embedding_vec", _binary_type(conn))
+
+
+def m003_neighbour_window_index(conn):
+    """Fenêtres de voisins des résultats de recherche (rag_engine._results_from_index_hits)"""
+    create_index(conn, "ix_document_chunks_document_id_chunk_index", "document_chunks", ("document_id", "chunk_index"))
+
+
+def m004_history_tail_index(conn):
+    """Fin d'historique de /ask (ORDER BY timestamp DESC LIMIT n par conversation)"""
+    create_index(conn, "ix_messages_conversation_id_timestamp", "messages", ("conversation_id", "timestamp"))
+
+
+def m005_hot_filter_indexes(conn):
+    """Documents d'un agent, conversations récentes d'un agent / d'une équipe, recherche de l'agent Slack"""
+    for name, table, columns in HOT_INDEXES:
+        create_index(conn, name, table, columns)
+
+
+def m006_content_hashes(conn):
+    """Empreintes de contenu : dédoublonnage des uploads et réutilisation des embeddings (content_hash.py)"""
+    _add_column(conn, "documents", "content_hash", "VARCHAR(64)")
+    _add_column(conn, "document_chunks", "text_hash", "VARCHAR(64)")
+    create_index(conn, "ix_documents_content_hash", "documents", ("content_hash",))
+    create_index(conn, "ix_document_chunks_text_hash", "document_chunks", ("text_hash",))
+
+
+def m007_ingestion_job_heartbeat(conn):
+    """Heartbeat des jobs d'ingestion : un job est perdu après INGEST_JOB_STALE_SECONDS sans progression"""
+    _add_column(conn, "ingestion_jobs", "updated_at", "TIMESTAMP")
+
+
+MIGRATIONS = [
+    (1, m001_documents_agent_id),
+    (2, m002_embedding_vec),
+    (3, m003_neighbour_window_index),
+    (4, m004_history_tail_index),
+    (5, m005_hot_filter_indexes),
+    (6, m006_content_hashes),
+    (7, m007_ingestion_job_heartbeat),
+]
+
+
+def _ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(200) NOT NULL,
+                applied_at TIMESTAMP NOT NULL
+            )
+        """))
+
+
+def applied_versions(conn) -> set:
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def _lock_migrations(conn):
+    if conn.dialect.name == "postgresql":
+        # Released at commit; the instance that waited sees the version already recorded
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+
+def _record(conn, version: int, migration):
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+        {"version": version, "name": migration.__name__, "applied_at": datetime.utcnow()},
+    )
+
+
+def run_migrations(engine) -> list:
+    """Apply the pending migrations in order, each in its own transaction; returns the versions applied.
+
+    On PostgreSQL the indexes of a migration are built after its transaction, outside the migration
+    lock (build_indexes), and the version is recorded once they exist. If another instance is already
+    building them, the version is left for it to record and startup goes on without waiting.
+    """
+    _ensure_version_table(engine)
+    applied = []
+    for version, migration in MIGRATIONS:
+        with engine.begin() as conn:
+            _lock_migrations(conn)
+            if version in applied_versions(conn):
+                continue
+            logger.info(f"Applying migration {version:03d} {migration.__name__}")
+            _deferred_indexes.clear()
+            migration(conn)
+            indexes = list(_deferred_indexes)
+            _deferred_indexes.clear()
+            if not indexes:
+                _record(conn, version, migration)
+                applied.append(version)
+                continue
+        if not build_indexes(engine, indexes):
+            logger.info(f"Migration {version:03d}: indexes already being built by another instance")
+            continue
+        with engine.begin() as conn:
+            _lock_migrations(conn)
+            if version not in applied_versions(conn):
+                _record(conn, version, migration)
+        applied.append(version)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrations versionnées du schéma")
+    parser.add_argument("--list", action="store_true", help="Affiche l'état des migrations sans rien appliquer")
+    args = parser.parse_args()
+
+    from database import engine
+
+    if args.list:
+        _ensure_version_table(engine)
+        with engine.connect() as conn:
+            done = applied_versions(conn)
+        for version, migration in MIGRATIONS:
+            print(f"{'✅' if version in done else '⏳'} {version:03d} {migration.__name__}: {migration.__doc__}")
+        return
+
+    applied = run_migrations(engine)
+    print(f"✅ {len(applied)} migration(s) appliquée(s): {applied}" if applied else "✅ Schéma à jour")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
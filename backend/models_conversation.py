@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship, backref
 from datetime import datetime
 from database import Base
@@ -14,6 +14,12 @@ class Conversation(Base):
     agent = relationship("Agent", backref=backref("conversations", cascade="all, delete-orphan"))
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
 
+    # Conversation lists and the agent's short memory read the newest conversations first
+    __table_args__ = (
+        Index("ix_conversations_agent_id_created_at", "agent_id", "created_at"),
+        Index("ix_conversations_team_id_created_at", "team_id", "created_at"),
+    )
+
 class Message(Base):
     __tablename__ = "messages"
     id = Column(Integer, primary_key=True, index=True)
@@ -25,3 +31,6 @@ class Message(Base):
     buffered = Column(Integer, default=0)  # 0 = non bufferisé, 1 = à bufferiser
 
     conversation = relationship("Conversation", back_populates="messages")
+
+    # History tails are read per conversation, newest first
+    __table_args__ = (Index("ix_messages_conversation_id_timestamp", "conversation_id", "timestamp"),)
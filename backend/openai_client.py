@@ -2,9 +2,13 @@ import os
 from openai import OpenAI
 from google.cloud import secretmanager
 import logging
-from typing import Any, Optional
+from typing import Any, List, Optional
 import json
 
+import analytics
+# count_tokens is also used by rag_engine: one counter for embeddings and prompts
+from token_counter import count_tokens, truncate as truncate_tokens
+
 # Optional import for Gemini/Vertex AI client
 try:
     from gemini_client import generate_text as gemini_generate_text
@@ -62,16 +66,18 @@ if not api_key:
 
 logger.info(f"OpenAI API key found: {'Yes' if api_key else 'No'}")
 
-# Initialize OpenAI client with custom configuration for Cloud Run
+# Initialize OpenAI client with custom configuration for Cloud Run.
+# One long-lived connection pool per process, shared by every thread (see llm_providers for the async client)
 import httpx
+from llm_providers import http_limits, http2_enabled, LLM_HTTP_TIMEOUT
 client = OpenAI(
     api_key=api_key,
-    timeout=30.0,
+    timeout=LLM_HTTP_TIMEOUT,
     max_retries=3,
     http_client=httpx.Client(
-        timeout=30.0,
-        limits=httpx.Limits(max_connections=5, max_keepalive_connections=2),
-        http2=False  # Force HTTP/1.1 for better Cloud Run compatibility
+        timeout=LLM_HTTP_TIMEOUT,
+        limits=http_limits(),
+        http2=http2_enabled()
     )
 )
 
@@ -83,18 +89,26 @@ try:
 except Exception:
     DEFAULT_MAX_TOKENS = 1000
 
+# One embedding model for chunks, agents and queries: vectors of different models are not comparable
+EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+# Seconds before a query-time embedding call gives up
+EMBEDDING_FAST_TIMEOUT = float(os.getenv("EMBEDDING_FAST_TIMEOUT", "5"))
+
 def get_embedding_fast(text: str) -> list:
-    """Get embedding for text with fast timeout"""
+    """Get embedding for text with fast timeout (query time: callers fall back to lexical search)
+
+    Raises on failure: a zero vector would silently match nothing (or everything) downstream.
+    """
     try:
-        response = client.embeddings.create(
-            input=text,
-            model="text-embedding-3-small"
-        )
+        with analytics.track_embedding(EMBEDDING_MODEL, "query"):
+            response = client.with_options(timeout=EMBEDDING_FAST_TIMEOUT, max_retries=1).embeddings.create(
+                input=text,
+                model=EMBEDDING_MODEL
+            )
         return response.data[0].embedding
     except Exception as e:
         logger.error(f"Error getting fast embedding: {e}")
-        # Return dummy embedding immediately
-        return [0.0] * 1536  # text-embedding-3-small has 1536 dimensions
+        raise
 
 def get_embedding(text: str) -> list:
     """Get embedding for text with robust retry logic"""
@@ -104,10 +118,11 @@ def get_embedding(text: str) -> list:
     for attempt in range(max_retries):
         try:
             logger.info(f"Attempting to get embedding (attempt {attempt + 1}/{max_retries})")
-            response = client.embeddings.create(
-                input=text,
-                model="text-embedding-3-small"
-            )
+            with analytics.track_embedding(EMBEDDING_MODEL, "single"):
+                response = client.embeddings.create(
+                    input=text,
+                    model=EMBEDDING_MODEL
+                )
             logger.info("Successfully got embedding from OpenAI")
             return response.data[0].embedding
         except Exception as e:
@@ -122,6 +137,75 @@ def get_embedding(text: str) -> list:
 
 
 
+# Batch embedding limits (OpenAI: 2048 inputs and ~300k tokens per request, 8191 tokens per input)
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "2048"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "250000"))
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+
+def _truncate_for_embedding(text: str) -> tuple:
+    """Return (text, token_count), truncating the text to the per-input token limit (cl100k_base)."""
+    return truncate_tokens(text, EMBEDDING_MAX_INPUT_TOKENS)
+
+
+def _plan_embedding_batches(token_counts: List[int]) -> List[List[int]]:
+    """Group input positions into batches respecting the input-count and token limits."""
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, n in enumerate(token_counts):
+        if current and (len(current) >= EMBEDDING_BATCH_MAX_INPUTS or current_tokens + n > EMBEDDING_BATCH_MAX_TOKENS):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += n
+    if current:
+        batches.append(current)
+    return batches
+
+
+def get_embeddings_batch(texts: List[str], model: str = None, max_retries: int = 5) -> List[Optional[list]]:
+    """Embed many texts with as few embeddings.create calls as the API limits allow.
+
+    Returns one embedding per input, in order. Empty inputs, and inputs whose batch still fails
+    after retries, get None so callers can store them for a later backfill instead of a dummy vector.
+    """
+    import time
+    model = model or EMBEDDING_MODEL
+    results: List[Optional[list]] = [None] * len(texts)
+    positions = [i for i, t in enumerate(texts) if t and t.strip()]
+    prepared = [_truncate_for_embedding(texts[i]) for i in positions]
+    batches = _plan_embedding_batches([n for _, n in prepared])
+    logger.info(f"Embedding {len(positions)} texts in {len(batches)} request(s)")
+
+    for batch_num, batch in enumerate(batches, 1):
+        inputs = [prepared[j][0] for j in batch]
+        for attempt in range(max_retries):
+            try:
+                with analytics.track_embedding(model, "batch", len(inputs)):
+                    response = client.embeddings.create(input=inputs, model=model)
+                for item in response.data:
+                    results[positions[batch[item.index]]] = item.embedding
+                break
+            except Exception as e:
+                logger.error(f"Error getting batch embeddings (batch {batch_num}/{len(batches)}, attempt {attempt + 1}/{max_retries}): {e}")
+                if attempt < max_retries - 1:
+                    wait_time = 2 ** attempt  # Exponential backoff
+                    # Honour the server's Retry-After on rate limits (429)
+                    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+                    retry_after = headers.get("retry-after")
+                    if retry_after:
+                        try:
+                            wait_time = max(wait_time, float(retry_after))
+                        except ValueError:
+                            pass
+                    logger.info(f"Waiting {wait_time} seconds before retry...")
+                    time.sleep(wait_time)
+                else:
+                    logger.error(f"Giving up on batch {batch_num}: {len(batch)} texts left without embedding")
+    return results
+
+
 def get_chat_response(messages: list, model_id: str = None, gemini_only: bool = False) -> str:
     """Get chat response from OpenAI with robust retry logic, custom model, and structured messages"""
     import time
@@ -136,7 +220,8 @@ def get_chat_response(messages: list, model_id: str = None, gemini_only: bool =
             model_short = model.split(':', 1)[1]
             prompt = _messages_to_prompt(messages)
             try:
-                return gemini_generate_text(prompt, model_name=model_short, temperature=0.7, max_tokens=max_tokens)
+                with analytics.track_llm("vertex", model_short):
+                    return gemini_generate_text(prompt, model_name=model_short, temperature=0.7, max_tokens=max_tokens)
             except Exception as e:
                 env_gemini_only = os.getenv("GEMINI_ONLY", "false").lower() in ("1", "true", "yes")
                 strict = bool(gemini_only) or env_gemini_only
@@ -154,12 +239,14 @@ def get_chat_response(messages: list, model_id: str = None, gemini_only: bool =
     for attempt in range(max_retries):
         try:
             logger.info(f"Attempting to get chat response (attempt {attempt + 1}/{max_retries}) with model {model}")
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=0.7
-            )
+            with analytics.track_llm("openai", model):
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.7
+                )
+            analytics.record_llm_usage("openai", model, getattr(response, "usage", None))
             logger.info("Successfully got response from OpenAI")
             return response.choices[0].message.content
         except Exception as e:
@@ -0,0 +1,190 @@
+# Extraction PDF page par page : les pages sont réparties sur le pool de processus (executors.cpu_pool), l'OCR
+# n'est lancé que sur les pages scannées (image sans couche texte), le texte est rendu dans l'ordre des pages
+# au fur et à mesure et un budget de temps par document borne l'OCR des scans très longs.
+import os
+import time
+import shutil
+import logging
+import tempfile
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import wait, FIRST_COMPLETED
+from typing import Iterator, List, Optional, Tuple
+
+import pdfplumber
+
+logger = logging.getLogger(__name__)
+
+# Pages per text-layer task: amortizes opening the PDF in the worker process
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+# A page with an image and fewer extracted characters than this is OCR'd
+PDF_OCR_MIN_CHARS = int(os.getenv("PDF_OCR_MIN_CHARS", "25"))
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "300"))
+PDF_OCR_LANG = os.getenv("PDF_OCR_LANG", "fra")
+# Seconds of OCR per document; past it, scanned pages not OCR'd yet keep their (near-empty) text layer.
+# The text layer of every page is always extracted. 0 = no limit
+PDF_EXTRACT_TIME_BUDGET = float(os.getenv("PDF_EXTRACT_TIME_BUDGET", "120"))
+
+
+@lru_cache(maxsize=1)
+def ocr_available() -> bool:
+    try:
+        import pytesseract  # noqa: F401
+    except Exception:
+        return False
+    return shutil.which("tesseract") is not None
+
+
+def _needs_ocr(page, text: str) -> bool:
+    # Scanned pages are an image with no (or a near-empty) text layer; blank pages are not worth an OCR pass
+    return len(text.strip()) < PDF_OCR_MIN_CHARS and bool(page.images)
+
+
+def extract_page_range(path: str, first: int, last: int) -> List[Tuple[int, str, bool]]:
+    """Text layer of pages [first, last) as (page_number, text, needs_ocr). Runs in a worker process."""
+    results = []
+    with pdfplumber.open(path) as pdf:
+        for number in range(first, min(last, len(pdf.pages))):
+            page = pdf.pages[number]
+            try:
+                text = page.extract_text() or ""
+            except Exception as e:
+                logger.warning(f"PDF page {number + 1}: text extraction failed: {e}")
+                text = ""
+            results.append((number, text, _needs_ocr(page, text)))
+            # pdfplumber caches the parsed objects of every page it visited
+            page.close()
+    return results
+
+
+def ocr_page(path: str, number: int, dpi: int = PDF_OCR_DPI, lang: str = PDF_OCR_LANG) -> str:
+    """OCR of one page rendered at `dpi`. Runs in a worker process."""
+    import pytesseract
+    with pdfplumber.open(path) as pdf:
+        image = pdf.pages[number].to_image(resolution=dpi).original
+    return pytesseract.image_to_string(image, lang=lang)
+
+
+def _use_process_pool() -> bool:
+    from executors import CPU_POOL_SIZE
+    # Inside a worker process (run_cpu) the pages are processed in place: no nested pools
+    return CPU_POOL_SIZE > 0 and multiprocessing.parent_process() is None
+
+
+def iter_pdf_pages(content: bytes, time_budget: Optional[float] = None, report: Optional[dict] = None) -> Iterator[Tuple[int, str]]:
+    """Yield (page_number, text) in page order, each page as soon as it and the pages before it are done.
+
+    `report`, when given, is filled with page / OCR counts and whether the time budget cut OCR short.
+    """
+    budget = PDF_EXTRACT_TIME_BUDGET if time_budget is None else time_budget
+    report = report if report is not None else {}
+    started = time.perf_counter()
+    deadline = started + budget if budget > 0 else None
+    fd, path = tempfile.mkstemp(suffix=".pdf", prefix="pdf_extract_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        with pdfplumber.open(path) as pdf:
+            page_count = len(pdf.pages)
+        report.update(pages=page_count, ocr_pages=0, ocr_skipped=0, failed_pages=0, timed_out=False)
+        pages = _iter_pooled(path, page_count, deadline, report) if _use_process_pool() else _iter_inline(path, page_count, deadline, report)
+        yield from pages
+    finally:
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    if report.get("timed_out"):
+        logger.warning(f"PDF extraction stopped by its {budget}s budget: {report}")
+    else:
+        logger.info(f"PDF extracted: {report}")
+
+
+def _iter_inline(path: str, page_count: int, deadline: Optional[float], report: dict) -> Iterator[Tuple[int, str]]:
+    can_ocr = ocr_available()
+    for first in range(0, page_count, PDF_PAGES_PER_TASK):
+        for number, text, needs_ocr in extract_page_range(path, first, first + PDF_PAGES_PER_TASK):
+            if needs_ocr and can_ocr:
+                if deadline is not None and time.perf_counter() > deadline:
+                    report["timed_out"] = True
+                    report["ocr_skipped"] += 1
+                else:
+                    try:
+                        text = ocr_page(path, number)
+                        report["ocr_pages"] += 1
+                    except Exception as e:
+                        logger.warning(f"PDF page {number + 1}: OCR failed: {e}")
+            yield number, text
+
+
+def _iter_pooled(path: str, page_count: int, deadline: Optional[float], report: dict) -> Iterator[Tuple[int, str]]:
+    from executors import cpu_pool
+    ocr_allowed = ocr_available()
+    kinds = {}  # future -> ("range", first, last) | ("ocr", page_number)
+    for first in range(0, page_count, PDF_PAGES_PER_TASK):
+        last = min(first + PDF_PAGES_PER_TASK, page_count)
+        kinds[cpu_pool.submit(extract_page_range, path, first, last)] = ("range", first, last)
+    pending = set(kinds)
+    layer = {}  # page -> text layer, kept as the fallback of pages waiting for OCR
+    finished = {}  # page -> final text
+    next_page = 0
+    try:
+        while next_page < page_count:
+            if next_page in finished:
+                yield next_page, finished.pop(next_page)
+                next_page += 1
+                continue
+            # The budget bounds OCR; text-layer tasks are always waited for
+            timeout = None
+            if deadline is not None and ocr_allowed:
+                timeout = max(0.0, deadline - time.perf_counter())
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                report["timed_out"] = True
+                ocr_allowed = False
+                for future in [f for f in pending if kinds[f][0] == "ocr"]:
+                    future.cancel()
+                    pending.discard(future)
+                    number = kinds.pop(future)[1]
+                    report["ocr_skipped"] += 1
+                    finished[number] = layer.pop(number, "")
+                continue
+            for future in done:
+                pending.discard(future)
+                kind = kinds.pop(future)
+                if kind[0] == "range":
+                    _, first, last = kind
+                    try:
+                        rows = future.result()
+                    except Exception as e:
+                        logger.warning(f"PDF pages {first + 1}-{last}: extraction failed: {e}")
+                        report["failed_pages"] += last - first
+                        rows = [(number, "", False) for number in range(first, last)]
+                    for number, text, needs_ocr in rows:
+                        if needs_ocr and ocr_allowed:
+                            layer[number] = text
+                            ocr_future = cpu_pool.submit(ocr_page, path, number)
+                            kinds[ocr_future] = ("ocr", number)
+                            pending.add(ocr_future)
+                            continue
+                        if needs_ocr and report["timed_out"]:
+                            report["ocr_skipped"] += 1
+                        finished[number] = text
+                else:
+                    number = kind[1]
+                    try:
+                        finished[number] = future.result()
+                        report["ocr_pages"] += 1
+                        layer.pop(number, None)
+                    except Exception as e:
+                        logger.warning(f"PDF page {number + 1}: OCR failed: {e}")
+                        finished[number] = layer.pop(number, "")
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def extract_pdf_text(content: bytes, time_budget: Optional[float] = None) -> str:
+    """Full text of a PDF, pages joined by newlines (see iter_pdf_pages)."""
+    return "\n".join(text for _, text in iter_pdf_pages(content, time_budget=time_budget))
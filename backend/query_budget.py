@@ -0,0 +1,51 @@
+# Comptage des requêtes SQL émises par un bloc de code ou un endpoint : garde-fou contre les régressions N+1
+# (voir scripts/check_query_budget.py pour les budgets des endpoints).
+import threading
+from contextlib import contextmanager
+from typing import List
+
+from sqlalchemy import event
+
+from database import engine
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a block issues more SQL statements than its budget."""
+
+
+class QueryCounter:
+    """SQL statements executed on an engine while the counter is active."""
+
+    def __init__(self):
+        self.statements: List[str] = []
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        with self._lock:
+            self.statements.append(" ".join(statement.split()))
+
+
+@contextmanager
+def count_queries(bind=None):
+    """Count the statements sent through `bind` (default: the app engine), from any thread."""
+    bind = bind if bind is not None else engine
+    counter = QueryCounter()
+    event.listen(bind, "before_cursor_execute", counter._on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(bind, "before_cursor_execute", counter._on_execute)
+
+
+@contextmanager
+def query_budget(max_queries: int, label: str = "", bind=None):
+    """Fail with QueryBudgetExceeded if the block runs more than `max_queries` statements."""
+    with count_queries(bind) as counter:
+        yield counter
+    if counter.count > max_queries:
+        listing = "\n".join(f"  {i}. {sql[:200]}" for i, sql in enumerate(counter.statements, 1))
+        raise QueryBudgetExceeded(f"{label or 'block'}: {counter.count} queries, budget {max_queries}\n{listing}")
@@ -1,30 +1,60 @@
 
 # Contient la logique RAG améliorée
+import os
 import json
 import logging
 import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
+from sqlalchemy import and_, or_, func
 from sqlalchemy.orm import Session
-from openai_client import get_embedding, get_chat_response, get_embedding_fast
-from database import Document, DocumentChunk, User, Agent
-from file_loader import load_text_from_pdf, chunk_text
+from openai_client import get_embedding, get_embedding_fast, get_chat_response, get_embeddings_batch, count_tokens, EMBEDDING_MODEL, DEFAULT_MODEL, DEFAULT_MAX_TOKENS
+from database import Document, DocumentChunk, User, Agent, release_connection
+from chunker import chunk_text
+from extractors import extract_text, is_supported
 from file_generator import FileGenerator
+from embedding_codec import encode_embedding
+from content_hash import content_hash, text_hash, text_hashes
+from similarity import EmbeddingMatrix
+from llm_providers import achat, chat_blocking
+from executors import run_blocking
+import redis_cache
+import semantic_cache
+import context_packer
+import reranker
+import request_trace
+
+# Dense retrieval backend (exact / FAISS / pgvector), see retrievers.RETRIEVAL_BACKEND
+import retrievers
+import lexical_index
 
 logger = logging.getLogger(__name__)
 
-# Cache simple pour les réponses récentes
-_answer_cache = {}
+# Hybrid retrieval: dense and BM25 candidate lists fused by reciprocal rank (score = sum 1 / (k + rank))
+RAG_HYBRID_ENABLED = os.getenv("RAG_HYBRID_ENABLED", "true").lower() in ("1", "true", "yes")
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+# Candidates taken from each retriever before fusion
+RAG_HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "30"))
+# Hits with the same chunk text (same file uploaded twice or to several agents) count once in the top-k
+RAG_DEDUP_ENABLED = os.getenv("RAG_DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+# Chunks added before and after each hit for context
+RAG_NEIGHBOR_WINDOW = int(os.getenv("RAG_NEIGHBOR_WINDOW", "1"))
+# Last conversation messages included in the prompt (and loaded from the database)
+RAG_HISTORY_MESSAGES = 5
+# get_documents_summary: preview length, built from at most this many leading chunks
+SUMMARY_PREVIEW_CHARS = 2000
+SUMMARY_PREVIEW_CHUNKS = 3
 
 def get_last_message_for_agent(agent_id: int, db: Session) -> str:
     """Retourne le dernier message envoyé à l'agent (mémoire courte par agent)."""
     from models_conversation import Message, Conversation
-    # Récupère la dernière conversation de l'agent
-    conv = db.query(Conversation).filter(Conversation.agent_id == agent_id).order_by(Conversation.created_at.desc()).first()
+    # Récupère la dernière conversation de l'agent (index ix_conversations_agent_id_created_at)
+    conv = db.query(Conversation.id).filter(Conversation.agent_id == agent_id).order_by(Conversation.created_at.desc()).first()
     if not conv:
         return ""
-    # Récupère le dernier message de la conversation
-    msg = db.query(Message).filter(Message.conversation_id == conv.id).order_by(Message.timestamp.desc()).first()
+    # Récupère le dernier message de la conversation (index ix_messages_conversation_id_timestamp)
+    msg = db.query(Message.content).filter(Message.conversation_id == conv.id).order_by(Message.timestamp.desc()).first()
     if not msg:
         return ""
     return msg.content
@@ -32,15 +62,12 @@ def get_last_message_for_agent(agent_id: int, db: Session) -> str:
 def get_answer_with_files(question: str, user_id: int, db: Session, selected_doc_ids: List[int] = None, agent_type: str = None) -> Dict[str, Any]:
     """Get answer using RAG with file generation capabilities"""
     try:
-        # Créer une clé de cache
-        cache_key = f"{user_id}_{hash(question)}_{hash(str(selected_doc_ids))}_{agent_type}"
-        
-        # Vérifier le cache (garde en cache pendant 5 minutes)
-        if cache_key in _answer_cache:
-            cached_time, cached_result = _answer_cache[cache_key]
-            if datetime.now().timestamp() - cached_time < 300:  # 5 minutes
-                logger.info("Returning cached answer")
-                return cached_result
+        # Clé stable (sha256) : partagée entre workers et instances via redis_cache
+        cache_key = redis_cache.answer_key(question, None, user_id, selected_doc_ids, "with_files", agent_type)
+        cached_result = redis_cache.get("answer", cache_key)
+        if cached_result is not None:
+            logger.info("Returning cached answer")
+            return cached_result
         
         # Get the regular answer first
         answer = get_answer(question, user_id, db, selected_doc_ids, agent_type)
@@ -69,12 +96,7 @@ def get_answer_with_files(question: str, user_id: int, db: Session, selected_doc
         }
         
         # Mettre en cache le résultat
-        _answer_cache[cache_key] = (datetime.now().timestamp(), result)
-        
-        # Nettoyer le cache (garder seulement les 10 dernières entrées)
-        if len(_answer_cache) > 10:
-            oldest_key = min(_answer_cache.keys(), key=lambda k: _answer_cache[k][0])
-            del _answer_cache[oldest_key]
+        redis_cache.put("answer", cache_key, result, redis_cache.ANSWER_CACHE_TTL)
             
         return result
         
@@ -105,17 +127,71 @@ def get_direct_gpt_response(question: str, db: Session, agent_id: int = None) ->
         raise Exception(f"Erreur lors du traitement de votre question : {str(e)}")
 
 
-def get_answer(
+def build_answer_prompt(
     question: str,
     user_id: int,
     db: Session,
     selected_doc_ids: List[int] = None,
     agent_id: int = None,
     history: list = None,
-    model_id: str = None
-) -> str:
-    """Get answer using RAG for specific user with OpenAI - always using embeddings, memory, and custom model if provided"""
-    try:
+    model_id: str = None,
+    user_question: str = None
+) -> Dict[str, Any]:
+    """Prepare the LLM call for get_answer/aget_answer (DB lookups, query embedding, retrieval).
+
+    `question` goes into the prompt; `user_question` is the text the user typed when the caller wrapped it
+    in an instruction (see main._agent_prompt). The query embedding, the BM25 query and the semantic cache
+    use the latter, so the instruction's words do not match every chunk that happens to contain them.
+
+    Returns {"messages": [...], "gemini_only": bool, "answer": None, "cache_key": ...}, or
+    {"answer": "..."} when the question can be answered without calling the model (including a
+    cached answer). Callers store the model's answer with store_cached_answer(prompt, answer).
+    """
+    user_question = user_question or question
+    # Réponse déjà calculée pour la même question, le même corpus et le même modèle (toutes instances)
+    cache_key = _answer_cache_key(question, user_id, selected_doc_ids, agent_id, history, model_id)
+    with request_trace.stage("cache"):
+        cached = redis_cache.get("answer", cache_key)
+    if cached is not None:
+        logger.info("Returning cached answer")
+        request_trace.note("cache", "exact")
+        return {"answer": cached, "cached": True}
+
+    # Cache sémantique par agent : une question formulée autrement mais équivalente réutilise la réponse
+    embedding_state = {}
+
+    def question_embedding():
+        # Computed at most once per call (and cached per model/text); None when the embedding API is down
+        if "value" not in embedding_state:
+            try:
+                logger.info(f"Getting embedding for question: {user_question}")
+                with request_trace.stage("embedding"):
+                    embedding_state["value"] = redis_cache.get_query_embedding(user_question, EMBEDDING_MODEL, get_embedding_fast)
+                logger.info("Successfully got query embedding")
+            except Exception as e:
+                logger.warning(f"Query embedding unavailable, using lexical retrieval only: {e}")
+                embedding_state["value"] = None
+        return embedding_state["value"]
+
+    semantic = None
+    if agent_id and not selected_doc_ids and semantic_cache.SEMANTIC_CACHE_ENABLED and semantic_cache.is_standalone(user_question, history):
+        try:
+            query_embedding = question_embedding()
+            if query_embedding is None:
+                raise RuntimeError("no query embedding")
+            with request_trace.stage("semantic_cache"):
+                version = semantic_cache.corpus_version(db, agent_id)
+                entry = semantic_cache.lookup(db, agent_id, query_embedding, version, model_id=model_id)
+            if entry is not None:
+                redis_cache.put("answer", cache_key, entry.answer, redis_cache.ANSWER_CACHE_TTL)
+                request_trace.note("cache", "semantic")
+                return {"answer": entry.answer, "cached": "semantic"}
+            semantic = {"agent_id": agent_id, "question": user_question, "embedding": query_embedding, "version": version, "model_id": model_id}
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {e}")
+
+    # Mémoire courte, documents et contexte de l'agent
+    with request_trace.stage("agent"):
         # Ajoute la mémoire courte par agent
         last_agent_message = None
         if agent_id:
@@ -148,152 +224,368 @@ def get_answer(
             agent = db.query(Agent).filter(Agent.user_id == user_id).first()
         contexte_agent = agent.contexte if agent and agent.contexte else ""
 
-        # Si pas de documents, fallback sur le contexte + mémoire
-        if not user_docs:
-            if selected_doc_ids:
-                return "Aucun des documents sélectionnés n'a été trouvé. Veuillez vérifier votre sélection."
-            else:
-                logger.info("No documents found, using context + question + memory only")
-                # Prépare la liste messages pour OpenAI
-                messages = []
-                if contexte_agent:
-                    messages.append({"role": "system", "content": contexte_agent})
-                # Ajoute un résumé des 5 derniers échanges dans le prompt utilisateur
-                if history:
-                    last_msgs = history[-5:]
-                    discussion = "\n".join([f"{m['role']}: {m['content']}" for m in last_msgs])
-                    user_prompt = f"Voici la discussion en cours :\n{discussion}\n\nEt maintenant voici ma question : {question}"
-                else:
-                    user_prompt = question
-                messages.append({"role": "user", "content": user_prompt})
-                logger.info("[PROMPT OPENAI] %s", json.dumps(messages, ensure_ascii=False, indent=2))
-                # If this request is for an actionnable agent, enforce Gemini-only (no OpenAI fallback)
-                gemini_only_flag = False
-                try:
-                    gemini_only_flag = bool(agent and getattr(agent, 'type', '') == 'actionnable')
-                except Exception:
-                    gemini_only_flag = False
-                response = get_chat_response(messages, model_id=model_id, gemini_only=gemini_only_flag)
-                return response
-
-        # Always get question embedding with retry
-        logger.info(f"Getting embedding for question: {question}")
-        query_embedding = get_embedding(question)
-        logger.info("Successfully got query embedding")
-
-        # Search similar chunks for this user (with optional document filtering)
-        logger.info(f"Searching similar texts for user {user_id}")
-        context_results = search_similar_texts_for_user(query_embedding, user_id, db, top_k=8, selected_doc_ids=selected_doc_ids, agent_id=agent_id)
-
-        # Préparer le contexte RAG
-        context_by_document = {}
-        for result in context_results:
-            doc_name = result['document_name']
-            if doc_name not in context_by_document:
-                context_by_document[doc_name] = []
-            context_by_document[doc_name].append(result['text'])
-
-        # Build enhanced context string
-        enhanced_context = ""
-        for doc_name, contexts in context_by_document.items():
-            enhanced_context += f"\n--- Extraits du document '{doc_name}' ---\n"
-            for i, context in enumerate(contexts, 1):
-                enhanced_context += f"Extrait {i}: {context}\n"
-
-        # Prompt final : contexte agent + mémoire courte + historique + question + extraits RAG
+    # If this request is for an actionnable agent, enforce Gemini-only (no OpenAI fallback)
+    gemini_only_flag = False
+    try:
+        gemini_only_flag = bool(agent and getattr(agent, 'type', '') == 'actionnable')
+    except Exception:
+        gemini_only_flag = False
+
+    # Si pas de documents, fallback sur le contexte + mémoire
+    if not user_docs:
+        if selected_doc_ids:
+            return {"answer": "Aucun des documents sélectionnés n'a été trouvé. Veuillez vérifier votre sélection."}
+        logger.info("No documents found, using context + question + memory only")
+        # Prépare la liste messages pour OpenAI
         messages = []
         if contexte_agent:
             messages.append({"role": "system", "content": contexte_agent})
-        if last_agent_message:
-            messages.append({"role": "assistant", "content": f"Mémoire agent : {last_agent_message}"})
         # Ajoute un résumé des 5 derniers échanges dans le prompt utilisateur
         if history:
-            last_msgs = history[-5:]
+            last_msgs = history[-RAG_HISTORY_MESSAGES:]
             discussion = "\n".join([f"{m['role']}: {m['content']}" for m in last_msgs])
-            user_content = f"Voici la discussion en cours :\n{discussion}\n\nEt maintenant voici ma question : {question}\n\nExtraits de documents :\n{enhanced_context}"
+            user_prompt = f"Voici la discussion en cours :\n{discussion}\n\nEt maintenant voici ma question : {question}"
         else:
-            user_content = f"{question}\n\nExtraits de documents :\n{enhanced_context}"
-        messages.append({"role": "user", "content": user_content})
+            user_prompt = question
+        messages.append({"role": "user", "content": user_prompt})
         logger.info("[PROMPT OPENAI] %s", json.dumps(messages, ensure_ascii=False, indent=2))
+        return {"messages": messages, "gemini_only": gemini_only_flag, "answer": None, "cache_key": cache_key, "semantic": semantic}
+
+    # Hybrid (dense + BM25) search over the agent's or user's chunks; the results are cached per corpus version
+    retrieval_key = redis_cache.retrieval_key(user_question, agent_id, user_id, 8, selected_doc_ids, reranker.RERANK_PROVIDER)
+    with request_trace.stage("cache"):
+        context_results = redis_cache.get("retrieval", retrieval_key)
+    request_trace.note("retrieval_cached", context_results is not None)
+    if context_results is None:
+        query_embedding = question_embedding()
+        logger.info(f"Searching similar texts for user {user_id}")
+        context_results = search_similar_texts_for_user(query_embedding, user_id, db, top_k=8, selected_doc_ids=selected_doc_ids, agent_id=agent_id, question=user_question)
+        # Lexical-only results (embedding API down) and unreranked fallbacks (reranker over budget) are not kept
+        if query_embedding is not None and (not reranker.enabled() or any(r.get('reranked') for r in context_results)):
+            redis_cache.put("retrieval", retrieval_key, context_results, redis_cache.RETRIEVAL_CACHE_TTL)
+
+    # Parties fixes du prompt : contexte agent + mémoire courte + historique + question
+    prompt_started = time.perf_counter()
+    messages = []
+    if contexte_agent:
+        messages.append({"role": "system", "content": contexte_agent})
+    if last_agent_message:
+        messages.append({"role": "assistant", "content": f"Mémoire agent : {last_agent_message}"})
+    # Ajoute un résumé des 5 derniers échanges dans le prompt utilisateur
+    if history:
+        last_msgs = history[-RAG_HISTORY_MESSAGES:]
+        discussion = "\n".join([f"{m['role']}: {m['content']}" for m in last_msgs])
+        user_content = f"Voici la discussion en cours :\n{discussion}\n\nEt maintenant voici ma question : {question}\n\nExtraits de documents :\n"
+    else:
+        user_content = f"{question}\n\nExtraits de documents :\n"
+
+    # Extraits RAG : les meilleurs résultats qui tiennent dans le budget de tokens du modèle
+    model = model_id or DEFAULT_MODEL
+    fixed_tokens = sum(context_packer.count_tokens(m["content"], model) for m in messages) + context_packer.count_tokens(user_content, model)
+    budget = context_packer.context_budget(model, fixed_tokens, DEFAULT_MAX_TOKENS)
+    packed_results, token_report = context_packer.pack_context(context_results, budget, model)
+    token_report["fixed_tokens"] = fixed_tokens
+    token_report["prompt_tokens"] = fixed_tokens + token_report["context_tokens"]
+    logger.info(f"Context packing ({model}): {token_report}")
+
+    context_by_document = {}
+    for result in packed_results:
+        doc_name = result['document_name']
+        if doc_name not in context_by_document:
+            context_by_document[doc_name] = []
+        context_by_document[doc_name].append(result['text'])
+
+    # Build enhanced context string
+    enhanced_context = ""
+    for doc_name, contexts in context_by_document.items():
+        enhanced_context += f"\n--- Extraits du document '{doc_name}' ---\n"
+        for i, context in enumerate(contexts, 1):
+            enhanced_context += f"Extrait {i}: {context}\n"
+
+    messages.append({"role": "user", "content": user_content + enhanced_context})
+    request_trace.add("prompt", (time.perf_counter() - prompt_started) * 1000)
+    if request_trace.explaining():
+        request_trace.note("model", model)
+        request_trace.note("tokens", token_report)
+        request_trace.note("context", [
+            {
+                "document_id": r.get("document_id"),
+                "document_name": r.get("document_name"),
+                "chunk_ids": r.get("chunk_ids"),
+                "score": r.get("similarity"),
+                "reranked": bool(r.get("reranked")),
+                "tokens": r.get("tokens"),
+            }
+            for r in packed_results
+        ])
+    logger.info("[PROMPT OPENAI] %s", json.dumps(messages, ensure_ascii=False, indent=2))
+    return {"messages": messages, "gemini_only": gemini_only_flag, "answer": None, "cache_key": cache_key, "semantic": semantic, "token_report": token_report}
+
+
+def _answer_cache_key(question: str, user_id: int, selected_doc_ids: List[int], agent_id: int, history: list, model_id: str) -> str:
+    # The agent's short memory (last message) is left out of the key: it changes after every
+    # exchange and would make every answer of an active agent a miss. Agent edits bump the version.
+    recent = [(m.get('role'), m.get('content')) for m in (history or [])[-RAG_HISTORY_MESSAGES:]]
+    return redis_cache.answer_key(question, agent_id, user_id, selected_doc_ids, model_id, recent)
+
+
+def store_cached_answer(prompt: Dict[str, Any], answer: str):
+    """Cache the model's answer for a prompt built by build_answer_prompt (exact and semantic caches)."""
+    if not answer:
+        return
+    if prompt.get("cache_key"):
+        redis_cache.put("answer", prompt["cache_key"], answer, redis_cache.ANSWER_CACHE_TTL)
+    semantic = prompt.get("semantic")
+    if semantic:
+        # Tokens a future hit will save: the whole prompt plus the completion
+        tokens = sum(count_tokens(m.get("content") or "") for m in prompt.get("messages") or []) + count_tokens(answer)
+        semantic_cache.store(
+            semantic["agent_id"], semantic["question"], semantic["embedding"], answer,
+            semantic["version"], model_id=semantic["model_id"], tokens=tokens,
+        )
+
+
+def get_answer(
+    question: str,
+    user_id: int,
+    db: Session,
+    selected_doc_ids: List[int] = None,
+    agent_id: int = None,
+    history: list = None,
+    model_id: str = None,
+    user_question: str = None
+) -> str:
+    """Get answer using RAG for specific user with OpenAI - always using embeddings, memory, and custom model if provided"""
+    try:
+        prompt = build_answer_prompt(question, user_id, db, selected_doc_ids=selected_doc_ids, agent_id=agent_id, history=history, model_id=model_id, user_question=user_question)
+        if prompt["answer"] is not None:
+            return prompt["answer"]
+        # All DB reads are done: do not hold the pooled connection during the LLM round-trip
+        release_connection(db)
         logger.info("Getting response from OpenAI with structured messages (system, mémoire agent, last 5, user, RAG)")
-        gemini_only_flag = False
-        try:
-            gemini_only_flag = bool(agent and getattr(agent, 'type', '') == 'actionnable')
-        except Exception:
-            gemini_only_flag = False
-        response = get_chat_response(messages, model_id=model_id, gemini_only=gemini_only_flag)
+        # Goes through the shared async connection pools when called from a worker thread of the API
+        with request_trace.stage("llm"):
+            response = chat_blocking(prompt["messages"], model_id=model_id, gemini_only=prompt["gemini_only"])
         logger.info("Successfully got response from OpenAI")
+        store_cached_answer(prompt, response)
         return response
     except Exception as e:
         logger.error(f"Error getting answer: {e}")
         raise Exception(f"Erreur lors du traitement de votre question avec l'API OpenAI : {str(e)}")
-def search_similar_texts_for_user(query_embedding: List[float], user_id: int, db: Session, top_k: int = 3, selected_doc_ids: List[int] = None, agent_id: int = None) -> List[dict]:
-    """Search similar texts for a specific user - returns structured data with document info"""
+
+
+async def aget_answer(
+    question: str,
+    user_id: int,
+    db: Session,
+    selected_doc_ids: List[int] = None,
+    agent_id: int = None,
+    history: list = None,
+    model_id: str = None,
+    user_question: str = None
+) -> str:
+    """Async get_answer: DB work and retrieval run in the blocking pool, the LLM call is awaited natively"""
     try:
-        # Get all chunks for user's documents (filter by selected documents if provided)
-        query = db.query(DocumentChunk, Document).join(Document)
-        # Respect agent_id when provided: prefer chunks from documents attached to the agent
-        if agent_id:
-            query = query.filter(Document.agent_id == agent_id)
+        # The worker thread does not inherit the caller's context: hand the active trace over explicitly
+        trace = request_trace.current()
+        if trace is not None:
+            prompt = await run_blocking(trace.run, build_answer_prompt, question, user_id, db, selected_doc_ids=selected_doc_ids, agent_id=agent_id, history=history, model_id=model_id, user_question=user_question)
         else:
-            query = query.filter(Document.user_id == user_id)
-        if selected_doc_ids:
-            query = query.filter(Document.id.in_(selected_doc_ids))
-        chunks_with_docs = query.all()
-        if not chunks_with_docs:
-            return []
-        # Similarity search with document info
-        similarities = []
-        chunk_map = {}  # document_id -> [chunks ordered by chunk_index]
-        for chunk, document in chunks_with_docs:
-            if chunk.embedding:
-                chunk_embedding = json.loads(chunk.embedding)
-                similarity = cosine_similarity(query_embedding, chunk_embedding)
-                similarities.append({
-                    'similarity': similarity,
-                    'text': chunk.chunk_text,
-                    'document_id': document.id,
-                    'document_name': document.filename,
-                    'created_at': document.created_at.isoformat(),
-                    'chunk_index': chunk.chunk_index
-                })
-                # Build chunk map for context retrieval
-                if document.id not in chunk_map:
-                    chunk_map[document.id] = []
-                chunk_map[document.id].append((chunk.chunk_index, chunk.chunk_text))
-        # Sort by similarity and get top_k
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        top_chunks = similarities[:top_k]
-        # Ajoute les chunks voisins pour le contexte
-        context_results = []
-        for item in top_chunks:
-            doc_id = item['document_id']
-            idx = item['chunk_index']
-            # Récupère les chunks voisins (avant/après)
-            neighbors = []
-            if doc_id in chunk_map:
-                ordered_chunks = sorted(chunk_map[doc_id], key=lambda x: x[0])
-                for i, (chunk_idx, chunk_text) in enumerate(ordered_chunks):
-                    if chunk_idx == idx:
-                        # Ajoute le chunk principal
-                        neighbors.append(chunk_text)
-                        # Ajoute le chunk précédent si dispo
-                        if i > 0:
-                            neighbors.insert(0, ordered_chunks[i-1][1])
-                        # Ajoute le chunk suivant si dispo
-                        if i < len(ordered_chunks)-1:
-                            neighbors.append(ordered_chunks[i+1][1])
-                        break
-            # Concatène les chunks pour le contexte
-            context_text = "\n".join(neighbors)
-            context_results.append({
-                'similarity': item['similarity'],
-                'text': context_text,
-                'document_id': item['document_id'],
-                'document_name': item['document_name'],
-                'created_at': item['created_at']
-            })
-        return context_results
+            prompt = await run_blocking(build_answer_prompt, question, user_id, db, selected_doc_ids=selected_doc_ids, agent_id=agent_id, history=history, model_id=model_id, user_question=user_question)
+        if prompt["answer"] is not None:
+            return prompt["answer"]
+        await run_blocking(release_connection, db)
+        with request_trace.stage("llm"):
+            answer = await achat(prompt["messages"], model_id=model_id, gemini_only=prompt["gemini_only"])
+        await run_blocking(store_cached_answer, prompt, answer)
+        return answer
+    except Exception as e:
+        logger.error(f"Error getting answer: {e}")
+        raise Exception(f"Erreur lors du traitement de votre question avec l'API OpenAI : {str(e)}")
+
+
+def search_similar_texts_for_user(query_embedding: Optional[List[float]], user_id: int, db: Session, top_k: int = 3, selected_doc_ids: List[int] = None, agent_id: int = None, exact: bool = False, question: str = None) -> List[dict]:
+    """Search similar texts for a specific user - returns structured data with document info
+
+    Dense candidates come from the configured retriever (FAISS or pgvector index; the exact scan is
+    used when `exact=True`, for selections the backend cannot filter, or if the backend fails). With `question`,
+    BM25 candidates are fused with them by reciprocal rank; without `query_embedding` (embedding API
+    unavailable) the lexical ranking is used alone. When a reranker is configured, RERANK_CANDIDATES
+    candidates are reranked against `question` and the best ones kept; past its time budget the fused
+    order is used. `question` must be what the user typed, not a prompt wrapped in instructions.
+    """
+    hybrid = bool(question) and RAG_HYBRID_ENABLED and lexical_index.LEXICAL_INDEX_ENABLED
+    rerank = bool(question) and reranker.enabled()
+    candidates = max(top_k, RAG_HYBRID_CANDIDATES) if hybrid else top_k
+    if RAG_DEDUP_ENABLED:
+        # Room for the copies dropped by _collapse_duplicate_hits
+        candidates = max(candidates, top_k * 2)
+    if rerank:
+        # Over-fetch: the reranker picks the final top_k among a wider candidate set
+        candidates = max(candidates, reranker.RERANK_CANDIDATES)
+    retrieval_started = time.perf_counter()
+    rankings = []
+    if query_embedding is not None:
+        rankings.append(_dense_hits(query_embedding, user_id, db, candidates, selected_doc_ids, agent_id, exact))
+    if hybrid or (question and query_embedding is None):
+        try:
+            start = time.time()
+            lexical_hits = lexical_index.search(db, question, candidates, agent_id=agent_id, user_id=user_id, document_ids=selected_doc_ids)
+            logger.info(f"BM25 index returned {len(lexical_hits)} hits in {(time.time() - start) * 1000:.1f}ms")
+            rankings.append(lexical_hits)
+        except Exception as e:
+            logger.warning(f"Lexical search failed: {e}")
+    limit = candidates if rerank else top_k
+    if len(rankings) > 1:
+        hits = reciprocal_rank_fusion(rankings, candidates)
+    else:
+        hits = rankings[0] if rankings else []
+    if RAG_DEDUP_ENABLED:
+        hits = _collapse_duplicate_hits(hits, db)
+    hits = hits[:limit]
+    request_trace.add("retrieval", (time.perf_counter() - retrieval_started) * 1000)
+    reranked = None
+    if rerank and len(hits) > 1:
+        with request_trace.stage("rerank"):
+            reranked = _rerank_hits(question, hits, db, top_k)
+    request_trace.note("hits", [{"chunk_id": chunk_id, "score": score} for chunk_id, score in (reranked or hits[:top_k])])
+    with request_trace.stage("expansion"):
+        if reranked is None:
+            return _results_from_index_hits(hits[:top_k], db)
+        results = _results_from_index_hits(reranked, db)
+    for result in results:
+        result['reranked'] = True
+    return results
+
+
+def _collapse_duplicate_hits(hits: List[Tuple[int, float]], db: Session) -> List[Tuple[int, float]]:
+    """Keep the best-ranked hit of each chunk text (DocumentChunk.text_hash).
+
+    Chunks stored before migration 006 have no text_hash and are hashed from their text.
+    """
+    if len(hits) < 2:
+        return hits
+    chunk_ids = [chunk_id for chunk_id, _ in hits]
+    keys = dict(db.query(DocumentChunk.id, DocumentChunk.text_hash).filter(DocumentChunk.id.in_(chunk_ids)).all())
+    unhashed = [chunk_id for chunk_id in chunk_ids if not keys.get(chunk_id)]
+    if unhashed:
+        for chunk_id, chunk in db.query(DocumentChunk.id, DocumentChunk.chunk_text).filter(DocumentChunk.id.in_(unhashed)):
+            keys[chunk_id] = text_hash(chunk)
+    seen = set()
+    collapsed = []
+    for chunk_id, score in hits:
+        key = keys.get(chunk_id) or chunk_id
+        if key in seen:
+            continue
+        seen.add(key)
+        collapsed.append((chunk_id, score))
+    if len(collapsed) < len(hits):
+        request_trace.note("duplicate_hits", len(hits) - len(collapsed))
+    return collapsed
+
+
+def _rerank_hits(query: str, hits: List[Tuple[int, float]], db: Session, top_k: int) -> Optional[List[Tuple[int, float]]]:
+    """Rerank candidate hits on their own chunk text (neighbours are added afterwards); None keeps the retrieval order.
+
+    `query` is the user's own question: an instruction prefix would be scored against every candidate too.
+    """
+    texts = dict(db.query(DocumentChunk.id, DocumentChunk.chunk_text).filter(DocumentChunk.id.in_([chunk_id for chunk_id, _ in hits])).all())
+    candidates = [(chunk_id, texts[chunk_id]) for chunk_id, _ in hits if chunk_id in texts]
+    top_n = min(top_k, reranker.RERANK_TOP_N) if reranker.RERANK_TOP_N else top_k
+    return reranker.rerank(query, candidates, top_n)
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[int, float]]], top_k: int, k: int = None) -> List[Tuple[int, float]]:
+    """Fuse ranked (chunk_id, score) lists: each list contributes 1 / (k + rank) to a chunk's score."""
+    k = RAG_RRF_K if k is None else k
+    fused = {}
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking, 1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+def _dense_hits(query_embedding: List[float], user_id: int, db: Session, top_k: int, selected_doc_ids: List[int] = None, agent_id: int = None, exact: bool = False) -> List[Tuple[int, float]]:
+    """(chunk_id, cosine) pairs from the configured retriever (RETRIEVAL_BACKEND), or from the exact scan."""
+    try:
+        start = time.time()
+        if exact:
+            hits = retrievers.exact.search(db, query_embedding, top_k, agent_id=agent_id, user_id=user_id, document_ids=selected_doc_ids)
+        else:
+            hits = retrievers.search(db, query_embedding, top_k, agent_id=agent_id, user_id=user_id, document_ids=selected_doc_ids)
+        logger.info(f"Dense retrieval returned {len(hits)} hits in {(time.time() - start) * 1000:.1f}ms")
+        return hits
+    except Exception as e:
+        logger.error(f"Error searching similar texts: {e}")
+        return []
+
+
+def _results_from_index_hits(hits: List[Tuple[int, float]], db: Session) -> List[dict]:
+    """Turn ranked (chunk_id, score) hits into context results with their neighbour chunks.
+
+    Only the rows of each hit's window (chunk_index ± RAG_NEIGHBOR_WINDOW) are loaded, through the
+    (document_id, chunk_index) index. Overlapping or adjacent windows of a document are merged into
+    one result, so no chunk appears twice in the prompt; a merged result keeps its best score.
+    """
+    if not hits:
+        return []
+    scores = dict(hits)
+    rows = (
+        db.query(DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.chunk_index, Document.filename, Document.created_at)
+        .join(Document, DocumentChunk.document_id == Document.id)
+        .filter(DocumentChunk.id.in_(list(scores.keys())))
+        .all()
+    )
+    documents = {}
+    windows = {}  # document_id -> [[first_index, last_index, score]]
+    for chunk_id, document_id, chunk_index, filename, created_at in rows:
+        documents[document_id] = (filename, created_at)
+        windows.setdefault(document_id, []).append(
+            [max(0, chunk_index - RAG_NEIGHBOR_WINDOW), chunk_index + RAG_NEIGHBOR_WINDOW, scores[chunk_id]]
+        )
+    merged = []
+    for document_id, spans in windows.items():
+        spans.sort()
+        current = spans[0]
+        for span in spans[1:]:
+            if span[0] <= current[1] + 1:
+                current[1] = max(current[1], span[1])
+                current[2] = max(current[2], span[2])
+            else:
+                merged.append((document_id, current))
+                current = span
+        merged.append((document_id, current))
+    if not merged:
+        # None of the hit chunks exists any more (deleted since the search, stale index or cached hit):
+        # or_() of no ranges would drop the filter and load every chunk
+        return []
+    merged.sort(key=lambda item: item[1][2], reverse=True)
+
+    texts = {}
+    ranges = [and_(DocumentChunk.document_id == document_id, DocumentChunk.chunk_index.between(first, last)) for document_id, (first, last, _) in merged]
+    for chunk_id, document_id, chunk_index, chunk_text in db.query(DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.chunk_index, DocumentChunk.chunk_text).filter(or_(*ranges)):
+        texts.setdefault(document_id, []).append((chunk_index, chunk_id, chunk_text))
+    context_results = []
+    for document_id, (first, last, score) in merged:
+        # Concatène les chunks de la fenêtre dans l'ordre du document, sans le recouvrement de chunk_text
+        window = sorted(row for row in texts.get(document_id, []) if first <= row[0] <= last)
+        filename, created_at = documents[document_id]
+        context_results.append({
+            'similarity': score,
+            'text': context_packer.join_chunks([text for _, _, text in window]),
+            'chunk_ids': [chunk_id for _, chunk_id, _ in window],
+            'document_id': document_id,
+            'document_name': filename,
+            'created_at': created_at.isoformat() if created_at else None
+        })
+    return context_results
+
+
+def search_similar_texts_exact(query_embedding: List[float], user_id: int, db: Session, top_k: int = 3, selected_doc_ids: List[int] = None, agent_id: int = None) -> List[dict]:
+    """Exact brute-force similarity search over every chunk of the user/agent (reference path)"""
+    try:
+        hits = retrievers.exact.search(db, query_embedding, top_k, agent_id=agent_id, user_id=user_id, document_ids=selected_doc_ids)
+        return _results_from_index_hits(hits, db)
     except Exception as e:
         logger.error(f"Error searching similar texts: {e}")
         return []
@@ -302,25 +594,45 @@ def get_documents_summary(user_id: int, db: Session, selected_doc_ids: List[int]
     """Get complete information about user's documents"""
     try:
         if selected_doc_ids:
-            documents = db.query(Document).filter(
+            documents = db.query(Document.id, Document.filename, Document.created_at).filter(
                 Document.user_id == user_id,
                 Document.id.in_(selected_doc_ids)
             ).all()
         else:
-            documents = db.query(Document).filter(Document.user_id == user_id).all()
-        
+            documents = db.query(Document.id, Document.filename, Document.created_at).filter(Document.user_id == user_id).all()
+        if not documents:
+            return []
+        doc_ids = [doc.id for doc in documents]
+
+        # Chunk counts of every document in one GROUP BY
+        counts = dict(
+            db.query(DocumentChunk.document_id, func.count(DocumentChunk.id))
+            .filter(DocumentChunk.document_id.in_(doc_ids))
+            .group_by(DocumentChunk.document_id)
+            .all()
+        )
+        # Preview: only the first chunks of each document, each cut to the preview length in SQL
+        position = func.row_number().over(partition_by=DocumentChunk.document_id, order_by=DocumentChunk.chunk_index).label("position")
+        first_chunks = (
+            db.query(DocumentChunk.document_id, func.substr(DocumentChunk.chunk_text, 1, SUMMARY_PREVIEW_CHARS + 1).label("text"), position)
+            .filter(DocumentChunk.document_id.in_(doc_ids))
+            .subquery()
+        )
+        previews = {}
+        for document_id, text, _ in db.query(first_chunks).filter(first_chunks.c.position <= SUMMARY_PREVIEW_CHUNKS).order_by(first_chunks.c.document_id, first_chunks.c.position):
+            previews.setdefault(document_id, []).append(text)
+
         doc_info = []
         for doc in documents:
-            # Get all chunks for this document
-            chunks = db.query(DocumentChunk).filter(DocumentChunk.document_id == doc.id).all()
-            content = " ".join([chunk.chunk_text for chunk in chunks])
-            
+            texts = previews.get(doc.id, [])
+            content = " ".join(texts)
+            truncated = len(content) > SUMMARY_PREVIEW_CHARS or len(texts) < counts.get(doc.id, 0)
             doc_info.append({
                 'id': doc.id,
                 'filename': doc.filename,
                 'created_at': doc.created_at.isoformat(),
-                'content': content[:2000] + "..." if len(content) > 2000 else content,  # Limit content
-                'chunk_count': len(chunks)
+                'content': content[:SUMMARY_PREVIEW_CHARS] + "..." if truncated else content,  # Limit content
+                'chunk_count': counts.get(doc.id, 0)
             })
         
         return doc_info
@@ -330,142 +642,156 @@ def get_documents_summary(user_id: int, db: Session, selected_doc_ids: List[int]
         return []
 
 def search_text_fallback(question: str, user_id: int, db: Session, top_k: int = 3) -> List[str]:
-    """Fallback text search when embeddings are not available"""
+    """Fallback text search when embeddings are not available (BM25 over the user's chunks)"""
     try:
-        # Get all chunks for user's documents
-        chunks = db.query(DocumentChunk).join(Document).filter(
-            Document.user_id == user_id
-        ).all()
-        
-        if not chunks:
+        hits = lexical_index.search(db, question, top_k, user_id=user_id)
+        if not hits:
             return []
-        
-        # Simple keyword matching
-        question_words = question.lower().split()
-        scored_chunks = []
-        
-        for chunk in chunks:
-            chunk_text = chunk.chunk_text.lower()
-            score = 0
-            
-            # Count word matches
-            for word in question_words:
-                if len(word) > 2:  # Skip very short words
-                    score += chunk_text.count(word)
-            
-            if score > 0:
-                scored_chunks.append((score, chunk.chunk_text))
-        
-        # Sort by score and return top results
-        scored_chunks.sort(reverse=True, key=lambda x: x[0])
-        return [text for _, text in scored_chunks[:top_k]]
-    
+        texts = dict(db.query(DocumentChunk.id, DocumentChunk.chunk_text).filter(DocumentChunk.id.in_([chunk_id for chunk_id, _ in hits])))
+        return [texts[chunk_id] for chunk_id, _ in hits if chunk_id in texts]
     except Exception as e:
         logger.error(f"Error in text fallback search: {e}")
         return []
 
 def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
-    """Calculate cosine similarity between two vectors"""
-    import numpy as np
-    
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
-    
-    dot_product = np.dot(vec1, vec2)
-    norm_vec1 = np.linalg.norm(vec1)
-    norm_vec2 = np.linalg.norm(vec2)
-    
-    if norm_vec1 == 0 or norm_vec2 == 0:
-        return 0
-    
-    return dot_product / (norm_vec1 * norm_vec2)
+    """Calculate cosine similarity between two vectors (use similarity.EmbeddingMatrix for many candidates)"""
+    return float(EmbeddingMatrix([vec2]).scores(vec1)[0])
 
-def process_document_for_user(filename: str, content: bytes, user_id: int, db: Session, agent_id: int = None) -> int:
-    """Process and store document for specific user and optionally for a specific agent"""
-    import tempfile
-    import os
-    
-    try:
-        logger.info(f"Starting to process document: {filename} for user {user_id}, agent {agent_id}")
-        
+@contextmanager
+def _untimed_stage(name: str):
+    yield
 
-        # Upload file to GCS
-        from google.cloud import storage
-        import time
-        bucket_name = os.getenv("GCS_BUCKET_NAME", "applydi-documents")
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        gcs_filename = f"{int(time.time())}_{filename.replace(' ', '_')}"
-        blob = bucket.blob(gcs_filename)
+
+def find_duplicate_document(db: Session, digest: str, user_id: int, agent_id: int = None) -> Optional[int]:
+    """Id of a document of this user and agent with the same raw content (Document.content_hash) and
+    chunks stored, i.e. fully ingested; None if the content is new to them."""
+    row = (
+        db.query(Document.id)
+        .filter(Document.content_hash == digest, Document.user_id == user_id, Document.agent_id == agent_id, Document.chunks.any())
+        .order_by(Document.id)
+        .first()
+    )
+    return row.id if row else None
+
+
+def _store_blob(content: bytes, digest: str, filename: str) -> str:
+    """Upload the raw file to GCS under a content-addressed name; a file already in the bucket is not uploaded again."""
+    from google.cloud import storage
+    bucket_name = os.getenv("GCS_BUCKET_NAME", "applydi-documents")
+    client = storage.Client()
+    bucket = client.bucket(bucket_name)
+    # The download endpoints name the file after Document.filename, not after the object
+    blob = bucket.blob(f"sha256/{digest}{os.path.splitext(filename)[1].lower()}")
+    if blob.exists():
+        logger.info(f"Document already in GCS, upload skipped: {blob.public_url}")
+    else:
         blob.upload_from_string(content)
-        gcs_url = blob.public_url
-        logger.info(f"Document uploaded to GCS: {gcs_url}")
-
-        # Save document to database with GCS URL
-        document = Document(
-            filename=filename,
-            content=content.decode('utf-8') if filename.endswith('.txt') else str(content),
-            user_id=user_id,
-            agent_id=agent_id,
-            gcs_url=gcs_url
+        logger.info(f"Document uploaded to GCS: {blob.public_url}")
+    return blob.public_url
+
+
+def _existing_embeddings(db: Session, hashes: List[str], batch_size: int = 500) -> Dict[str, bytes]:
+    """text_hash -> stored embedding (bytes) of chunks already embedded, in any document."""
+    found = {}
+    unique = list(dict.fromkeys(hashes))
+    for start in range(0, len(unique), batch_size):
+        batch = unique[start:start + batch_size]
+        # One row per text: the oldest embedded chunk
+        first_ids = (
+            db.query(func.min(DocumentChunk.id))
+            .filter(DocumentChunk.text_hash.in_(batch), DocumentChunk.embedding_vec.isnot(None))
+            .group_by(DocumentChunk.text_hash)
         )
-        db.add(document)
-        db.commit()
-        db.refresh(document)
-        logger.info(f"Document saved to database with ID: {document.id}")
-        
-        # Process content based on file type
-        if filename.endswith('.pdf'):
-            # Save content temporarily to process with pdfplumber
-            tmp_file = None
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                    tmp_file = tmp.name
-                    tmp.write(content)
-                logger.info(f"Processing PDF file: {tmp_file}")
-                text_content = load_text_from_pdf(tmp_file)
-            finally:
-                # Clean up temporary file
-                if tmp_file and os.path.exists(tmp_file):
-                    os.unlink(tmp_file)
-        else:
-            text_content = content.decode('utf-8')
-        
+        found.update(db.query(DocumentChunk.text_hash, DocumentChunk.embedding_vec).filter(DocumentChunk.id.in_(first_ids.scalar_subquery())).all())
+    return found
+
+
+def process_document_for_user(filename: str, content: bytes, user_id: int, db: Session, agent_id: int = None,
+                              text_content: str = None, stage=None, chunks: List[str] = None) -> int:
+    """Process and store document for specific user and optionally for a specific agent
+
+    `text_content` skips extraction when the caller already has the text, `chunks` skips chunking
+    (PDF pages chunked while they were extracted). `stage(name)` is an optional
+    context manager wrapped around each step (extract, store, chunk, embed, index), used by the
+    ingestion jobs to record per-stage timings.
+    """
+    stage = stage or _untimed_stage
+    try:
+        logger.info(f"Starting to process document: {filename} for user {user_id}, agent {agent_id}")
+        digest = content_hash(content)
+        duplicate = find_duplicate_document(db, digest, user_id, agent_id)
+        if duplicate:
+            logger.info(f"{filename} is identical to document {duplicate} of user {user_id}, agent {agent_id}: not ingested again")
+            return duplicate
+
+        if text_content is None:
+            with stage("extract"):
+                if is_supported(filename):
+                    text_content = extract_text(filename, content)
+                else:
+                    text_content = content.decode('utf-8', errors='ignore')
         logger.info(f"Extracted text length: {len(text_content)} characters")
-        
-        # Chunk the text
-        chunks = chunk_text(text_content)
-        logger.info(f"Created {len(chunks)} chunks")
-        
-        # Process first few chunks with embeddings, save others without embeddings for now
-        max_immediate_chunks = 20  # Process only first 20 chunks immediately
-        
-        for i, chunk in enumerate(chunks):
-            if i < max_immediate_chunks:
-                logger.info(f"Processing chunk {i+1}/{len(chunks)} with embedding")
-                try:
-                    # Get embedding for chunk with shorter timeout
-                    embedding = get_embedding_fast(chunk)
-                except Exception as e:
-                    logger.warning(f"Failed to get embedding for chunk {i}, using dummy: {e}")
-                    embedding = [0.0] * 1536
-            else:
-                logger.info(f"Saving chunk {i+1}/{len(chunks)} without embedding (will process later)")
-                embedding = None  # Will be processed later
-            
-            # Save chunk to database
-            doc_chunk = DocumentChunk(
-                document_id=document.id,
-                chunk_text=chunk,
-                embedding=json.dumps(embedding) if embedding else None,
-                chunk_index=i
+
+        with stage("store"):
+            gcs_url = _store_blob(content, digest, filename)
+
+            # Save document to database with GCS URL
+            document = Document(
+                filename=filename,
+                content=text_content,
+                user_id=user_id,
+                agent_id=agent_id,
+                gcs_url=gcs_url,
+                content_hash=digest
             )
-            db.add(doc_chunk)
-        
-        db.commit()
+            db.add(document)
+            db.commit()
+            db.refresh(document)
+            logger.info(f"Document saved to database with ID: {document.id}")
+
+        if chunks is None:
+            with stage("chunk"):
+                chunks = chunk_text(text_content)
+        logger.info(f"Created {len(chunks)} chunks")
+
+        with stage("embed"):
+            # Chunks already embedded in any document reuse that vector; the others are embedded once
+            # per distinct text, in as few API calls as the batch limits allow
+            hashes = text_hashes(chunks)
+            vectors = _existing_embeddings(db, hashes)
+            reused = len(vectors)
+            pending = {}
+            for chunk_hash, chunk in zip(hashes, chunks):
+                if chunk_hash not in vectors:
+                    pending.setdefault(chunk_hash, chunk)
+            embeddings = get_embeddings_batch(list(pending.values())) if pending else []
+            for chunk_hash, embedding in zip(pending, embeddings):
+                if embedding is not None:
+                    vectors[chunk_hash] = encode_embedding(embedding)
+            logger.info(f"{len(chunks)} chunks: {reused} distinct texts reuse an existing embedding, {len(pending)} embedded")
+            missing = sum(1 for chunk_hash in hashes if chunk_hash not in vectors)
+            if missing:
+                logger.warning(f"{missing}/{len(chunks)} chunks saved without embedding (will process later)")
+
+            for i, chunk in enumerate(chunks):
+                # Save chunk to database
+                doc_chunk = DocumentChunk(
+                    document_id=document.id,
+                    chunk_text=chunk,
+                    embedding_vec=vectors.get(hashes[i]),
+                    chunk_index=i,
+                    text_hash=hashes[i]
+                )
+                db.add(doc_chunk)
+            db.commit()
+
+        with stage("index"):
+            retrievers.index_new_chunks(db, agent_id=agent_id, user_id=user_id)
+            # Cached retrieval results and answers of this agent/user are now stale
+            redis_cache.bump_corpus_version(agent_id=agent_id, user_id=user_id)
         logger.info(f"Document processed successfully: {filename} for user {user_id}")
         return document.id
-    
+
     except Exception as e:
         logger.error(f"Error processing document: {e}")
         db.rollback()
@@ -0,0 +1,249 @@
+# Cache partagé entre instances (Redis) pour les embeddings de questions, les résultats de recherche et les
+# réponses finales, avec repli sur un LRU en mémoire quand Redis n'est pas configuré ou ne répond pas.
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# redis://host:6379/0 ; empty = in-memory cache only (per process)
+REDIS_URL = os.getenv("REDIS_URL", "")
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "rag:")
+# Entries kept by the in-memory fallback
+CACHE_LOCAL_MAX_ENTRIES = int(os.getenv("CACHE_LOCAL_MAX_ENTRIES", "2048"))
+# TTLs in seconds. Embeddings only depend on the text and model; results and answers are also
+# invalidated through the corpus version when documents change.
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "300"))
+# Redis calls sit on the request path: fail fast, then stay on the local cache for a while
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.25"))
+REDIS_RETRY_AFTER = float(os.getenv("REDIS_RETRY_AFTER", "30"))
+
+NAMESPACES = ("embedding", "retrieval", "answer")
+
+
+class LocalLRU:
+    """Thread-safe LRU with per-entry expiry; stands in for Redis in a single process."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at and expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: int = 0):
+        with self._lock:
+            self._data[key] = (time.time() + ttl if ttl else 0, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_local = LocalLRU(CACHE_LOCAL_MAX_ENTRIES)
+# Corpus versions of the in-memory mode (kept out of the LRU so they are never evicted)
+_local_versions = {}
+_redis = None
+_redis_down_until = 0.0
+_redis_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {ns: {"hits": 0, "misses": 0, "sets": 0} for ns in NAMESPACES}
+_stats["redis_errors"] = 0
+
+
+def _count(namespace: str, field: str):
+    with _stats_lock:
+        _stats[namespace][field] += 1
+
+
+def _get_redis():
+    """Shared Redis client, or None when not configured / recently unreachable."""
+    global _redis
+    if not REDIS_URL or redis is None or time.time() < _redis_down_until:
+        return None
+    if _redis is None:
+        with _redis_lock:
+            if _redis is None:
+                _redis = redis.Redis.from_url(
+                    REDIS_URL,
+                    socket_timeout=REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+                )
+    return _redis
+
+
+def _redis_failed(e: Exception):
+    global _redis_down_until
+    with _stats_lock:
+        _stats["redis_errors"] += 1
+    _redis_down_until = time.time() + REDIS_RETRY_AFTER
+    logger.warning(f"Redis cache unavailable, using the in-memory cache for {REDIS_RETRY_AFTER:.0f}s: {e}")
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a question for cache keys (unicode NFC, case, whitespace)."""
+    return " ".join(unicodedata.normalize("NFC", text or "").lower().split())
+
+
+def make_key(namespace: str, *parts: Any) -> str:
+    """Stable key across processes and restarts (unlike hash(), which is salted per interpreter)."""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return f"{CACHE_KEY_PREFIX}{namespace}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+def get(namespace: str, key: str) -> Optional[Any]:
+    """JSON value stored under `key`, or None. Counts a hit or a miss for `namespace`."""
+    if not CACHE_ENABLED:
+        return None
+    value = None
+    client = _get_redis()
+    if client is not None:
+        try:
+            raw = client.get(key)
+            value = json.loads(raw) if raw is not None else None
+        except Exception as e:
+            _redis_failed(e)
+            value = _local.get(key)
+    else:
+        value = _local.get(key)
+    _count(namespace, "hits" if value is not None else "misses")
+    return value
+
+
+def put(namespace: str, key: str, value: Any, ttl: int):
+    if not CACHE_ENABLED or value is None:
+        return
+    client = _get_redis()
+    if client is not None:
+        try:
+            client.set(key, json.dumps(value, ensure_ascii=False, default=str), ex=ttl or None)
+            _count(namespace, "sets")
+            return
+        except Exception as e:
+            _redis_failed(e)
+    _local.set(key, value, ttl)
+    _count(namespace, "sets")
+
+
+def get_or_compute(namespace: str, key: str, compute: Callable[[], Any], ttl: int) -> Any:
+    value = get(namespace, key)
+    if value is None:
+        value = compute()
+        put(namespace, key, value, ttl)
+    return value
+
+
+def _scope(agent_id: Optional[int], user_id: Optional[int]) -> str:
+    # Same scopes as the vector index: the agent's documents, or the user's when there is no agent
+    return f"agent_{agent_id}" if agent_id else f"user_{user_id}"
+
+
+def corpus_version(agent_id: Optional[int] = None, user_id: Optional[int] = None) -> int:
+    """Current version of a scope's documents; part of every retrieval/answer key."""
+    if not CACHE_ENABLED:
+        return 0
+    key = f"{CACHE_KEY_PREFIX}corpus:{_scope(agent_id, user_id)}"
+    client = _get_redis()
+    if client is not None:
+        try:
+            return int(client.get(key) or 0)
+        except Exception as e:
+            _redis_failed(e)
+    with _stats_lock:
+        return _local_versions.get(key, 0)
+
+
+def bump_corpus_version(agent_id: Optional[int] = None, user_id: Optional[int] = None):
+    """Invalidate cached results and answers of the agent and user scopes after a document change.
+
+    Old entries are not deleted: they become unreachable and expire with their TTL.
+    """
+    if not CACHE_ENABLED:
+        return
+    scopes = []
+    if agent_id:
+        scopes.append(_scope(agent_id, None))
+    if user_id:
+        scopes.append(_scope(None, user_id))
+    client = _get_redis()
+    for scope in scopes:
+        key = f"{CACHE_KEY_PREFIX}corpus:{scope}"
+        if client is not None:
+            try:
+                client.incr(key)
+                continue
+            except Exception as e:
+                _redis_failed(e)
+        with _stats_lock:
+            _local_versions[key] = _local_versions.get(key, 0) + 1
+    logger.info(f"Cache corpus version bumped for {scopes}")
+
+
+def get_query_embedding(text: str, model: str, compute: Callable[[str], List[float]]) -> List[float]:
+    """Embedding of a question, computed with `compute(text)` on a miss."""
+    key = make_key("embedding", model, normalize_text(text))
+    return get_or_compute("embedding", key, lambda: list(compute(text)), EMBEDDING_CACHE_TTL)
+
+
+def retrieval_key(question: str, agent_id: Optional[int], user_id: Optional[int], top_k: int, selected_doc_ids: Optional[List[int]] = None, *extra: Any) -> str:
+    return make_key(
+        "retrieval",
+        _scope(agent_id, user_id),
+        corpus_version(agent_id, user_id),
+        normalize_text(question),
+        top_k,
+        sorted(selected_doc_ids or []),
+        *extra,
+    )
+
+
+def answer_key(question: str, agent_id: Optional[int], user_id: Optional[int], selected_doc_ids: Optional[List[int]] = None, *extra: Any) -> str:
+    return make_key(
+        "answer",
+        _scope(agent_id, user_id),
+        corpus_version(agent_id, user_id),
+        normalize_text(question),
+        sorted(selected_doc_ids or []),
+        *extra,
+    )
+
+
+def cache_stats() -> dict:
+    with _stats_lock:
+        stats = {ns: dict(_stats[ns]) for ns in NAMESPACES}
+        redis_errors = _stats["redis_errors"]
+    for ns_stats in stats.values():
+        lookups = ns_stats["hits"] + ns_stats["misses"]
+        ns_stats["hit_rate"] = round(ns_stats["hits"] / lookups, 3) if lookups else 0.0
+    stats["backend"] = "redis" if _get_redis() is not None else "memory"
+    stats["redis_configured"] = bool(REDIS_URL and redis is not None)
+    stats["redis_errors"] = redis_errors
+    stats["local_entries"] = len(_local)
+    stats["enabled"] = CACHE_ENABLED
+    return stats
@@ -0,0 +1,184 @@
+# Trace par requête du pipeline de réponse : durée de chaque étape (historique, agent, embedding, recherche,
+# voisins, prompt, LLM), payload explain optionnel (chunks retenus, scores, tokens) et histogrammes agrégés.
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+_current = contextvars.ContextVar("request_trace", default=None)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (cumulative counts, Prometheus style)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if ms <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum_ms += ms
+
+    def _quantile(self, counts, count, q: float) -> Optional[float]:
+        # Upper bound of the bucket holding the q-quantile (None when it falls in the unbounded bucket)
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            if cumulative >= rank:
+                return float(bound)
+        return None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+            sum_ms = self.sum_ms
+        cumulative = 0
+        buckets = {}
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = count
+        return {
+            "count": count,
+            "sum_ms": round(sum_ms, 2),
+            "avg_ms": round(sum_ms / count, 2) if count else 0.0,
+            "p50_ms": self._quantile(counts, count, 0.5),
+            "p95_ms": self._quantile(counts, count, 0.95),
+            "p99_ms": self._quantile(counts, count, 0.99),
+            "buckets": buckets,
+        }
+
+
+_histograms: Dict[str, Dict[str, Histogram]] = {}
+_histograms_lock = threading.Lock()
+
+
+def observe(pipeline: str, stage: str, ms: float):
+    with _histograms_lock:
+        histogram = _histograms.setdefault(pipeline, {}).get(stage)
+        if histogram is None:
+            histogram = _histograms[pipeline][stage] = Histogram()
+    histogram.observe(ms)
+
+
+class RequestTrace:
+    """Stage timings of one request; stages measured several times (e.g. two agents) are summed."""
+
+    def __init__(self, pipeline: str = "ask", explain: bool = False):
+        self.pipeline = pipeline
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.explain: Optional[Dict[str, Any]] = {} if explain else None
+        self.finished_ms: Optional[float] = None
+
+    def add(self, stage: str, ms: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    @contextmanager
+    def stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(stage, (time.perf_counter() - start) * 1000)
+
+    def note(self, key: str, value: Any):
+        if self.explain is not None:
+            self.explain[key] = value
+
+    def run(self, fn, *args, **kwargs):
+        """Call fn with this trace active (for work handed to another thread, e.g. run_blocking)."""
+        token = _current.set(self)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    def finish(self) -> float:
+        """Record the total and every stage in the histograms (once)."""
+        if self.finished_ms is None:
+            self.finished_ms = (time.perf_counter() - self.started) * 1000
+            for stage, ms in self.stages.items():
+                observe(self.pipeline, stage, ms)
+            observe(self.pipeline, "total", self.finished_ms)
+        return self.finished_ms
+
+    def to_dict(self) -> dict:
+        total = self.finished_ms if self.finished_ms is not None else (time.perf_counter() - self.started) * 1000
+        result = {"stages_ms": {stage: round(ms, 2) for stage, ms in self.stages.items()}, "total_ms": round(total, 2)}
+        if self.explain is not None:
+            result["explain"] = self.explain
+        return result
+
+
+def start(pipeline: str = "ask", explain: bool = False) -> RequestTrace:
+    """New trace, active in the calling thread until finish_current()."""
+    trace = RequestTrace(pipeline, explain=explain)
+    _current.set(trace)
+    return trace
+
+
+def current() -> Optional[RequestTrace]:
+    return _current.get()
+
+
+def finish_current() -> Optional[RequestTrace]:
+    trace = _current.get()
+    if trace is not None:
+        trace.finish()
+        _current.set(None)
+    return trace
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage of the active trace (no-op outside a traced request)."""
+    trace = _current.get()
+    if trace is None:
+        yield None
+        return
+    with trace.stage(name):
+        yield trace
+
+
+def add(name: str, ms: float):
+    """Add a duration measured by the caller to a stage of the active trace."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, ms)
+
+
+def note(key: str, value: Any):
+    """Add to the explain payload of the active trace, if it was requested."""
+    trace = _current.get()
+    if trace is not None:
+        trace.note(key, value)
+
+
+def explaining() -> bool:
+    trace = _current.get()
+    return trace is not None and trace.explain is not None
+
+
+def latency_stats() -> dict:
+    with _histograms_lock:
+        pipelines = {name: dict(stages) for name, stages in _histograms.items()}
+    return {name: {stage: histogram.snapshot() for stage, histogram in stages.items()} for name, stages in pipelines.items()}
@@ -0,0 +1,141 @@
+# Reranking des candidats de la recherche (dense + BM25) avant l'assemblage du prompt : Cohere Rerank
+# ou cross-encoder local (sentence-transformers), sous budget de temps strict par requête.
+import os
+import time
+import logging
+import threading
+from typing import List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from executors import InstrumentedPool, ExecutorSaturated, register_pool
+
+try:
+    import cohere
+except Exception:
+    cohere = None
+
+try:
+    from sentence_transformers import CrossEncoder
+except Exception:
+    CrossEncoder = None
+
+logger = logging.getLogger(__name__)
+
+# "" (disabled) | cohere | cross-encoder
+RERANK_PROVIDER = os.getenv("RERANK_PROVIDER", "").lower()
+RERANK_MODEL = os.getenv(
+    "RERANK_MODEL",
+    "rerank-multilingual-v3.0" if RERANK_PROVIDER == "cohere" else "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1",
+)
+# Candidates fetched from retrieval and sent to the reranker
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+# Results kept after reranking (0 = the caller's top_k); better hits allow a shorter prompt
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "5"))
+# Per-request budget; past it the retrieval order is used as is
+RERANK_TIMEOUT_MS = int(os.getenv("RERANK_TIMEOUT_MS", "800"))
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "4"))
+# Characters of each candidate sent to the model (cross-encoders truncate to ~512 tokens anyway)
+RERANK_MAX_CHARS = int(os.getenv("RERANK_MAX_CHARS", "2000"))
+COHERE_API_KEY = os.getenv("COHERE_API_KEY")
+
+_pool = InstrumentedPool(
+    "rerank",
+    RERANK_WORKERS,
+    lambda: ThreadPoolExecutor(max_workers=RERANK_WORKERS, thread_name_prefix="rerank"),
+    max_queue=RERANK_WORKERS * 4,
+)
+register_pool("rerank", _pool.stats)
+
+_model = None
+_model_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"reranked": 0, "timeouts": 0, "errors": 0, "skipped": 0, "total_ms": 0.0}
+
+
+def enabled() -> bool:
+    if RERANK_PROVIDER == "cohere":
+        return cohere is not None and bool(COHERE_API_KEY)
+    if RERANK_PROVIDER == "cross-encoder":
+        return CrossEncoder is not None
+    return False
+
+
+def _get_model():
+    """Cohere client or CrossEncoder, created once per process (the first call pays the model load)."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                if RERANK_PROVIDER == "cohere":
+                    _model = cohere.Client(api_key=COHERE_API_KEY, timeout=max(1, RERANK_TIMEOUT_MS // 1000 + 1))
+                else:
+                    _model = CrossEncoder(RERANK_MODEL, max_length=512)
+                logger.info(f"Reranker ready: {RERANK_PROVIDER} ({RERANK_MODEL})")
+    return _model
+
+
+def _score(query: str, texts: List[str]) -> List[float]:
+    model = _get_model()
+    if RERANK_PROVIDER == "cohere":
+        response = model.rerank(model=RERANK_MODEL, query=query, documents=texts, top_n=len(texts))
+        scores = [0.0] * len(texts)
+        for result in response.results:
+            scores[result.index] = float(result.relevance_score)
+        return scores
+    return [float(score) for score in model.predict([(query, text) for text in texts])]
+
+
+def _count(key: str, elapsed_ms: float = 0.0):
+    with _stats_lock:
+        _stats[key] += 1
+        _stats["total_ms"] += elapsed_ms
+
+
+def rerank(query: str, candidates: List[Tuple[int, str]], top_n: int) -> Optional[List[Tuple[int, float]]]:
+    """Reorder (chunk_id, text) candidates by relevance to `query`.
+
+    Returns the best `top_n` as (chunk_id, relevance score), or None when reranking is disabled,
+    fails or exceeds RERANK_TIMEOUT_MS: the caller then keeps its retrieval order.
+    """
+    if not enabled() or not query or len(candidates) < 2:
+        return None
+    start = time.perf_counter()
+    texts = [(text or "")[:RERANK_MAX_CHARS] for _, text in candidates]
+    try:
+        future = _pool.submit(_score, query, texts)
+    except ExecutorSaturated:
+        _count("skipped")
+        logger.warning("Reranker saturated, keeping retrieval order")
+        return None
+    try:
+        scores = future.result(timeout=RERANK_TIMEOUT_MS / 1000)
+    except FutureTimeout:
+        # The call finishes in the background (a cold model load keeps going and warms the next request)
+        _count("timeouts", RERANK_TIMEOUT_MS)
+        logger.warning(f"Reranking exceeded {RERANK_TIMEOUT_MS}ms, keeping retrieval order")
+        return None
+    except Exception as e:
+        _count("errors", (time.perf_counter() - start) * 1000)
+        logger.warning(f"Reranking failed, keeping retrieval order: {e}")
+        return None
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    _count("reranked", elapsed_ms)
+    logger.info(f"Reranked {len(candidates)} candidates in {elapsed_ms:.1f}ms")
+    ranked = sorted(zip((chunk_id for chunk_id, _ in candidates), scores), key=lambda item: item[1], reverse=True)
+    return ranked[:top_n]
+
+
+def stats() -> dict:
+    with _stats_lock:
+        calls = _stats["reranked"] + _stats["timeouts"] + _stats["errors"]
+        return {
+            "provider": RERANK_PROVIDER or None,
+            "model": RERANK_MODEL if RERANK_PROVIDER else None,
+            "enabled": enabled(),
+            "timeout_ms": RERANK_TIMEOUT_MS,
+            "reranked": _stats["reranked"],
+            "timeouts": _stats["timeouts"],
+            "errors": _stats["errors"],
+            "skipped": _stats["skipped"],
+            "avg_ms": round(_stats["total_ms"] / calls, 2) if calls else 0.0,
+        }
@@ -0,0 +1,268 @@
+# Recherche dense derrière une interface commune : scan exact (numpy), index FAISS en mémoire (vector_index)
+# ou pgvector (similarité et filtres calculés dans PostgreSQL). Choix via RETRIEVAL_BACKEND.
+import os
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import Document, DocumentChunk
+from embedding_codec import load_embedding, load_unit_embedding
+from similarity import EmbeddingMatrix
+
+# Optional ANN index (FAISS)
+try:
+    import vector_index
+except Exception:
+    vector_index = None
+
+logger = logging.getLogger(__name__)
+
+# exact | faiss | pgvector (default: faiss when available, see vector_index.VECTOR_INDEX_ENABLED)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "").lower()
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "1536"))
+# pgvector query-time recall knobs (hnsw.ef_search / ivfflat.probes)
+PGVECTOR_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH", "100"))
+PGVECTOR_PROBES = int(os.getenv("PGVECTOR_PROBES", "10"))
+# pgvector >= 0.8: keep scanning the HNSW graph until enough rows pass the agent/user filter
+# (off | relaxed_order | strict_order; ignored with a warning on older pgvector versions)
+PGVECTOR_ITERATIVE_SCAN = os.getenv("PGVECTOR_ITERATIVE_SCAN", "relaxed_order").lower()
+
+Hits = List[Tuple[int, float]]
+
+# Zero vectors (dummy embeddings of older versions) have a NaN cosine distance: never copied by
+# index_new_chunks, and excluded here in case an earlier copy stored them
+_PG_SEARCHABLE = "c.embedding_pg IS NOT NULL AND vector_norm(c.embedding_pg) > 0"
+
+
+class Retriever(ABC):
+    """Dense retrieval backend: top-k (chunk_id, cosine) for an agent scope, or a user scope if no agent."""
+
+    name = "base"
+    # True if document_ids is applied inside the search (otherwise selections use the exact scan)
+    filters_documents = False
+
+    @abstractmethod
+    def search(self, db: Session, query_embedding: List[float], top_k: int, agent_id: int = None, user_id: int = None, document_ids: List[int] = None) -> Hits:
+        """Best chunks of the scope, by decreasing cosine similarity."""
+
+    def index_new_chunks(self, db: Session, agent_id: int = None, user_id: int = None):
+        """Called once freshly embedded chunks are committed."""
+
+    def remove_chunks(self, chunk_ids: List[int], agent_id: int = None, user_id: int = None):
+        """Called after chunks were deleted."""
+
+    def reindex_chunks(self, db: Session, chunk_ids: List[int], agent_id: int = None, user_id: int = None):
+        """Called once existing chunks got a new embedding (e.g. dummy zero vectors re-embedded by the backfill)."""
+        self.index_new_chunks(db, agent_id=agent_id, user_id=user_id)
+
+
+class ExactRetriever(Retriever):
+    """Brute-force scan: every embedding of the scope is loaded and scored in one matrix product.
+
+    Rows are unit-norm (normalized at ingest, legacy JSON rows on load), so scoring is a plain dot product.
+    """
+
+    name = "exact"
+    filters_documents = True
+
+    def search(self, db, query_embedding, top_k, agent_id=None, user_id=None, document_ids=None):
+        # Only ids and embeddings are loaded; texts are fetched for the winners only
+        query = db.query(DocumentChunk.id, DocumentChunk.embedding_vec, DocumentChunk.embedding).join(Document)
+        # Respect agent_id when provided: prefer chunks from documents attached to the agent
+        if agent_id:
+            query = query.filter(Document.agent_id == agent_id)
+        else:
+            query = query.filter(Document.user_id == user_id)
+        if document_ids:
+            query = query.filter(Document.id.in_(document_ids))
+        ids = []
+        vectors = []
+        dim = len(query_embedding)
+        for chunk_id, embedding_vec, embedding in query.yield_per(1000):
+            chunk_embedding = load_unit_embedding(embedding_vec, embedding)
+            if chunk_embedding is not None and chunk_embedding.shape[0] == dim:
+                ids.append(chunk_id)
+                vectors.append(chunk_embedding)
+        if not ids:
+            return []
+        idx, scores = EmbeddingMatrix(vectors, normalized=True).top_k(query_embedding, top_k)
+        return [(ids[i], float(score)) for i, score in zip(idx, scores)]
+
+
+class FaissRetriever(Retriever):
+    """Persistent in-process FAISS index per agent/user (see vector_index)."""
+
+    name = "faiss"
+
+    def search(self, db, query_embedding, top_k, agent_id=None, user_id=None, document_ids=None):
+        return vector_index.search(db, query_embedding, top_k, agent_id=agent_id, user_id=user_id)
+
+    def index_new_chunks(self, db, agent_id=None, user_id=None):
+        vector_index.index_new_chunks(db, agent_id=agent_id, user_id=user_id)
+
+    def remove_chunks(self, chunk_ids, agent_id=None, user_id=None):
+        vector_index.remove_chunks(chunk_ids, agent_id=agent_id, user_id=user_id)
+
+
+def to_pgvector(vector) -> str:
+    """Text literal accepted by CAST(... AS vector)."""
+    return "[" + ",".join(f"{float(x):.7g}" for x in vector) + "]"
+
+
+class PgvectorRetriever(Retriever):
+    """document_chunks.embedding_pg (pgvector) with an HNSW/IVFFlat index, see migrate_pgvector.py.
+
+    Scope and document filters, distance and top-k ordering all run in a single SQL query. The ANN
+    index is global: without iterative scan it yields about ef_search neighbours before the scope
+    filter, so a scope holding a small share of the table can come up short. When fewer than top_k
+    rows come back while the scope has more, the query is run again as an exact scan of the scope.
+    """
+
+    name = "pgvector"
+    filters_documents = True
+
+    def __init__(self):
+        self.iterative_scan = PGVECTOR_ITERATIVE_SCAN not in ("", "off")
+
+    def search(self, db, query_embedding, top_k, agent_id=None, user_id=None, document_ids=None):
+        params = {"q": to_pgvector(query_embedding), "k": top_k}
+        if agent_id:
+            where = "d.agent_id = :scope_id"
+            params["scope_id"] = agent_id
+        else:
+            where = "d.user_id = :scope_id"
+            params["scope_id"] = user_id
+        if document_ids:
+            where += " AND d.id = ANY(:document_ids)"
+            params["document_ids"] = list(document_ids)
+        db.execute(text(f"SET LOCAL hnsw.ef_search = {max(PGVECTOR_EF_SEARCH, top_k)}"))
+        db.execute(text(f"SET LOCAL ivfflat.probes = {PGVECTOR_PROBES}"))
+        if self.iterative_scan:
+            try:
+                with db.begin_nested():
+                    db.execute(text(f"SET LOCAL hnsw.iterative_scan = {PGVECTOR_ITERATIVE_SCAN}"))
+            except Exception as e:
+                self.iterative_scan = False
+                logger.warning(f"pgvector iterative scan unavailable (pgvector < 0.8?), relying on the exact fallback: {e}")
+        query = text(f"""
+            SELECT c.id, 1 - (c.embedding_pg <=> CAST(:q AS vector)) AS score
+            FROM document_chunks c
+            JOIN documents d ON d.id = c.document_id
+            WHERE {where} AND {_PG_SEARCHABLE}
+            ORDER BY c.embedding_pg <=> CAST(:q AS vector)
+            LIMIT :k
+        """)
+        rows = db.execute(query, params).fetchall()
+        if len(rows) < top_k:
+            available = db.execute(text(f"""
+                SELECT count(*)
+                FROM document_chunks c
+                JOIN documents d ON d.id = c.document_id
+                WHERE {where} AND {_PG_SEARCHABLE}
+            """), params).scalar() or 0
+            if available > len(rows):
+                logger.info(f"pgvector index returned {len(rows)}/{top_k} rows for a scope of {available} chunks, using an exact scan")
+                db.execute(text("SET LOCAL enable_indexscan = off"))
+                rows = db.execute(query, params).fetchall()
+                db.execute(text("SET LOCAL enable_indexscan = on"))
+        # relaxed_order may return rows slightly out of order
+        return sorted(((int(chunk_id), float(score)) for chunk_id, score in rows), key=lambda hit: hit[1], reverse=True)
+
+    def reindex_chunks(self, db, chunk_ids, agent_id=None, user_id=None):
+        """Clear embedding_pg of the re-embedded chunks so that index_new_chunks copies the new vectors."""
+        try:
+            db.execute(text("UPDATE document_chunks SET embedding_pg = NULL WHERE id = ANY(:ids)"), {"ids": list(chunk_ids)})
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Could not reset pgvector embeddings: {e}")
+            return
+        self.index_new_chunks(db, agent_id=agent_id, user_id=user_id)
+
+    def index_new_chunks(self, db, agent_id=None, user_id=None):
+        """Copy the embeddings of new chunks (embedding_vec / legacy JSON) into embedding_pg."""
+        if user_id:
+            where, scope_id = "d.user_id = :scope_id", user_id
+        elif agent_id:
+            where, scope_id = "d.agent_id = :scope_id", agent_id
+        else:
+            return
+        try:
+            rows = db.execute(text(f"""
+                SELECT c.id, c.embedding_vec, c.embedding
+                FROM document_chunks c
+                JOIN documents d ON d.id = c.document_id
+                WHERE {where} AND c.embedding_pg IS NULL
+                  AND (c.embedding_vec IS NOT NULL OR c.embedding IS NOT NULL)
+            """), {"scope_id": scope_id}).fetchall()
+            params = []
+            for chunk_id, embedding_vec, embedding in rows:
+                vector = load_embedding(embedding_vec, embedding)
+                # Zero vectors (dummy embeddings) are left out, as vector_index does
+                if vector is not None and vector.shape[0] == EMBEDDING_DIMENSION and np.linalg.norm(vector) > 0:
+                    params.append({"id": chunk_id, "vec": to_pgvector(vector)})
+            if params:
+                db.execute(text("UPDATE document_chunks SET embedding_pg = CAST(:vec AS vector) WHERE id = :id"), params)
+                db.commit()
+                logger.info(f"pgvector: {len(params)} chunk embeddings copied to embedding_pg")
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Could not update pgvector embeddings: {e}")
+
+
+exact = ExactRetriever()
+_retriever = None
+_lock = threading.Lock()
+
+
+def get_retriever() -> Retriever:
+    """Backend selected by RETRIEVAL_BACKEND (created once per process)."""
+    global _retriever
+    if _retriever is None:
+        with _lock:
+            if _retriever is None:
+                backend = RETRIEVAL_BACKEND
+                if not backend:
+                    backend = "faiss" if vector_index is not None and vector_index.VECTOR_INDEX_ENABLED else "exact"
+                if backend == "faiss" and vector_index is None:
+                    logger.warning("RETRIEVAL_BACKEND=faiss but FAISS is unavailable; using the exact scan")
+                    backend = "exact"
+                if backend == "pgvector":
+                    _retriever = PgvectorRetriever()
+                elif backend == "faiss":
+                    _retriever = FaissRetriever()
+                else:
+                    _retriever = exact
+                logger.info(f"Retrieval backend: {_retriever.name}")
+    return _retriever
+
+
+def search(db: Session, query_embedding: List[float], top_k: int, agent_id: int = None, user_id: int = None, document_ids: List[int] = None) -> Hits:
+    """Dense top-k with the configured backend; document selections it cannot filter use the exact scan."""
+    retriever = get_retriever()
+    if document_ids and not retriever.filters_documents:
+        retriever = exact
+    if retriever is not exact:
+        try:
+            return retriever.search(db, query_embedding, top_k, agent_id=agent_id, user_id=user_id, document_ids=document_ids)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"{retriever.name} search failed, falling back to exact scan: {e}")
+    return exact.search(db, query_embedding, top_k, agent_id=agent_id, user_id=user_id, document_ids=document_ids)
+
+
+def index_new_chunks(db: Session, agent_id: int = None, user_id: int = None):
+    get_retriever().index_new_chunks(db, agent_id=agent_id, user_id=user_id)
+
+
+def remove_chunks(chunk_ids: List[int], agent_id: int = None, user_id: int = None):
+    get_retriever().remove_chunks(chunk_ids, agent_id=agent_id, user_id=user_id)
+
+
+def reindex_chunks(db: Session, chunk_ids: List[int], agent_id: int = None, user_id: int = None):
+    get_retriever().reindex_chunks(db, chunk_ids, agent_id=agent_id, user_id=user_id)
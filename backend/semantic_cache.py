@@ -0,0 +1,220 @@
+# Cache sémantique des réponses par agent : une question proche (cosinus >= seuil) d'une question déjà
+# traitée, sur le même corpus, reçoit la réponse enregistrée sans embedding de recherche ni appel LLM.
+import os
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Agent, Document, DocumentChunk, SemanticCacheEntry
+from embedding_codec import encode_embedding, decode_embedding, embedding_present
+from similarity import EmbeddingMatrix
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Minimum cosine similarity between the new question and a cached one
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+# Entries kept per agent; the least recently used unpinned entries are evicted beyond that
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+# Best matches checked against the DB (corpus version, model) before giving up
+SEMANTIC_CACHE_CANDIDATES = 5
+
+_lock = threading.Lock()
+_matrices = {}  # agent_id -> ((count, max_id), ids, EmbeddingMatrix)
+_stats = {"lookups": 0, "hits": 0, "misses": 0, "stored": 0, "saved_tokens": 0}
+
+
+def _count(field: str, n: int = 1):
+    with _lock:
+        _stats[field] += n
+
+
+def corpus_version(db: Session, agent_id: int) -> str:
+    """Fingerprint of what an agent's answers depend on: its embedded chunks and its context.
+
+    Derived from the DB rather than a counter, so it survives restarts and is the same on every instance.
+    """
+    count, max_id = (
+        db.query(func.count(DocumentChunk.id), func.max(DocumentChunk.id))
+        .join(Document, DocumentChunk.document_id == Document.id)
+        .filter(Document.agent_id == agent_id)
+        .filter(embedding_present(DocumentChunk))
+        .one()
+    )
+    contexte = db.query(Agent.contexte).filter(Agent.id == agent_id).scalar() or ""
+    return f"{count or 0}:{max_id or 0}:{hashlib.sha256(contexte.encode('utf-8')).hexdigest()[:12]}"
+
+
+def is_standalone(question: str, history: Optional[list]) -> bool:
+    """Only questions without prior turns are cacheable (follow-ups depend on the conversation)."""
+    if not history:
+        return True
+    return len(history) == 1 and history[0].get("content") == question
+
+
+def _matrix(db: Session, agent_id: int):
+    signature = db.query(func.count(SemanticCacheEntry.id), func.max(SemanticCacheEntry.id)).filter(
+        SemanticCacheEntry.agent_id == agent_id
+    ).one()
+    with _lock:
+        cached = _matrices.get(agent_id)
+        if cached is not None and cached[0] == tuple(signature):
+            return cached[1], cached[2]
+    rows = db.query(SemanticCacheEntry.id, SemanticCacheEntry.question_embedding).filter(
+        SemanticCacheEntry.agent_id == agent_id
+    ).all()
+    ids = np.array([row.id for row in rows], dtype="int64")
+    matrix = EmbeddingMatrix([decode_embedding(row.question_embedding) for row in rows], normalized=True)
+    with _lock:
+        _matrices[agent_id] = (tuple(signature), ids, matrix)
+    return ids, matrix
+
+
+def lookup(db: Session, agent_id: int, query_embedding: List[float], version: str, model_id: str = None) -> Optional[SemanticCacheEntry]:
+    """Closest cached entry above the threshold that is still valid (same corpus and model, or pinned)."""
+    _count("lookups")
+    ids, matrix = _matrix(db, agent_id)
+    if not len(matrix):
+        _count("misses")
+        return None
+    idx, scores = matrix.top_k(query_embedding, SEMANTIC_CACHE_CANDIDATES)
+    candidates = [(int(ids[i]), float(score)) for i, score in zip(idx, scores) if score >= SEMANTIC_CACHE_THRESHOLD]
+    if candidates:
+        rows = {e.id: e for e in db.query(SemanticCacheEntry).filter(SemanticCacheEntry.id.in_([c[0] for c in candidates]))}
+        for entry_id, score in candidates:
+            entry = rows.get(entry_id)
+            if entry is None:
+                continue
+            if entry.pinned or (entry.corpus_version == version and entry.model_id == model_id):
+                entry.hits = (entry.hits or 0) + 1
+                entry.last_hit_at = datetime.utcnow()
+                db.commit()
+                _count("hits")
+                _count("saved_tokens", entry.tokens or 0)
+                logger.info(f"Semantic cache hit for agent {agent_id}: entry {entry.id} (cosine {score:.3f})")
+                return entry
+    _count("misses")
+    return None
+
+
+def store(agent_id: int, question: str, query_embedding: List[float], answer: str, version: str, model_id: str = None, tokens: int = 0):
+    """Record an answer; drops the agent's stale unpinned entries and evicts beyond SEMANTIC_CACHE_MAX_ENTRIES."""
+    db = SessionLocal()
+    try:
+        db.add(SemanticCacheEntry(
+            agent_id=agent_id,
+            question=question,
+            question_embedding=encode_embedding(query_embedding, dtype="float32"),
+            answer=answer,
+            model_id=model_id,
+            corpus_version=version,
+            tokens=tokens,
+        ))
+        db.query(SemanticCacheEntry).filter(
+            SemanticCacheEntry.agent_id == agent_id,
+            SemanticCacheEntry.pinned.is_(False),
+            SemanticCacheEntry.corpus_version != version,
+        ).delete(synchronize_session=False)
+        db.flush()
+        unpinned = db.query(SemanticCacheEntry.id).filter(
+            SemanticCacheEntry.agent_id == agent_id, SemanticCacheEntry.pinned.is_(False)
+        )
+        overflow = unpinned.count() - SEMANTIC_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            oldest = [row.id for row in unpinned.order_by(
+                func.coalesce(SemanticCacheEntry.last_hit_at, SemanticCacheEntry.created_at)
+            ).limit(overflow)]
+            db.query(SemanticCacheEntry).filter(SemanticCacheEntry.id.in_(oldest)).delete(synchronize_session=False)
+        db.commit()
+        _count("stored")
+    except Exception as e:
+        logger.warning(f"Could not store semantic cache entry for agent {agent_id}: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
+def list_entries(db: Session, agent_id: int, limit: int = 100, offset: int = 0) -> List[SemanticCacheEntry]:
+    return (
+        db.query(SemanticCacheEntry)
+        .filter(SemanticCacheEntry.agent_id == agent_id)
+        .order_by(SemanticCacheEntry.pinned.desc(), SemanticCacheEntry.hits.desc(), SemanticCacheEntry.id.desc())
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+
+
+def set_pinned(db: Session, agent_id: int, entry_id: int, pinned: bool) -> Optional[SemanticCacheEntry]:
+    entry = db.query(SemanticCacheEntry).filter(SemanticCacheEntry.id == entry_id, SemanticCacheEntry.agent_id == agent_id).first()
+    if entry is None:
+        return None
+    entry.pinned = pinned
+    db.commit()
+    db.refresh(entry)
+    return entry
+
+
+def delete_entry(db: Session, agent_id: int, entry_id: int) -> bool:
+    deleted = db.query(SemanticCacheEntry).filter(
+        SemanticCacheEntry.id == entry_id, SemanticCacheEntry.agent_id == agent_id
+    ).delete(synchronize_session=False)
+    db.commit()
+    return bool(deleted)
+
+
+def purge(db: Session, agent_id: int, include_pinned: bool = False) -> int:
+    query = db.query(SemanticCacheEntry).filter(SemanticCacheEntry.agent_id == agent_id)
+    if not include_pinned:
+        query = query.filter(SemanticCacheEntry.pinned.is_(False))
+    deleted = query.delete(synchronize_session=False)
+    db.commit()
+    logger.info(f"Semantic cache purged for agent {agent_id}: {deleted} entries")
+    return deleted
+
+
+def agent_stats(db: Session, agent_id: int) -> dict:
+    """Totals persisted in the DB for one agent (all instances, since the entries were stored)."""
+    entries, pinned, hits, saved = db.query(
+        func.count(SemanticCacheEntry.id),
+        func.sum(case((SemanticCacheEntry.pinned.is_(True), 1), else_=0)),
+        func.sum(SemanticCacheEntry.hits),
+        func.sum(SemanticCacheEntry.hits * SemanticCacheEntry.tokens),
+    ).filter(SemanticCacheEntry.agent_id == agent_id).one()
+    return {
+        "entries": entries or 0,
+        "pinned": int(pinned or 0),
+        "hits": int(hits or 0),
+        "saved_tokens": int(saved or 0),
+    }
+
+
+def entry_to_dict(entry: SemanticCacheEntry) -> dict:
+    return {
+        "id": entry.id,
+        "question": entry.question,
+        "answer": entry.answer,
+        "model_id": entry.model_id,
+        "corpus_version": entry.corpus_version,
+        "tokens": entry.tokens,
+        "hits": entry.hits,
+        "pinned": entry.pinned,
+        "created_at": entry.created_at.isoformat() if entry.created_at else None,
+        "last_hit_at": entry.last_hit_at.isoformat() if entry.last_hit_at else None,
+    }
+
+
+def stats() -> dict:
+    """Counters of this process since start (hit rate, tokens not sent to the model)."""
+    with _lock:
+        result = dict(_stats)
+    result["hit_rate"] = round(result["hits"] / result["lookups"], 3) if result["lookups"] else 0.0
+    result["threshold"] = SEMANTIC_CACHE_THRESHOLD
+    result["enabled"] = SEMANTIC_CACHE_ENABLED
+    return result
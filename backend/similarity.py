@@ -0,0 +1,65 @@
+# Scoring vectorisé : une seule multiplication matrice-vecteur + sélection top-k par argpartition
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+
+Vector = Union[Sequence[float], np.ndarray]
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, in O(n + k log k)."""
+    n = scores.shape[0]
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+class EmbeddingMatrix:
+    """Candidate embeddings stacked into one contiguous float32 matrix with precomputed row norms.
+
+    Rows written through embedding_codec are already unit-norm (normalized at ingest), in which
+    case `normalized=True` skips the norm pass entirely; otherwise norms are computed once, in a
+    single vectorized pass, when the matrix is built.
+    """
+
+    def __init__(self, vectors: Union[List[Vector], np.ndarray], normalized: bool = False):
+        if isinstance(vectors, np.ndarray) and vectors.ndim == 2:
+            self.matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        elif len(vectors):
+            self.matrix = np.ascontiguousarray(np.vstack(vectors), dtype=np.float32)
+        else:
+            self.matrix = np.empty((0, 0), dtype=np.float32)
+        if normalized:
+            self.norms = None
+        else:
+            self.norms = np.linalg.norm(self.matrix, axis=1)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def dimension(self) -> int:
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    def scores(self, query: Vector) -> np.ndarray:
+        """Cosine similarity of the query against every row (zero-norm rows score 0)."""
+        if len(self) == 0:
+            return np.empty(0, dtype=np.float32)
+        q = np.asarray(query, dtype=np.float32)
+        q_norm = float(np.linalg.norm(q))
+        if q_norm == 0:
+            return np.zeros(len(self), dtype=np.float32)
+        dots = self.matrix @ q
+        if self.norms is None:
+            return dots / q_norm
+        denom = self.norms * q_norm
+        return np.divide(dots, denom, out=np.zeros_like(dots), where=denom > 0)
+
+    def top_k(self, query: Vector, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row indices, cosine scores) of the k best rows, best first."""
+        scores = self.scores(query)
+        idx = top_k_indices(scores, k)
+        return idx, scores[idx]
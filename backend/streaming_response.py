@@ -0,0 +1,176 @@
+# Réponses en streaming (token par token) : OpenAI stream=True, Gemini streamGenerateContent, exposées en SSE
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import llm_providers
+import analytics
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def astream_gemini(prompt: str, model_name: str, temperature: float = 0.7, max_tokens: int = 512, timeout: int = 60) -> AsyncIterator[str]:
+    """Yield text deltas from Vertex streamGenerateContent (SSE mode) over the shared Vertex pool."""
+    from gemini_client import resolve_model, build_generate_url, get_access_token
+    token = await asyncio.to_thread(get_access_token)
+    resolved_model = resolve_model(model_name)
+    url = build_generate_url(resolved_model, method="streamGenerateContent") + "?alt=sse"
+    started = time.perf_counter()
+    first = True
+    with analytics.track_llm("vertex", resolved_model):
+        async for text in _vertex_sse_texts(url, resolved_model, prompt, token, temperature, max_tokens, timeout):
+            if first:
+                analytics.record_llm_ttft("vertex", resolved_model, time.perf_counter() - started)
+                first = False
+            yield text
+
+
+async def _vertex_sse_texts(url: str, model: str, prompt: str, token: str, temperature: float, max_tokens: int, timeout: int) -> AsyncIterator[str]:
+    from gemini_client import build_request_body
+    usage = None
+    async with llm_providers.get_vertex_http().stream(
+        "POST",
+        url,
+        json=build_request_body(prompt, temperature, max_tokens),
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=timeout,
+    ) as resp:
+        if resp.status_code >= 400:
+            body = await resp.aread()
+            logger.error(f"Vertex streamGenerateContent non-2xx status {resp.status_code}: {body[:1000]!r}")
+            resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if not payload:
+                continue
+            try:
+                chunk = json.loads(payload)
+            except ValueError:
+                continue
+            # The last chunk carries the token usage of the whole answer
+            usage = chunk if chunk.get("usageMetadata") else usage
+            # Chunks without text parts (safety ratings, usage metadata) are skipped
+            text = _chunk_text(chunk)
+            if text:
+                yield text
+    analytics.record_gemini_usage(model, usage)
+
+
+def _chunk_text(chunk: dict) -> str:
+    """Text of a streamGenerateContent chunk: every text part of the first candidate, joined."""
+    candidates = chunk.get("candidates")
+    if not isinstance(candidates, list) or not candidates or not isinstance(candidates[0], dict):
+        return ""
+    content = candidates[0].get("content")
+    parts = content.get("parts") if isinstance(content, dict) else None
+    if not isinstance(parts, list):
+        return ""
+    return "".join(part["text"] for part in parts if isinstance(part, dict) and isinstance(part.get("text"), str))
+
+
+async def astream_openai(messages: list, model: str, temperature: float = 0.7, max_tokens: int = None) -> AsyncIterator[str]:
+    """Yield text deltas from chat.completions.create(stream=True)."""
+    client = llm_providers.get_async_openai()
+    started = time.perf_counter()
+    first = True
+    with analytics.track_llm("openai", model):
+        stream = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            # Token usage arrives in a last chunk without choices
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            if getattr(chunk, "usage", None):
+                analytics.record_llm_usage("openai", model, chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first:
+                    analytics.record_llm_ttft("openai", model, time.perf_counter() - started)
+                    first = False
+                yield delta
+
+
+async def get_chat_response_stream(messages: list, model_id: str = None, gemini_only: bool = False, temperature: float = 0.7, max_tokens: int = None) -> AsyncIterator[str]:
+    """Streaming variant of openai_client.get_chat_response, with the same provider routing.
+
+    A Gemini failure before the first token falls back to OpenAI (unless gemini_only / GEMINI_ONLY);
+    once tokens have been sent, errors are propagated to the caller.
+    """
+    from openai_client import DEFAULT_MODEL, DEFAULT_MAX_TOKENS, _messages_to_prompt
+    model = model_id if model_id else DEFAULT_MODEL
+    max_tokens = max_tokens if max_tokens is not None else DEFAULT_MAX_TOKENS
+    if isinstance(model, str) and model.startswith('gemini:'):
+        model_short = model.split(':', 1)[1]
+        started = False
+        try:
+            async for delta in astream_gemini(_messages_to_prompt(messages), model_short, temperature=temperature, max_tokens=max_tokens):
+                started = True
+                yield delta
+            return
+        except Exception as e:
+            env_gemini_only = os.getenv("GEMINI_ONLY", "false").lower() in ("1", "true", "yes")
+            if started or gemini_only or env_gemini_only:
+                logger.error(f"Gemini streaming call failed: {e}")
+                raise
+            logger.warning(f"Gemini streaming call failed (will fallback to OpenAI): {e}")
+            model = DEFAULT_MODEL
+    if isinstance(model, str) and model.startswith('perplexity:'):
+        logger.warning(f"Perplexity integration not implemented; falling back to DEFAULT_MODEL ({DEFAULT_MODEL}).")
+        model = DEFAULT_MODEL
+    async for delta in astream_openai(messages, model, temperature=temperature, max_tokens=max_tokens):
+        yield delta
+
+
+async def stream_answer_events(
+    messages: Optional[list],
+    model_id: str = None,
+    gemini_only: bool = False,
+    answer: Optional[str] = None,
+    on_complete: Optional[Callable[[str], Awaitable[Optional[dict]]]] = None,
+    trace=None,
+) -> AsyncIterator[str]:
+    """SSE frames for one answer: `token` events with {"delta"}, then `done` with the full answer.
+
+    If `answer` is already known (no LLM call needed) it is sent as a single token. `on_complete`
+    receives the full text once the stream ends (e.g. to persist the Message); the dict it returns
+    is merged into the `done` payload. Errors are reported as an `error` event. With a
+    request_trace.RequestTrace, the model's time to first token and total time are recorded.
+    """
+    parts = []
+    try:
+        if answer is not None:
+            parts.append(answer)
+            yield sse_event("token", {"delta": answer})
+        else:
+            started = time.perf_counter()
+            async for delta in get_chat_response_stream(messages, model_id=model_id, gemini_only=gemini_only):
+                if trace is not None and not parts:
+                    trace.add("llm_ttft", (time.perf_counter() - started) * 1000)
+                parts.append(delta)
+                yield sse_event("token", {"delta": delta})
+            if trace is not None:
+                trace.add("llm", (time.perf_counter() - started) * 1000)
+        full = "".join(parts)
+        done = {"answer": full}
+        if on_complete is not None:
+            done.update(await on_complete(full) or {})
+        yield sse_event("done", done)
+    except Exception as e:
+        logger.error(f"Streaming answer failed: {e}")
+        yield sse_event("error", {"detail": str(e), "partial": "".join(parts)})
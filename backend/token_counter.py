@@ -0,0 +1,65 @@
+# Comptage de tokens partagé (tiktoken) : troncature des entrées d'embedding (openai_client), budget du prompt
+# (context_packer) et taille des chunks (chunker) utilisent les mêmes encodages et la même estimation de repli.
+import logging
+from functools import lru_cache
+from typing import Optional
+
+try:
+    import tiktoken
+except Exception:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = "cl100k_base"
+# Without the BPE files (offline), counts are estimated from the length: 3 characters per token is
+# deliberately conservative (French prose is closer to 4), so estimated budgets are not overrun
+CHARS_PER_TOKEN_ESTIMATE = 3
+
+
+@lru_cache(maxsize=8)
+def get_encoding(name: str = DEFAULT_ENCODING):
+    """tiktoken encoding by name, or None when tiktoken or its BPE file is unavailable (counts are then estimated)."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"tiktoken encoding {name} unavailable, token counts are estimated: {e}")
+        return None
+
+
+@lru_cache(maxsize=16)
+def encoding_for_model(model: Optional[str] = None):
+    """Encoding of an OpenAI model; Gemini and unknown ids use cl100k_base, a close enough estimate for budgeting."""
+    if tiktoken is not None and model:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except Exception:
+            pass
+    return get_encoding(DEFAULT_ENCODING)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text or "") // CHARS_PER_TOKEN_ESTIMATE + 1
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Token count of a text for a model (cl100k_base by default), estimated if tiktoken is unavailable."""
+    encoding = encoding_for_model(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode_ordinary(text or ""))
+
+
+def truncate(text: str, max_tokens: int, model: Optional[str] = None) -> tuple:
+    """Return (text, token_count), the text cut to its first max_tokens tokens."""
+    encoding = encoding_for_model(model)
+    if encoding is None:
+        text = (text or "")[:max(0, max_tokens) * CHARS_PER_TOKEN_ESTIMATE]
+        return text, estimate_tokens(text)
+    tokens = encoding.encode_ordinary(text or "")
+    if len(tokens) > max_tokens:
+        tokens = tokens[:max(0, max_tokens)]
+        text = encoding.decode(tokens)
+    return text, len(tokens)
@@ -0,0 +1,282 @@
+# Index vectoriel ANN persistant par agent et par utilisateur (FAISS)
+import os
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Document, DocumentChunk
+from embedding_codec import load_embedding, embedding_present
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_ENABLED = os.getenv("VECTOR_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "/tmp/vector_index")
+DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "1536"))  # text-embedding-3-small
+# Below this size an exact inner-product index answers in a few ms; above it we switch to IVF.
+IVF_MIN_VECTORS = int(os.getenv("VECTOR_INDEX_IVF_MIN_VECTORS", "20000"))
+IVF_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "16"))
+
+
+def _normalize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """L2-normalize rows in place (inner product == cosine) and return (vectors, mask of usable rows)."""
+    norms = np.linalg.norm(vectors, axis=1)
+    usable = norms > 0
+    vectors[usable] /= norms[usable, None]
+    return vectors, usable
+
+
+class ScopeIndex:
+    """FAISS index for one retrieval scope ("agent_<id>" or "user_<id>").
+
+    Vector ids are DocumentChunk ids. `rows_seen` / `max_chunk_id` / `binary_rows` mirror the DB
+    state the index was last synced with, so a stale copy (e.g. built on another Cloud Run instance)
+    is detected and caught up incrementally, or rebuilt when chunks were deleted or re-embedded
+    (legacy JSON rows, including dummy zero vectors, rewritten to embedding_vec by the backfill).
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.index = None
+        self.kind = "flat"
+        self.rows_seen = 0
+        self.max_chunk_id = 0
+        self.binary_rows = None
+        self.lock = threading.RLock()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(VECTOR_INDEX_DIR, f"{self.key}.faiss")
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(VECTOR_INDEX_DIR, f"{self.key}.json")
+
+    def _new_index(self, vectors: np.ndarray):
+        """Create an empty index sized for the given (normalized) training vectors."""
+        n = len(vectors)
+        if n >= IVF_MIN_VECTORS:
+            nlist = int(4 * np.sqrt(n))
+            quantizer = faiss.IndexFlatIP(DIMENSION)
+            index = faiss.IndexIVFFlat(quantizer, DIMENSION, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.nprobe = IVF_NPROBE
+            self.kind = "ivf"
+            return index
+        self.kind = "flat"
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(DIMENSION))
+
+    def build(self, ids: np.ndarray, vectors: np.ndarray, rows_seen: int, max_chunk_id: int, binary_rows: int):
+        with self.lock:
+            self.index = self._new_index(vectors)
+            if len(ids):
+                self.index.add_with_ids(vectors, ids)
+            self.rows_seen = rows_seen
+            self.max_chunk_id = max_chunk_id
+            self.binary_rows = binary_rows
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray, rows_seen: int, max_chunk_id: int, binary_rows: int):
+        with self.lock:
+            if len(ids):
+                self.index.add_with_ids(vectors, ids)
+            self.rows_seen += rows_seen
+            self.max_chunk_id = max(self.max_chunk_id, max_chunk_id)
+            self.binary_rows = binary_rows
+
+    def remove(self, chunk_ids: List[int]):
+        with self.lock:
+            if self.index is None or not chunk_ids:
+                return
+            self.index.remove_ids(np.array(chunk_ids, dtype="int64"))
+            self.rows_seen = max(0, self.rows_seen - len(chunk_ids))
+            if self.binary_rows is not None:
+                # Assumes embedding_vec rows; a removed legacy JSON row only costs a rebuild on the next sync
+                self.binary_rows = max(0, self.binary_rows - len(chunk_ids))
+
+    def search(self, query: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        with self.lock:
+            if self.index is None or self.index.ntotal == 0:
+                return []
+            scores, ids = self.index.search(query, min(top_k, self.index.ntotal))
+        return [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i != -1]
+
+    def save(self):
+        with self.lock:
+            if self.index is None:
+                return
+            os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+            tmp_path = self.index_path + ".tmp"
+            faiss.write_index(self.index, tmp_path)
+            os.replace(tmp_path, self.index_path)
+            # Also replaced atomically; `ntotal` lets load() reject a meta file left from before the index
+            # it sits next to (crash between the two replaces)
+            tmp_meta_path = self.meta_path + ".tmp"
+            with open(tmp_meta_path, "w") as f:
+                json.dump({
+                    "kind": self.kind, "rows_seen": self.rows_seen, "max_chunk_id": self.max_chunk_id,
+                    "binary_rows": self.binary_rows, "ntotal": int(self.index.ntotal), "dimension": DIMENSION,
+                }, f)
+            os.replace(tmp_meta_path, self.meta_path)
+
+    def load(self) -> bool:
+        with self.lock:
+            if not (os.path.exists(self.index_path) and os.path.exists(self.meta_path)):
+                return False
+            try:
+                with open(self.meta_path) as f:
+                    meta = json.load(f)
+                if meta.get("dimension") != DIMENSION:
+                    return False
+                index = faiss.read_index(self.index_path)
+                if meta.get("ntotal") != index.ntotal:
+                    logger.warning(f"Vector index {self.key} on disk does not match its meta file, rebuilding")
+                    return False
+                self.index = index
+                self.kind = meta.get("kind", "flat")
+                if self.kind == "ivf":
+                    self.index.nprobe = IVF_NPROBE
+                self.rows_seen = int(meta.get("rows_seen", 0))
+                self.max_chunk_id = int(meta.get("max_chunk_id", 0))
+                self.binary_rows = meta.get("binary_rows")
+                return True
+            except Exception as e:
+                logger.warning(f"Could not load vector index {self.key} from disk: {e}")
+                self.index = None
+                return False
+
+
+_indexes: Dict[str, ScopeIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _scope_key(agent_id: Optional[int], user_id: Optional[int]) -> Optional[str]:
+    if agent_id:
+        return f"agent_{agent_id}"
+    if user_id:
+        return f"user_{user_id}"
+    return None
+
+
+def _scope_query(db: Session, columns, agent_id: Optional[int], user_id: Optional[int]):
+    """Query over embedded chunks of a scope, using the same filters as search_similar_texts_for_user."""
+    query = db.query(*columns).join(Document, DocumentChunk.document_id == Document.id)
+    if agent_id:
+        query = query.filter(Document.agent_id == agent_id)
+    else:
+        query = query.filter(Document.user_id == user_id)
+    return query.filter(embedding_present(DocumentChunk))
+
+
+def _load_vectors(db: Session, agent_id: Optional[int], user_id: Optional[int], min_chunk_id: int = 0):
+    """Load (ids, normalized vectors, rows_seen, max_chunk_id) for embedded chunks with id > min_chunk_id."""
+    query = _scope_query(db, (DocumentChunk.id, DocumentChunk.embedding_vec, DocumentChunk.embedding), agent_id, user_id)
+    if min_chunk_id:
+        query = query.filter(DocumentChunk.id > min_chunk_id)
+    ids = []
+    vectors = []
+    for chunk_id, embedding_vec, embedding in query.yield_per(1000):
+        ids.append(chunk_id)
+        vectors.append(load_embedding(embedding_vec, embedding))
+    if not ids:
+        return np.empty(0, dtype="int64"), np.empty((0, DIMENSION), dtype="float32"), 0, 0
+    id_arr = np.array(ids, dtype="int64")
+    vec_arr, usable = _normalize(np.vstack(vectors).astype("float32", copy=False))
+    return id_arr[usable], np.ascontiguousarray(vec_arr[usable]), len(ids), int(id_arr.max())
+
+
+def _sync(scope: ScopeIndex, db: Session, agent_id: Optional[int], user_id: Optional[int]) -> bool:
+    """Bring the index in line with the DB. Returns True if the index changed."""
+    count, max_id, binary = _scope_query(
+        db, (func.count(DocumentChunk.id), func.max(DocumentChunk.id), func.count(DocumentChunk.embedding_vec)), agent_id, user_id
+    ).one()
+    count = count or 0
+    max_id = max_id or 0
+    binary = binary or 0
+    if scope.index is not None and count == scope.rows_seen and max_id <= scope.max_chunk_id:
+        if scope.binary_rows is None:
+            # Meta file written before binary_rows was tracked: adopt the current count
+            scope.binary_rows = binary
+        if binary == scope.binary_rows:
+            return False
+    appended = count - scope.rows_seen
+    if scope.index is not None and max_id > scope.max_chunk_id and scope.binary_rows is not None and binary - scope.binary_rows == appended:
+        # Only appends since the last sync (new chunks are stored in embedding_vec, no existing row
+        # was re-embedded): add the new rows instead of rebuilding
+        ids, vectors, rows_seen, new_max = _load_vectors(db, agent_id, user_id, min_chunk_id=scope.max_chunk_id)
+        if rows_seen == appended:
+            scope.add(ids, vectors, rows_seen, new_max, binary)
+            if scope.kind == "flat" and scope.index.ntotal >= 2 * IVF_MIN_VECTORS:
+                logger.info(f"Vector index {scope.key} outgrew flat storage, rebuilding as IVF")
+            else:
+                return True
+    ids, vectors, rows_seen, new_max = _load_vectors(db, agent_id, user_id)
+    scope.build(ids, vectors, rows_seen, new_max, binary)
+    logger.info(f"Vector index {scope.key} rebuilt ({scope.kind}, {len(ids)} vectors)")
+    return True
+
+
+def _get_scope(key: str) -> ScopeIndex:
+    with _indexes_lock:
+        scope = _indexes.get(key)
+        if scope is None:
+            scope = ScopeIndex(key)
+            scope.load()
+            _indexes[key] = scope
+        return scope
+
+
+def search(db: Session, query_embedding: List[float], top_k: int, agent_id: int = None, user_id: int = None) -> List[Tuple[int, float]]:
+    """Return the top_k (chunk_id, cosine score) pairs for the agent scope, or the user scope if no agent."""
+    key = _scope_key(agent_id, user_id)
+    if key is None:
+        return []
+    scope = _get_scope(key)
+    with scope.lock:
+        if _sync(scope, db, agent_id, user_id):
+            scope.save()
+    query, usable = _normalize(np.array([query_embedding], dtype="float32"))
+    if not usable[0]:
+        return []
+    return scope.search(query, top_k)
+
+
+def _affected_keys(agent_id: Optional[int], user_id: Optional[int]) -> List[Tuple[str, Optional[int], Optional[int]]]:
+    keys = []
+    if agent_id:
+        keys.append((f"agent_{agent_id}", agent_id, None))
+    if user_id:
+        keys.append((f"user_{user_id}", None, user_id))
+    return keys
+
+
+def index_new_chunks(db: Session, agent_id: int = None, user_id: int = None):
+    """Pick up freshly committed chunks in the agent and user indexes (no-op for scopes never built)."""
+    for key, scope_agent_id, scope_user_id in _affected_keys(agent_id, user_id):
+        try:
+            scope = _get_scope(key)
+            with scope.lock:
+                if scope.index is None:
+                    continue  # built lazily on first search
+                if _sync(scope, db, scope_agent_id, scope_user_id):
+                    scope.save()
+        except Exception as e:
+            logger.warning(f"Could not update vector index {key}: {e}")
+
+
+def remove_chunks(chunk_ids: List[int], agent_id: int = None, user_id: int = None):
+    """Remove deleted chunks from the agent and user indexes."""
+    for key, _, _ in _affected_keys(agent_id, user_id):
+        try:
+            scope = _get_scope(key)
+            with scope.lock:
+                if scope.index is None:
+                    continue
+                scope.remove(chunk_ids)
+                scope.save()
+        except Exception as e:
+            logger.warning(f"Could not remove chunks from vector index {key}: {e}")
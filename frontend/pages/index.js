@@ -201,6 +201,23 @@ export default function Dashboard() {
 
   // Suppression des fonctions d'export CSV/PDF
 
+  // Les uploads sont traités en tâche de fond : attendre la fin du job d'ingestion
+  // (le backend marque en échec un job perdu après INGEST_JOB_STALE_SECONDS ; ce délai n'est qu'un garde-fou)
+  const INGEST_POLL_DEADLINE_MS = 20 * 60 * 1000;
+  const waitForIngestJob = async (jobId) => {
+    if (!jobId) return;
+    const deadline = Date.now() + INGEST_POLL_DEADLINE_MS;
+    while (Date.now() < deadline) {
+      const res = await axios.get(`${API_URL}/ingest/jobs/${jobId}`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      if (res.data.status === "done") return res.data;
+      if (res.data.status === "failed") throw new Error(res.data.error || "Ingestion failed");
+      await new Promise((resolve) => setTimeout(resolve, 1500));
+    }
+    throw new Error("Le traitement du document prend trop de temps. Vérifiez plus tard s'il apparaît dans vos documents.");
+  };
+
   const handleFileUpload = async (event) => {
     const file = event.target.files[0];
     if (!file) return;
@@ -220,6 +237,7 @@ export default function Dashboard() {
             Authorization: `Bearer ${token}`,
           },
         });
+        await waitForIngestJob(response.data.job_id);
         
         // Reload documents for current agent
         loadAgentData(currentAgent.id, token);
@@ -233,6 +251,7 @@ export default function Dashboard() {
             Authorization: `Bearer ${token}`,
           },
         });
+        await waitForIngestJob(response.data.job_id);
         
         // Reload all documents
         loadDocuments(token);
@@ -483,9 +502,10 @@ export default function Dashboard() {
                 try {
                   const payload = { url: urlToAdd };
                   if (currentAgent) payload.agent_id = currentAgent.id;
-                  await axios.post(`${API_URL}/upload-url`, payload, {
+                  const response = await axios.post(`${API_URL}/upload-url`, payload, {
                     headers: { Authorization: `Bearer ${token}` }
                   });
+                  await waitForIngestJob(response.data.job_id);
                   toast.success("URL ajoutée avec succès !");
                   setUrlToAdd("");
                   // Recharger les documents pour afficher la nouvelle source
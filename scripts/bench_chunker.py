@@ -0,0 +1,130 @@
+"""Benchmark: legacy file_loader.chunk_text (NLTK, characters) vs. chunker.chunk_text (regex sentences, tokens).
+
+Usage: PYTHONPATH=backend python scripts/bench_chunker.py [--mb 10] [--repeat 3] [--max-tokens 512] [--overlap-tokens 50]
+                                                       [--legacy-mb 10] [--file PATH] [--target-seconds 1.0]
+
+Chunks a synthetic French document (numbered sections, prose paragraphs, tab-separated tables, lists) of
+--mb megabytes, or the text file given with --file, with both chunkers and prints the median time, the
+throughput and the token size of the chunks. The legacy chunker is run on the first --legacy-mb megabytes
+only (0 = skip it). Token counts are exact when the tiktoken encoding can be loaded, estimated otherwise
+(printed at start); the legacy chunker needs the NLTK 'punkt' model (without it sentences are not split).
+Offline, point TIKTOKEN_CACHE_DIR at a directory holding the cl100k_base BPE file to get exact counts.
+
+Exits with status 1 when the token-aware chunker is slower than --target-seconds per 10 MB (0 = no target).
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import statistics
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import chunker  # noqa: E402
+import context_packer  # noqa: E402
+
+SENTENCES = [
+    "Le contrat prévoit une révision annuelle des tarifs selon l'indice publié au premier trimestre.",
+    "M. Dupont a signé l'avenant le 3 mars, cf. p. 12 de l'annexe technique.",
+    "Les pénalités de retard s'appliquent de plein droit après trente jours !",
+    "« Le client peut résilier le contrat à tout moment par lettre recommandée. »",
+    "Voir l'article 4.2 du règlement intérieur pour les conditions d'accès au site.",
+    "Est-ce que la garantie couvre les pièces d'usure ?",
+    "La facturation est mensuelle et payable à réception, sauf accord écrit contraire.",
+]
+
+
+def make_document(size: int, seed: int = 1) -> str:
+    random.seed(seed)
+    parts = []
+    length = 0
+    section = 0
+    while length < size:
+        section += 1
+        block = [f"{section}. Section {section}"]
+        for _ in range(random.randint(1, 6)):
+            block.append(" ".join(random.choice(SENTENCES) for _ in range(random.randint(2, 10))))
+            block.append("")
+        if section % 6 == 0:
+            block.append("Produit\tPrix unitaire\tQuantité\tRemise")
+            block += [f"Article {j}\t{j * 3},50 €\t{j}\t{j % 5 * 5} %" for j in range(random.randint(3, 60))]
+            block.append("")
+        if section % 9 == 0:
+            block += [f"{k}) Point de contrôle numéro {k}." for k in range(1, 6)]
+            block.append("")
+        text = "\n".join(block)
+        parts.append(text)
+        length += len(text) + 1
+    return "\n".join(parts)[:size]
+
+
+def timed(fn, text: str, repeat: int):
+    timings = []
+    chunks = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = fn(text)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), chunks
+
+
+def describe(label: str, text: str, seconds: float, chunks):
+    tokens = sorted(chunker._count_tokens(chunks)) if chunks else [0]
+    mb = len(text.encode("utf-8")) / 1e6
+    print(f"{label:<8} {mb:>7.2f} {seconds:>9.3f} {mb / seconds if seconds else 0:>8.1f} {len(chunks):>8} "
+          f"{tokens[0]:>6} {tokens[len(tokens) // 2]:>6} {tokens[int(len(tokens) * 0.95)]:>6} {tokens[-1]:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Legacy vs. token-aware chunking")
+    parser.add_argument("--mb", type=float, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-tokens", type=int, default=chunker.CHUNK_MAX_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=chunker.CHUNK_OVERLAP_TOKENS)
+    parser.add_argument("--legacy-mb", type=float, default=10, help="Size given to the legacy chunker (0 = skip)")
+    parser.add_argument("--file", default=None, help="Chunk this UTF-8 text file instead of the synthetic document")
+    parser.add_argument("--target-seconds", type=float, default=1.0, help="Maximum median time per 10 MB (0 = no target)")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, encoding="utf-8", errors="ignore") as f:
+            text = f.read()
+    else:
+        text = make_document(int(args.mb * 1e6))
+    print(f"tiktoken encoding: {'exact' if chunker._encoding() is not None else 'unavailable, estimated counts'}, "
+          f"{chunker.CHUNK_TOKEN_THREADS} counting thread(s), {os.cpu_count()} CPU(s)")
+
+    print(f"\n{'chunker':<8} {'MB':>7} {'median s':>9} {'MB/s':>8} {'chunks':>8} {'min':>6} {'median':>6} {'p95':>6} {'max':>6}  (tokens per chunk)")
+    seconds, chunks = timed(lambda t: chunker.chunk_text(t, args.max_tokens, args.overlap_tokens), text, args.repeat)
+    describe("tokens", text, seconds, chunks)
+    per_10mb = seconds * 10e6 / max(1, len(text.encode("utf-8")))
+    if args.legacy_mb > 0:
+        import nltk
+        from file_loader import chunk_text as legacy_chunk_text
+        legacy_text = text[:int(args.legacy_mb * 1e6)]
+        legacy_chunk_text("Warm-up. Loads NLTK.")
+        try:
+            nltk.data.find("tokenizers/punkt")
+        except LookupError:
+            print("(legacy: NLTK 'punkt' unavailable, sentences are not split)")
+        # Without punkt the legacy chunker logs an error per paragraph
+        logging.getLogger("file_loader").setLevel(logging.CRITICAL)
+        seconds, legacy_chunks = timed(legacy_chunk_text, legacy_text, args.repeat)
+        describe("legacy", legacy_text, seconds, legacy_chunks)
+
+    # The overlap must be removable when neighbouring chunks are merged back into one extract
+    joined = context_packer.join_chunks(chunks)
+    print(f"\njoin_chunks(tokens chunks): {len(joined)} characters for {len(text)} in the source "
+          f"({len(''.join(chunks)) - len(text):+d} before removing the overlap)")
+
+    if args.target_seconds > 0:
+        verdict = "ok" if per_10mb <= args.target_seconds else "FAIL"
+        print(f"\n{verdict}: {per_10mb:.3f} s per 10 MB (target {args.target_seconds:.3f} s)")
+        if per_10mb > args.target_seconds:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
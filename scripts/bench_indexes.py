@@ -0,0 +1,200 @@
+"""Benchmark: query plans and latency of the hot filters without / with the indexes of migration 005.
+
+Usage: PYTHONPATH=backend python scripts/bench_indexes.py [--chunks 1000000] [--chunks-per-document 100]
+                                                         [--conversations 50000] [--messages 500000] [--repeat 20]
+                                                         [--no-seed]
+
+Seeds an empty database (a temporary SQLite file unless DATABASE_URL is set; refuses a database that
+already holds chunks unless --no-seed is given to reuse a previous seed), drops the hot-filter indexes,
+prints the EXPLAIN plan and median latency of each query, creates the indexes (timed) and runs them again.
+PostgreSQL plans are EXPLAIN ANALYZE; SQLite plans are EXPLAIN QUERY PLAN.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="bench_indexes_"), "bench.db")
+
+from sqlalchemy import text  # noqa: E402
+
+import models_conversation  # noqa: E402,F401  (registers conversations/messages tables)
+from database import Base, engine  # noqa: E402
+from migrations import HOT_INDEXES, build_indexes  # noqa: E402
+
+BATCH = 10000
+AGENTS = 1000
+TEAMS = 100
+
+# (label, SQL, parameter factory) ; the factories draw ids from the seeded ranges
+QUERIES = [
+    ("documents of an agent", "SELECT id FROM documents WHERE agent_id = :agent_id",
+     lambda s: {"agent_id": random.randint(1, AGENTS)}),
+    ("chunks of a document", "SELECT id, chunk_index FROM document_chunks WHERE document_id = :document_id ORDER BY chunk_index",
+     lambda s: {"document_id": random.randint(1, s["documents"])}),
+    ("neighbour window", "SELECT id, chunk_text FROM document_chunks WHERE document_id = :document_id AND chunk_index BETWEEN :first AND :last",
+     lambda s: (lambda i: {"document_id": random.randint(1, s["documents"]), "first": i, "last": i + 2})(random.randint(0, s["chunks_per_document"] - 3))),
+    ("latest conversation of agent", "SELECT id FROM conversations WHERE agent_id = :agent_id ORDER BY created_at DESC LIMIT 1",
+     lambda s: {"agent_id": random.randint(1, AGENTS)}),
+    ("conversations of a team", "SELECT id, title FROM conversations WHERE team_id = :team_id ORDER BY created_at DESC",
+     lambda s: {"team_id": random.randint(1, TEAMS)}),
+    ("history tail", "SELECT role, content FROM messages WHERE conversation_id = :conversation_id ORDER BY timestamp DESC, id DESC LIMIT 5",
+     lambda s: {"conversation_id": random.randint(1, s["conversations"])}),
+    ("slack agent by bot user", "SELECT id FROM agents WHERE slack_bot_user_id = :bot_user_id",
+     lambda s: {"bot_user_id": f"UBOT{random.randint(1, AGENTS):05d}"}),
+    ("slack agent by workspace", "SELECT id FROM agents WHERE slack_team_id = :team_id LIMIT 1",
+     lambda s: {"team_id": f"TWS{random.randint(1, AGENTS // 10):04d}"}),
+]
+
+
+def insert_batches(conn, table: str, rows):
+    columns = None
+    batch = []
+    for row in rows:
+        if columns is None:
+            columns = list(row)
+            statement = text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})")
+        batch.append(row)
+        if len(batch) >= BATCH:
+            conn.execute(statement, batch)
+            batch = []
+    if batch:
+        conn.execute(statement, batch)
+
+
+def seed(sizes: dict):
+    base = datetime(2024, 1, 1)
+    documents, per_document = sizes["documents"], sizes["chunks_per_document"]
+    conversations, messages = sizes["conversations"], sizes["messages"]
+    with engine.begin() as conn:
+        insert_batches(conn, "users", [{"id": 1, "username": "bench", "email": "bench@example.com", "hashed_password": "x", "created_at": base}])
+        insert_batches(conn, "agents", ({
+            "id": i, "name": f"agent {i}", "statut": "public", "type": "conversationnel", "user_id": 1, "created_at": base,
+            "slack_bot_user_id": f"UBOT{i:05d}", "slack_team_id": f"TWS{i % (AGENTS // 10):04d}",
+        } for i in range(1, AGENTS + 1)))
+        insert_batches(conn, "teams", ({"id": i, "name": f"team {i}", "leader_agent_id": i, "user_id": 1, "created_at": base} for i in range(1, TEAMS + 1)))
+        insert_batches(conn, "documents", ({
+            "id": i, "filename": f"doc{i}.txt", "content": "", "user_id": 1, "agent_id": i % AGENTS + 1, "created_at": base,
+        } for i in range(1, documents + 1)))
+        print(f"  documents: {documents}")
+        insert_batches(conn, "document_chunks", ({
+            "id": i + 1, "document_id": i // per_document + 1, "chunk_index": i % per_document,
+            "chunk_text": f"chunk {i % per_document} of document {i // per_document + 1}", "created_at": base,
+        } for i in range(documents * per_document)))
+        print(f"  chunks: {documents * per_document}")
+        insert_batches(conn, "conversations", ({
+            "id": i, "agent_id": i % AGENTS + 1, "team_id": i % TEAMS + 1 if i % 5 == 0 else None,
+            "title": f"conversation {i}", "created_at": base + timedelta(seconds=i),
+        } for i in range(1, conversations + 1)))
+        insert_batches(conn, "messages", ({
+            "id": i, "conversation_id": i % conversations + 1, "role": "user" if i % 2 else "agent",
+            "content": f"message {i}", "timestamp": base + timedelta(seconds=i), "buffered": 0,
+        } for i in range(1, messages + 1)))
+        print(f"  conversations: {conversations}, messages: {messages}")
+        if conn.dialect.name == "postgresql":
+            # Explicit ids: move the sequences past the seed so that the app can insert into this database
+            for table in ("users", "agents", "teams", "documents", "document_chunks", "conversations", "messages"):
+                conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"))
+
+
+def analyze():
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def explain(conn, sql: str, params: dict) -> str:
+    if conn.dialect.name == "postgresql":
+        rows = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {sql}"), params).fetchall()
+        return "\n".join(row[0] for row in rows)
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params).fetchall()
+    return "\n".join(row[-1] for row in rows)
+
+
+def run_queries(sizes: dict, repeat: int) -> dict:
+    results = {}
+    with engine.connect() as conn:
+        for label, sql, make_params in QUERIES:
+            conn.execute(text(sql), make_params(sizes)).fetchall()  # warm-up
+            timings = []
+            for _ in range(repeat):
+                params = make_params(sizes)
+                start = time.perf_counter()
+                conn.execute(text(sql), params).fetchall()
+                timings.append((time.perf_counter() - start) * 1000)
+            results[label] = {"plan": explain(conn, sql, make_params(sizes)), "median_ms": statistics.median(timings)}
+    return results
+
+
+def print_plans(title: str, results: dict):
+    print(f"\n=== {title} ===")
+    for label, result in results.items():
+        print(f"\n-- {label}: {result['median_ms']:.3f} ms (median)")
+        for line in result["plan"].splitlines():
+            print(f"   {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot-filter indexes: plans and latency before / after")
+    parser.add_argument("--chunks", type=int, default=1000000)
+    parser.add_argument("--chunks-per-document", type=int, default=100)
+    parser.add_argument("--conversations", type=int, default=50000)
+    parser.add_argument("--messages", type=int, default=500000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--no-seed", action="store_true", help="Reuse the data of a previous run")
+    args = parser.parse_args()
+
+    sizes = {
+        "documents": max(1, args.chunks // args.chunks_per_document),
+        "chunks_per_document": max(3, args.chunks_per_document),
+        "conversations": args.conversations,
+        "messages": args.messages,
+    }
+    print(f"Database: {engine.url.render_as_string(hide_password=True)}")
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        existing = conn.execute(text("SELECT COUNT(*) FROM document_chunks")).scalar()
+    if args.no_seed:
+        if not existing:
+            raise SystemExit("--no-seed: the database holds no chunks")
+        with engine.connect() as conn:
+            sizes["documents"] = conn.execute(text("SELECT MAX(id) FROM documents")).scalar()
+            sizes["conversations"] = conn.execute(text("SELECT MAX(id) FROM conversations")).scalar()
+    elif existing:
+        raise SystemExit(f"The database already holds {existing} chunks; use an empty database or --no-seed")
+    else:
+        print("Seeding...")
+        start = time.perf_counter()
+        seed(sizes)
+        print(f"Seeded in {time.perf_counter() - start:.1f}s")
+
+    with engine.begin() as conn:
+        for name, _, _ in HOT_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    analyze()
+    before = run_queries(sizes, args.repeat)
+    print_plans("Before (no hot-filter indexes)", before)
+
+    print("\nCreating indexes...")
+    for index in HOT_INDEXES:
+        start = time.perf_counter()
+        build_indexes(engine, [index])
+        print(f"  {index[0]}: {time.perf_counter() - start:.2f}s")
+    analyze()
+    after = run_queries(sizes, args.repeat)
+    print_plans("After (migration 005)", after)
+
+    print(f"\n{'query':<32} {'before ms':>12} {'after ms':>12} {'speedup':>10}")
+    for label in before:
+        b, a = before[label]["median_ms"], after[label]["median_ms"]
+        print(f"{label:<32} {b:>12.3f} {a:>12.3f} {b / a if a else float('inf'):>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Benchmark: former serial PDF extraction (all-or-nothing OCR) vs. pdf_extraction's page-parallel pipeline.
+
+Usage: PYTHONPATH=backend python scripts/bench_pdf_extraction.py [--pages 100] [--workers 4] [--budget 0] [--keep DIR]
+
+Generates a synthetic set with reportlab (text-only, scanned = one image per page, mixed = scanned pages
+between text pages) and extracts each file both ways. The new pipeline is also timed to its first page,
+i.e. when chunking can start. OCR needs pytesseract and the tesseract binary (with the 'fra' language);
+without them scanned pages are reported as not OCR'd and only the text-layer part is compared.
+"""
+import os
+import io
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+LINES_PER_PAGE = 40
+SENTENCE = "Le contrat prévoit une révision annuelle des tarifs selon l'indice publié au premier trimestre."
+
+
+def _page_lines(number: int):
+    return [f"Page {number + 1} - ligne {line + 1}. {SENTENCE}" for line in range(LINES_PER_PAGE)]
+
+
+def _scan_image(number: int):
+    # What a scanner produces: the page as a bitmap, no text layer
+    from PIL import Image, ImageDraw
+    image = Image.new("L", (1240, 1754), 255)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(_page_lines(number)):
+        draw.text((80, 80 + i * 40), line, fill=0)
+    return image
+
+
+def make_pdf(path: str, pages: int, scanned_every: int):
+    """scanned_every: 0 = text only, 1 = every page scanned, n = every n-th page scanned."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+    width, height = A4
+    pdf = canvas.Canvas(path, pagesize=A4)
+    for number in range(pages):
+        if scanned_every and number % scanned_every == 0:
+            buffer = io.BytesIO()
+            _scan_image(number).save(buffer, format="PNG")
+            buffer.seek(0)
+            pdf.drawImage(ImageReader(buffer), 0, 0, width=width, height=height)
+        else:
+            text = pdf.beginText(40, height - 50)
+            text.setFont("Helvetica", 9)
+            for line in _page_lines(number):
+                text.textLine(line)
+            pdf.drawText(text)
+        pdf.showPage()
+    pdf.save()
+
+
+def legacy_extract(content: bytes) -> str:
+    """Copy of the former file_loader.extract_text PDF branch: serial text layer, OCR of every page if empty."""
+    import pdfplumber
+    text = None
+    try:
+        with pdfplumber.open(io.BytesIO(content)) as pdf:
+            text = "\n".join([page.extract_text() or "" for page in pdf.pages])
+    except Exception:
+        pass
+    if not text or not text.strip():
+        try:
+            import pytesseract
+            with pdfplumber.open(io.BytesIO(content)) as pdf:
+                text = "\n".join(pytesseract.image_to_string(page.to_image(resolution=300).original, lang="fra") for page in pdf.pages)
+        except Exception:
+            pass
+    return text or ""
+
+
+def bench_pipeline(content: bytes, budget: float):
+    from pdf_extraction import iter_pdf_pages
+    report = {}
+    start = time.perf_counter()
+    first_page = None
+    texts = []
+    for _, text in iter_pdf_pages(content, time_budget=budget, report=report):
+        if first_page is None:
+            first_page = time.perf_counter() - start
+        texts.append(text)
+    return time.perf_counter() - start, first_page or 0.0, "\n".join(texts), report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs. page-parallel PDF extraction")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4, help="CPU_POOL_SIZE of the new pipeline")
+    parser.add_argument("--budget", type=float, default=0, help="Per-document time budget in seconds (0 = none)")
+    parser.add_argument("--keep", default=None, help="Write the synthetic PDFs to this directory and keep them")
+    args = parser.parse_args()
+
+    # Must be set before executors is imported
+    os.environ["CPU_POOL_SIZE"] = str(args.workers)
+    from pdf_extraction import ocr_available
+    from executors import cpu_pool
+
+    directory = args.keep or tempfile.mkdtemp(prefix="bench_pdf_")
+    os.makedirs(directory, exist_ok=True)
+    corpus = [("text", 0), ("scanned", 1), ("mixed", 4)]
+    print(f"Generating {len(corpus)} PDFs of {args.pages} pages in {directory}...")
+    files = []
+    for name, scanned_every in corpus:
+        path = os.path.join(directory, f"{name}_{args.pages}p.pdf")
+        make_pdf(path, args.pages, scanned_every)
+        files.append((name, path))
+    print(f"OCR available: {ocr_available()}; workers: {args.workers}; cpus: {os.cpu_count()}")
+
+    # Start the worker processes outside the measurements
+    bench_pipeline(open(files[0][1], "rb").read(), 0)
+
+    print(f"\n{'file':<10} {'legacy s':>9} {'new s':>8} {'1st page s':>11} {'speedup':>8} {'chars old/new':>16}  report")
+    for name, path in files:
+        with open(path, "rb") as f:
+            content = f.read()
+        start = time.perf_counter()
+        old_text = legacy_extract(content)
+        legacy_seconds = time.perf_counter() - start
+        seconds, first_page, new_text, report = bench_pipeline(content, args.budget)
+        speedup = legacy_seconds / seconds if seconds else float("inf")
+        summary = {k: report[k] for k in ("pages", "ocr_pages", "ocr_skipped", "failed_pages", "timed_out")}
+        print(f"{name:<10} {legacy_seconds:>9.2f} {seconds:>8.2f} {first_page:>11.2f} {speedup:>7.1f}x {len(old_text):>7}/{len(new_text):<8}  {summary}")
+
+    cpu_pool.executor.shutdown(wait=True)
+    if not args.keep:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
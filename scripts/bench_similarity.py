@@ -0,0 +1,87 @@
+"""Microbenchmark: per-chunk cosine loop vs. vectorized EmbeddingMatrix scoring.
+
+Usage: PYTHONPATH=backend python scripts/bench_similarity.py [--sizes 10000,100000,1000000] [--dim 1536] [--top-k 8]
+
+1M x 1536 float32 is ~6 GB of RAM; pass --dim 256 (or smaller --sizes) on small machines.
+The legacy loop is timed on at most 10k rows and extrapolated linearly for larger sizes.
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from similarity import EmbeddingMatrix  # noqa: E402
+
+LEGACY_MAX_ROWS = 10000
+
+
+def legacy_cosine(vec1, vec2):
+    """Copy of the former rag_engine.cosine_similarity (arrays and norms rebuilt per call)."""
+    vec1 = np.array(vec1)
+    vec2 = np.array(vec2)
+    dot_product = np.dot(vec1, vec2)
+    norm_vec1 = np.linalg.norm(vec1)
+    norm_vec2 = np.linalg.norm(vec2)
+    if norm_vec1 == 0 or norm_vec2 == 0:
+        return 0
+    return dot_product / (norm_vec1 * norm_vec2)
+
+
+def bench_legacy(rows, query, top_k):
+    start = time.perf_counter()
+    similarities = []
+    for i, row in enumerate(rows):
+        similarities.append({"similarity": legacy_cosine(query, row), "index": i})
+    similarities.sort(key=lambda x: x["similarity"], reverse=True)
+    similarities[:top_k]
+    return time.perf_counter() - start
+
+
+def bench_vectorized(matrix, query, top_k, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        matrix.top_k(query, top_k)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--top-k", type=int, default=8)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    query = rng.standard_normal(args.dim).astype(np.float32)
+    print(f"{'chunks':>10} {'legacy loop':>14} {'build matrix':>14} {'vectorized':>12} {'speedup':>9}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        data = rng.standard_normal((size, args.dim), dtype=np.float32)
+
+        legacy_rows = min(size, LEGACY_MAX_ROWS)
+        legacy_time = bench_legacy([data[i].tolist() for i in range(legacy_rows)], query.tolist(), args.top_k)
+        legacy_time *= size / legacy_rows
+
+        start = time.perf_counter()
+        matrix = EmbeddingMatrix(data)
+        build_time = time.perf_counter() - start
+
+        # Sanity check against a full sort
+        idx, _ = matrix.top_k(query, args.top_k)
+        expected = np.argsort(-matrix.scores(query))[:args.top_k]
+        assert np.array_equal(idx, expected), "argpartition top-k differs from full sort"
+
+        vec_time = bench_vectorized(matrix, query, args.top_k)
+        suffix = "*" if legacy_rows < size else " "
+        print(f"{size:>10} {legacy_time * 1000:>12.1f}ms{suffix} {build_time * 1000:>12.1f}ms {vec_time * 1000:>10.2f}ms {legacy_time / vec_time:>8.0f}x")
+        del data, matrix
+    print("* extrapolated from the first 10k rows")
+
+
+if __name__ == "__main__":
+    main()
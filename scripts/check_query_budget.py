@@ -0,0 +1,125 @@
+"""Query-count regression check: fails if a read path issues more SQL statements than its budget.
+
+Usage: PYTHONPATH=backend python scripts/check_query_budget.py [--teams 20] [--documents 20] [--messages 200]
+
+Seeds a throwaway SQLite database (unless DATABASE_URL is set), then calls each endpoint / helper and
+counts the statements sent to the engine. Budgets do not depend on the number of rows: a loop that
+queries per team, per agent or per document (N+1) exceeds them as soon as the seed has several rows.
+Exits with status 1 on the first budget exceeded and prints the offending statements.
+"""
+import os
+import sys
+import argparse
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="query_budget_"), "budget.db")
+os.environ.setdefault("OPENAI_API_KEY", "sk-query-budget")
+
+import json  # noqa: E402
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import models_conversation  # noqa: E402,F401  (registers conversations/messages tables)
+from database import Base, engine, SessionLocal, User, Agent, Document, DocumentChunk, Team  # noqa: E402
+from models_conversation import Conversation, Message  # noqa: E402
+from auth import create_access_token  # noqa: E402
+from query_budget import query_budget, QueryBudgetExceeded  # noqa: E402
+
+# (label, method, path template, budget); path templates are filled from the seed
+ENDPOINT_BUDGETS = [
+    ("list teams", "GET", "/teams", 2),
+    ("get team", "GET", "/teams/{team_id}", 2),
+    ("list agents", "GET", "/agents", 1),
+    ("list conversations", "GET", "/conversations?agent_id={agent_id}", 1),
+    ("conversation messages", "GET", "/conversations/{conversation_id}/messages", 1),
+]
+DOCUMENTS_SUMMARY_BUDGET = 3
+HISTORY_BUDGET = 1
+
+
+def seed(teams: int, documents: int, messages: int) -> dict:
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        user = User(username=f"budget-{os.getpid()}", email=f"budget-{os.getpid()}@example.com", hashed_password="x")
+        db.add(user)
+        db.commit()
+        agents = [Agent(name=f"agent {i}", user_id=user.id, type="conversationnel") for i in range(teams * 3 + 1)]
+        db.add_all(agents)
+        db.commit()
+        for i in range(teams):
+            members = [agents[3 * i + 1].id, agents[3 * i + 2].id, agents[3 * i + 3].id]
+            db.add(Team(name=f"team {i}", leader_agent_id=agents[0].id, action_agent_ids=json.dumps(members), user_id=user.id))
+        for i in range(documents):
+            document = Document(filename=f"doc {i}.txt", content="", user_id=user.id, agent_id=agents[0].id)
+            db.add(document)
+            db.flush()
+            db.add_all(DocumentChunk(document_id=document.id, chunk_text=f"chunk {j} " * 200, chunk_index=j) for j in range(5))
+        conversation = Conversation(agent_id=agents[0].id, title="budget")
+        db.add(conversation)
+        db.flush()
+        db.add_all(Message(conversation_id=conversation.id, role="user" if j % 2 == 0 else "agent", content=f"message {j}") for j in range(messages))
+        db.commit()
+        team_id = db.query(Team.id).filter(Team.user_id == user.id).first()[0]
+        return {"user_id": user.id, "agent_id": agents[0].id, "team_id": team_id, "conversation_id": conversation.id}
+    finally:
+        db.close()
+
+
+def check_endpoints(client: TestClient, ids: dict, headers: dict):
+    for label, method, template, budget in ENDPOINT_BUDGETS:
+        path = template.format(**ids)
+        with query_budget(budget, label=f"{method} {path}") as counter:
+            response = client.request(method, path, headers=headers)
+        if response.status_code >= 400:
+            raise SystemExit(f"{method} {path} returned {response.status_code}: {response.text[:200]}")
+        print(f"  ok  {label:<24} {counter.count}/{budget} queries")
+
+
+def check_helpers(ids: dict):
+    from rag_engine import get_documents_summary
+    from main import QuestionRequest, _load_history
+
+    db = SessionLocal()
+    try:
+        with query_budget(DOCUMENTS_SUMMARY_BUDGET, label="get_documents_summary") as counter:
+            summary = get_documents_summary(ids["user_id"], db)
+        assert summary and all(doc["chunk_count"] == 5 for doc in summary), "unexpected documents summary"
+        print(f"  ok  {'get_documents_summary':<24} {counter.count}/{DOCUMENTS_SUMMARY_BUDGET} queries")
+
+        request = QuestionRequest(question="?", agent_id=ids["agent_id"], conversation_id=ids["conversation_id"])
+        with query_budget(HISTORY_BUDGET, label="/ask history") as counter:
+            history = _load_history(request, db)
+        assert len(history) <= 5, f"history not limited: {len(history)} messages"
+        print(f"  ok  {'/ask history':<24} {counter.count}/{HISTORY_BUDGET} queries")
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQL query budgets of the API read paths")
+    parser.add_argument("--teams", type=int, default=20)
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    import main as api
+
+    ids = seed(args.teams, args.documents, args.messages)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': str(ids['user_id'])})}"}
+    print(f"Database: {engine.url.render_as_string(hide_password=True)}")
+    try:
+        with TestClient(api.app) as client:
+            check_endpoints(client, ids, headers)
+        check_helpers(ids)
+    except QueryBudgetExceeded as e:
+        print(f"FAIL {e}")
+        sys.exit(1)
+    print("All query budgets respected")
+
+
+if __name__ == "__main__":
+    main()